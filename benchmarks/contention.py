@@ -0,0 +1,239 @@
+"""
+Measures contention between subscription readers and preference toggles.
+
+Concurrent reader threads call `is_subscribed` and `filter_not_subscribed` while
+writer threads toggle individual `Unsubscribe` and `Subscription` rows, the way a
+preference page does: check for a row, then delete it or create it, in one
+transaction. Prints the throughput and latency percentiles of each operation, the
+operations that failed on a lock (SQLite's "database is locked", PostgreSQL
+deadlocks and lock timeouts), on PostgreSQL the number of sessions seen waiting on
+a lock, and the duplicate rows the toggles left behind.
+
+On SQLite the test database is a file rather than in memory, so that every thread
+shares it.
+
+Usage:
+
+    DB=postgres python -m benchmarks.contention --readers=8 --writers=2 --duration=30
+    DB=sqlite python -m benchmarks.contention --readers=4 --writers=1
+"""
+import random
+import threading
+import time
+from collections import defaultdict
+from optparse import OptionParser
+
+from settings import configure_settings
+
+
+configure_settings()
+
+from django.db import connection, transaction, OperationalError  # noqa
+from django.db.models import Count  # noqa
+from entity.models import EntityKind, EntityRelationship  # noqa
+
+from benchmarks.database import create_entities, test_database  # noqa
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe  # noqa
+
+
+SQLITE_TEST_NAME = 'entity_subscription_contention.sqlite3'
+
+
+def percentile(timings, fraction):
+    """
+    Returns the nearest-rank percentile of a sorted list of timings.
+    """
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def is_lock_error(error):
+    message = str(error).lower()
+    return any(text in message for text in ('locked', 'deadlock', 'lock timeout', 'could not obtain lock'))
+
+
+def toggle(model, **lookups):
+    """
+    Deletes the rows matching the lookups if there are any, or creates one.
+    """
+    with transaction.atomic():
+        rows = model.objects.filter(**lookups)
+        if rows.exists():
+            rows.delete()
+        else:
+            model.objects.create(**lookups)
+
+
+class Worker(threading.Thread):
+    """
+    Runs randomly chosen operations until a deadline, timing each one.
+    """
+    def __init__(self, operations, deadline, seed):
+        super(Worker, self).__init__()
+        self.operations = operations
+        self.deadline = deadline
+        self.random = random.Random(seed)
+        self.timings = defaultdict(list)
+        self.lock_errors = defaultdict(int)
+
+    def run(self):
+        try:
+            while time.time() < self.deadline:
+                name, operation = self.random.choice(self.operations)
+                start = time.time()
+                try:
+                    operation(self.random)
+                except OperationalError as error:
+                    if not is_lock_error(error):
+                        raise
+                    self.lock_errors[name] += 1
+                else:
+                    self.timings[name].append((time.time() - start) * 1000)
+        finally:
+            connection.close()
+
+
+class LockWaitMonitor(threading.Thread):
+    """
+    Samples the number of PostgreSQL sessions waiting on a lock.
+    """
+    def __init__(self, deadline, interval=0.05):
+        super(LockWaitMonitor, self).__init__()
+        self.deadline = deadline
+        self.interval = interval
+        self.samples = []
+
+    def run(self):
+        try:
+            cursor = connection.cursor()
+            while time.time() < self.deadline:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() "
+                    "AND wait_event_type = 'Lock'"
+                )
+                self.samples.append(cursor.fetchone()[0])
+                time.sleep(self.interval)
+        finally:
+            connection.close()
+
+
+def duplicates(model, fields):
+    """
+    Returns the number of rows beyond the first with the same values of the fields.
+    """
+    groups = model.objects.values(*fields).annotate(rows=Count('id')).filter(rows__gt=1)
+    return sum(group['rows'] - 1 for group in groups)
+
+
+def build_fixture(entity_count, unsubscribed_share):
+    source = Source.objects.create(name='contention', display_name='Contention', description='')
+    medium = Medium.objects.create(name='contention', display_name='Contention', description='')
+    member_kind = EntityKind.objects.create(name='contention_member')
+    group_kind = EntityKind.objects.create(name='contention_group')
+    [group_id] = create_entities(group_kind, 1)
+    member_ids = create_entities(member_kind, entity_count)
+    EntityRelationship.objects.bulk_create([
+        EntityRelationship(super_entity_id=group_id, sub_entity_id=member_id) for member_id in member_ids
+    ])
+    Subscription.objects.create(source=source, medium=medium, entity_id=group_id, subentity_kind=member_kind)
+    Unsubscribe.objects.bulk_create([
+        Unsubscribe(source=source, medium=medium, entity_id=member_id)
+        for member_id in member_ids[:int(entity_count * unsubscribed_share)]
+    ])
+    return source, medium, member_ids
+
+
+def weighted(operations, share):
+    """
+    Returns a list of two operations to choose from uniformly, where the second has the given share.
+    """
+    second_count = int(round(share * 100))
+    return [operations[0]] * (100 - second_count) + [operations[1]] * second_count
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--readers', dest='readers', type=int, default=4)
+    parser.add_option('--writers', dest='writers', type=int, default=1)
+    parser.add_option('--duration', dest='duration', type=float, default=10)
+    parser.add_option('--entities', dest='entities', type=int, default=10000)
+    parser.add_option('--filter-size', dest='filter_size', type=int, default=500,
+                      help='Number of entities given to each filter_not_subscribed call.')
+    parser.add_option('--filter-share', dest='filter_share', type=float, default=0.1,
+                      help='Share of reads that are filter_not_subscribed calls rather than is_subscribed.')
+    parser.add_option('--subscription-share', dest='subscription_share', type=float, default=0.2,
+                      help='Share of writes that toggle a Subscription rather than an Unsubscribe.')
+    parser.add_option('--seed', dest='seed', type=int, default=0)
+    options, args = parser.parse_args()
+
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST_NAME'] = SQLITE_TEST_NAME
+
+    with test_database():
+        source, medium, member_ids = build_fixture(options.entities, 0.1)
+        objects = Subscription.objects
+        filter_size = min(options.filter_size, len(member_ids))
+
+        def check(rand):
+            objects.is_subscribed(source, medium, rand.choice(member_ids))
+
+        def filter_entities(rand):
+            list(objects.filter_not_subscribed(source, medium, rand.sample(member_ids, filter_size)))
+
+        def toggle_unsubscribe(rand):
+            toggle(Unsubscribe, source=source, medium=medium, entity_id=rand.choice(member_ids))
+
+        def toggle_subscription(rand):
+            toggle(Subscription, source=source, medium=medium, entity_id=rand.choice(member_ids), subentity_kind=None)
+
+        reads = weighted([('is_subscribed', check), ('filter_not_subscribed', filter_entities)], options.filter_share)
+        writes = weighted(
+            [('toggle Unsubscribe', toggle_unsubscribe), ('toggle Subscription', toggle_subscription)],
+            options.subscription_share
+        )
+        connection.close()
+
+        deadline = time.time() + options.duration
+        workers = (
+            [Worker(reads, deadline, options.seed + i) for i in range(options.readers)] +
+            [Worker(writes, deadline, options.seed + options.readers + i) for i in range(options.writers)]
+        )
+        monitor = LockWaitMonitor(deadline) if connection.vendor == 'postgresql' else None
+        for thread in workers + ([monitor] if monitor else []):
+            thread.start()
+        for thread in workers + ([monitor] if monitor else []):
+            thread.join()
+
+        report(workers, monitor, options.duration)
+
+
+def report(workers, monitor, duration):
+    timings, lock_errors = defaultdict(list), defaultdict(int)
+    for worker in workers:
+        for name, worker_timings in worker.timings.items():
+            timings[name].extend(worker_timings)
+        for name, count in worker.lock_errors.items():
+            lock_errors[name] += count
+
+    print('{0:>22} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10} {6:>12}'.format(
+        'operation', 'ops/s', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)', 'lock errors'
+    ))
+    for name in sorted(set(timings) | set(lock_errors)):
+        operation_timings = sorted(timings[name]) or [0]
+        print('{0:>22} {1:>10.1f} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>12}'.format(
+            name, len(timings[name]) / duration, percentile(operation_timings, 0.5),
+            percentile(operation_timings, 0.95), percentile(operation_timings, 0.99),
+            operation_timings[-1], lock_errors[name],
+        ))
+
+    if monitor is not None and monitor.samples:
+        print('Sessions waiting on a lock: {0:.2f} on average, {1} at most'.format(
+            float(sum(monitor.samples)) / len(monitor.samples), max(monitor.samples)
+        ))
+    print('Duplicate Subscription rows: {0}'.format(
+        duplicates(Subscription, ['entity', 'source', 'medium', 'subentity_kind'])
+    ))
+    print('Duplicate Unsubscribe rows: {0}'.format(duplicates(Unsubscribe, ['entity', 'source', 'medium'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Helpers for running benchmarks against a throwaway test database.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """
+    Creates the test database for the configured backend, and destroys it afterwards.
+    """
+    if 'south' in settings.INSTALLED_APPS:
+        from south.management.commands import patch_for_test_db_setup
+        patch_for_test_db_setup()
+
+    old_name = settings.DATABASES['default']['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+def create_entities(entity_kind, count):
+    """
+    Bulk creates `count` entities of a kind and returns their ids.
+    """
+    from django.contrib.contenttypes.models import ContentType
+    from entity.models import Entity
+
+    content_type = ContentType.objects.get_for_model(Entity)
+    first_entity_id = (Entity.objects.order_by('-entity_id').values_list('entity_id', flat=True)[:1] or [0])[0] + 1
+    Entity.objects.bulk_create([
+        Entity(entity_type=content_type, entity_id=first_entity_id + i, entity_kind=entity_kind)
+        for i in range(count)
+    ])
+    return list(Entity.objects.filter(
+        entity_type=content_type, entity_kind=entity_kind, entity_id__gte=first_entity_id
+    ).order_by('id').values_list('id', flat=True))
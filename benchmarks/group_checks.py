@@ -0,0 +1,79 @@
+"""
+Measures how the latency of group subscription checks changes with group size.
+
+For each group size, a super-entity with that many sub-entities is created. One
+member also belongs to a second group which holds the only matching group
+subscription, so a hit has to find that one member. Prints the median latency of
+`is_subscribed` and `mediums_subscribed` with a `subentity_kind`, for a hit and
+for a miss.
+
+Usage:
+
+    DB=postgres python -m benchmarks.group_checks --sizes=100,1000,10000,100000
+"""
+import time
+from optparse import OptionParser
+
+from settings import configure_settings
+
+
+configure_settings()
+
+from entity.models import Entity, EntityKind, EntityRelationship  # noqa
+
+from benchmarks.database import create_entities, test_database  # noqa
+from entity_subscription.models import Medium, Source, Subscription  # noqa
+
+
+def median_ms(func, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        timings.append((time.time() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def build_group(size, source, medium):
+    member_kind = EntityKind.objects.create(name='member_{0}'.format(size))
+    group_kind = EntityKind.objects.create(name='group_{0}'.format(size))
+    group_id, other_group_id = create_entities(group_kind, 2)
+    member_ids = create_entities(member_kind, size)
+    EntityRelationship.objects.bulk_create(
+        [EntityRelationship(super_entity_id=group_id, sub_entity_id=member_id) for member_id in member_ids] +
+        [EntityRelationship(super_entity_id=other_group_id, sub_entity_id=member_ids[-1])]
+    )
+    Subscription.objects.create(source=source, medium=medium, entity_id=other_group_id, subentity_kind=member_kind)
+    return group_id, member_kind
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--sizes', dest='sizes', default='100,1000,10000')
+    parser.add_option('--repeat', dest='repeat', type=int, default=21)
+    options, args = parser.parse_args()
+
+    with test_database():
+        source = Source.objects.create(name='benchmark', display_name='Benchmark', description='')
+        other_source = Source.objects.create(name='other', display_name='Other', description='')
+        medium = Medium.objects.create(name='benchmark', display_name='Benchmark', description='')
+
+        print('{0:>10} {1:>16} {2:>16} {3:>16} {4:>16}'.format(
+            'group size', 'is_subscribed', 'is_subscribed', 'mediums', 'mediums'
+        ))
+        print('{0:>10} {1:>16} {2:>16} {3:>16} {4:>16}'.format('', 'hit (ms)', 'miss (ms)', 'hit (ms)', 'miss (ms)'))
+        for size in [int(size) for size in options.sizes.split(',')]:
+            group_id, member_kind = build_group(size, source, medium)
+            objects = Subscription.objects
+            repeat = options.repeat
+            print('{0:>10} {1:>16.2f} {2:>16.2f} {3:>16.2f} {4:>16.2f}'.format(
+                size,
+                median_ms(lambda: objects.is_subscribed(source, medium, group_id, member_kind), repeat),
+                median_ms(lambda: objects.is_subscribed(other_source, medium, group_id, member_kind), repeat),
+                median_ms(lambda: list(objects.mediums_subscribed(source, group_id, member_kind)), repeat),
+                median_ms(lambda: list(objects.mediums_subscribed(other_source, group_id, member_kind)), repeat),
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Deferred, batched resolution of individual subscription checks.
+
+Inside a `subscription_batch` scope, `Subscription.objects.is_subscribed`
+and `Subscription.objects.mediums_subscribed` (for individual
+entities) return lazy results instead of querying immediately. Every
+check registered in the scope is resolved together, with a fixed
+number of set-based queries, the first time any result is evaluated.
+"""
+import threading
+from contextlib import contextmanager
+
+from entity_subscription.utils import get_id
+
+
+_local = threading.local()
+
+
+def current_batch():
+    """Return the innermost active `SubscriptionBatch`, or None.
+    """
+    stack = getattr(_local, 'batches', None)
+    return stack[-1] if stack else None
+
+
+def _push_batch(batch):
+    if not hasattr(_local, 'batches'):
+        _local.batches = []
+    _local.batches.append(batch)
+
+
+def _pop_batch(batch):
+    """Remove a batch from the stack, wherever it is.
+    """
+    _local.batches.remove(batch)
+
+
+@contextmanager
+def subscription_batch():
+    """Defer individual subscription checks made inside this scope.
+
+    Yields the `SubscriptionBatch` collecting the checks. Results
+    created inside the scope stay usable after it exits.
+    """
+    batch = SubscriptionBatch()
+    _push_batch(batch)
+    try:
+        yield batch
+    finally:
+        _pop_batch(batch)
+
+
+class SubscriptionBatchMiddleware(object):
+    """Wrap every request in a `subscription_batch` scope.
+
+    The batch pushed for a request is kept on the request, so that
+    only that batch is removed when the request ends.
+    """
+    def process_request(self, request):
+        request._subscription_batch = SubscriptionBatch()
+        _push_batch(request._subscription_batch)
+
+    def process_response(self, request, response):
+        self._end_batch(request)
+        return response
+
+    def process_exception(self, request, exception):
+        self._end_batch(request)
+
+    def _end_batch(self, request):
+        batch = getattr(request, '_subscription_batch', None)
+        if batch is not None:
+            _pop_batch(batch)
+            del request._subscription_batch
+
+
+class SubscriptionBatch(object):
+    """A collection of pending individual subscription checks.
+
+    Checks are keyed by (entity, source). Pending keys are resolved
+    all at once; results are kept for the lifetime of the batch, so
+    they reflect the database state at the moment of resolution.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._subscribed = {}
+        self._mediums = {}
+
+    def is_subscribed(self, source, medium, entity):
+        """Return a lazy boolean for an individual subscription check.
+        """
+        self._register(source, entity)
+        return LazySubscribed(self, get_id(source), get_id(medium), get_id(entity))
+
+    def mediums_subscribed(self, source, entity, ids=False):
+        """Return a lazy collection of the mediums an entity is subscribed to.
+
+        With `ids`, the collection is of medium ids rather than
+        `Medium` objects.
+        """
+        self._register(source, entity)
+        return LazyMediums(self, get_id(source), get_id(entity), ids)
+
+    def resolve(self):
+        """Resolve every pending check with a fixed number of queries.
+        """
+        if not self._pending:
+            return
+        from entity_subscription.models import Subscription
+
+        entities = dict((get_id(entity), entity) for entity, source_id in self._pending.values())
+        source_ids = set(source_id for entity, source_id in self._pending.values())
+        keys = Subscription.objects._effective_subscriptions(entities.values(), source_ids)
+        for key in self._pending:
+            self._subscribed[key] = set()
+        for entity_id, source_id, medium_id in keys:
+            if (entity_id, source_id) in self._pending:
+                self._subscribed[(entity_id, source_id)].add(medium_id)
+        self._pending = {}
+
+    def _register(self, source, entity):
+        key = (get_id(entity), get_id(source))
+        if key not in self._subscribed:
+            self._pending[key] = (entity, get_id(source))
+
+    def _medium_ids(self, source_id, entity_id):
+        key = (entity_id, source_id)
+        if key not in self._subscribed:
+            self.resolve()
+        return self._subscribed[key]
+
+    def _medium_objects(self, medium_ids):
+        """Return the `Medium` objects of some ids.
+
+        The mediums of every resolved check are fetched together, the
+        first time any of them is needed.
+        """
+        missing = set().union(*self._subscribed.values()) - set(self._mediums)
+        if missing:
+            from entity_subscription.models import Medium
+
+            self._mediums.update(Medium.objects.in_bulk(missing))
+        return [self._mediums[medium_id] for medium_id in medium_ids]
+
+
+class LazySubscribed(object):
+    """A boolean subscription result resolved on first evaluation.
+    """
+    def __init__(self, batch, source_id, medium_id, entity_id):
+        self._batch = batch
+        self._source_id = source_id
+        self._medium_id = medium_id
+        self._entity_id = entity_id
+
+    @property
+    def value(self):
+        return self._medium_id in self._batch._medium_ids(self._source_id, self._entity_id)
+
+    def __nonzero__(self):
+        return self.value
+
+    __bool__ = __nonzero__
+
+    def __eq__(self, other):
+        return self.value == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+class LazyMediums(object):
+    """A collection of subscribed mediums, or medium ids, resolved on first evaluation.
+    """
+    def __init__(self, batch, source_id, entity_id, ids=False):
+        self._batch = batch
+        self._source_id = source_id
+        self._entity_id = entity_id
+        self._ids = ids
+
+    @property
+    def value(self):
+        medium_ids = self._batch._medium_ids(self._source_id, self._entity_id)
+        if self._ids:
+            return frozenset(medium_ids)
+        return self._batch._medium_objects(sorted(medium_ids))
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __contains__(self, medium):
+        return get_id(medium) in self._batch._medium_ids(self._source_id, self._entity_id)
+
+    def __nonzero__(self):
+        return bool(self._batch._medium_ids(self._source_id, self._entity_id))
+
+    __bool__ = __nonzero__
+
+    def __repr__(self):
+        return repr(self.value)
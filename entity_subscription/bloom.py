@@ -0,0 +1,216 @@
+"""An optional in-process negative cache for `Unsubscribe` lookups.
+
+Most entities never unsubscribe from anything, yet every individual
+subscription check queries the `Unsubscribe` table. When enabled, the
+`UnsubscribeFilter` keeps a Bloom filter over the (entity, source,
+medium) keys of that table, so checks for keys it definitely does not
+contain skip the `Unsubscribe` query entirely.
+
+A Bloom filter never reports a false negative for keys it has seen,
+but it only sees the rows present when it was built and those saved
+through this process afterwards. Deployments with several processes
+writing `Unsubscribe` rows must call `rebuild` often enough to pick up
+rows saved elsewhere.
+"""
+import hashlib
+import math
+import struct
+import threading
+
+from django.db.models.signals import post_save
+
+from entity_subscription.signals import preferences_changed
+from entity_subscription.utils import get_id
+
+
+class BloomFilter(object):
+    """A fixed-size Bloom filter sized for a capacity and error rate.
+
+    Args:
+
+      capacity - The number of keys the filter is expected to hold.
+
+      error_rate - The false positive rate wanted once the filter
+      holds `capacity` keys.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(float(self.num_bits) / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self):
+        """The memory used by the bit array, in bytes.
+        """
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self):
+        """The expected false positive rate for the keys added so far.
+        """
+        return (1 - math.exp(-float(self.num_hashes) * self.count / self.num_bits)) ** self.num_hashes
+
+    def add(self, key):
+        """Add a key. `count` only grows for keys not already in the filter.
+
+        Keys that were already contained, including false positives,
+        set no new bits and so do not change the false positive rate.
+        """
+        positions = self._positions(key)
+        with self._lock:
+            new = False
+            for position in positions:
+                byte, bit = position // 8, 1 << (position % 8)
+                if not self.bits[byte] & bit:
+                    self.bits[byte] |= bit
+                    new = True
+            if new:
+                self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+    def _positions(self, key):
+        digest = hashlib.md5(':'.join(str(part) for part in key).encode('utf-8')).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+
+class UnsubscribeFilter(object):
+    """A Bloom filter over the keys of the `Unsubscribe` table.
+
+    Every row is added under three keys: its (entity, source, medium),
+    its (entity, source) and its entity, so checks for any medium or
+    any source can be answered too. Null sources and mediums, which
+    opt out of every source or medium, are stored as None.
+
+    Args:
+
+      capacity - The number of `Unsubscribe` rows the filter is
+      expected to hold. The Bloom filter is sized for three keys per
+      row.
+
+      error_rate - The false positive rate wanted once the filter
+      holds `capacity` rows.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom_filter = self._new_bloom_filter()
+        self._rebuilding = None
+
+    @property
+    def size_bytes(self):
+        return self.bloom_filter.size_bytes
+
+    @property
+    def false_positive_rate(self):
+        return self.bloom_filter.false_positive_rate
+
+    def rebuild(self):
+        """Rebuild the filter from the rows currently in the database.
+        """
+        from entity_subscription.models import Unsubscribe
+
+        bloom_filter = self._new_bloom_filter()
+        self._rebuilding = bloom_filter
+        rows = Unsubscribe.objects.values_list('entity', 'source', 'medium').order_by()
+        for key in rows.iterator():
+            _add_keys(bloom_filter, key)
+        self.bloom_filter = bloom_filter
+        self._rebuilding = None
+
+    def add(self, entity, source, medium):
+        # Rows saved during a rebuild go to both filters, so they are
+        # not lost when the rebuilt filter replaces the current one.
+        for bloom_filter in set([self.bloom_filter, self._rebuilding]) - set([None]):
+            _add_keys(bloom_filter, (get_id(entity), get_id(source), get_id(medium)))
+
+    def might_be_unsubscribed(self, entity, source=None, medium=None):
+        """Return False only if the entity is definitely not unsubscribed.
+
+        With no source, checks for an unsubscription from anything.
+        With no medium, checks for an unsubscription from any medium
+        of the source.
+        """
+        entity_id, source_id, medium_id = get_id(entity), get_id(source), get_id(medium)
+        if source_id is None:
+            keys = [('entity', entity_id)]
+        elif medium_id is None:
+            keys = [('source', entity_id, source_id), ('source', entity_id, None)]
+        else:
+            keys = [
+                ('row', entity_id, key_source_id, key_medium_id)
+                for key_source_id in (source_id, None) for key_medium_id in (medium_id, None)
+            ]
+        return any(key in self.bloom_filter for key in keys)
+
+    def _new_bloom_filter(self):
+        return BloomFilter(self.capacity * KEYS_PER_ROW, self.error_rate)
+
+
+KEYS_PER_ROW = 3
+
+
+def _add_keys(bloom_filter, row):
+    entity_id, source_id, medium_id = row
+    bloom_filter.add(('row', entity_id, source_id, medium_id))
+    bloom_filter.add(('source', entity_id, source_id))
+    bloom_filter.add(('entity', entity_id))
+
+
+_unsubscribe_filter = None
+_building_filter = None
+
+
+def get_unsubscribe_filter():
+    """Return the enabled `UnsubscribeFilter`, or None.
+    """
+    return _unsubscribe_filter
+
+
+def enable_unsubscribe_filter(capacity, error_rate=0.01):
+    """Build an `UnsubscribeFilter` and use it for subscription checks.
+
+    Newly saved `Unsubscribe` rows are added to the filter as they are
+    saved, including by `set_preferences`. Deleted rows remain in the
+    filter, which only costs an unnecessary query, until the next
+    `rebuild`.
+    """
+    global _unsubscribe_filter, _building_filter
+    from entity_subscription.models import Unsubscribe
+
+    _building_filter = UnsubscribeFilter(capacity, error_rate)
+    post_save.connect(_add_unsubscribe, sender=Unsubscribe, dispatch_uid='entity_subscription_unsubscribe_filter')
+    preferences_changed.connect(
+        _add_unsubscribes, sender=Unsubscribe, dispatch_uid='entity_subscription_unsubscribe_filter'
+    )
+    _building_filter.rebuild()
+    _unsubscribe_filter, _building_filter = _building_filter, None
+    return _unsubscribe_filter
+
+
+def disable_unsubscribe_filter():
+    global _unsubscribe_filter, _building_filter
+    from entity_subscription.models import Unsubscribe
+
+    post_save.disconnect(sender=Unsubscribe, dispatch_uid='entity_subscription_unsubscribe_filter')
+    preferences_changed.disconnect(sender=Unsubscribe, dispatch_uid='entity_subscription_unsubscribe_filter')
+    _unsubscribe_filter = None
+    _building_filter = None
+
+
+def _add_unsubscribe(sender, instance, **kwargs):
+    for unsubscribe_filter in (_unsubscribe_filter, _building_filter):
+        if unsubscribe_filter is not None:
+            unsubscribe_filter.add(instance.entity_id, instance.source_id, instance.medium_id)
+
+
+def _add_unsubscribes(sender, entity, added, **kwargs):
+    for unsubscribe_filter in (_unsubscribe_filter, _building_filter):
+        if unsubscribe_filter is not None:
+            for source_id, medium_id in added:
+                unsubscribe_filter.add(entity, source_id, medium_id)
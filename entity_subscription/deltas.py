@@ -0,0 +1,109 @@
+"""Find who a subscription or entity relationship change affects.
+
+Adding or deleting a `Subscription`, or an `EntityRelationship`
+joining a sub-entity to a super-entity, changes the effective
+subscriptions of some entities. The functions here return exactly
+which, so that audience caches can be patched rather than rebuilt.
+
+The changed row is passed as an instance, and the change may be
+pending or already applied: the row itself is left out of the
+queries, and its effect worked out from its fields. An update of a
+row is the deletion of its old values and the addition of its new
+ones.
+"""
+from collections import namedtuple
+
+from django.db.models import Q
+from entity.models import Entity, EntityRelationship
+
+from entity_subscription.models import Subscription, Unsubscribe, _matches_any, _Wildcards
+from entity_subscription.utils import id_chunks, id_list, subquery
+
+
+class AudienceDelta(namedtuple('AudienceDelta', ['gained', 'lost'])):
+    """The entities whose effective subscription a change adds or removes.
+
+    Both `gained` and `lost` are dictionaries mapping (source id,
+    medium id) pairs to sets of entity ids. Pairs without any entity
+    are left out. Wildcard subscriptions are expanded into every pair
+    they apply to.
+    """
+
+
+def subscription_delta(subscription, deleted=False):
+    """Return the `AudienceDelta` of adding, or deleting, a subscription.
+
+    An entity gains, or loses, a source and medium when no other
+    subscription covers it and it is not unsubscribed from it.
+    """
+    if subscription.subentity_kind_id is None:
+        entity_ids = [subscription.entity_id]
+    else:
+        entity_ids = list(EntityRelationship.objects.filter(
+            super_entity=subscription.entity_id, sub_entity__entity_kind=subscription.subentity_kind_id
+        ).values_list('sub_entity', flat=True))
+    pairs = set(_Wildcards().expand(subscription.source_id, subscription.medium_id))
+    changed = _uncovered_keys(entity_ids, pairs, subscriptions=_excluding(Subscription, subscription))
+    return _delta(changed, deleted)
+
+
+def relationship_delta(relationship, deleted=False):
+    """Return the `AudienceDelta` of adding, or deleting, an entity relationship.
+
+    The sub-entity gains, or loses, every source and medium the group
+    subscriptions of the super-entity to its kind cover, unless it is
+    subscribed to them otherwise or unsubscribed from them.
+    """
+    group_subscriptions = Subscription.objects.filter(
+        entity=relationship.super_entity_id,
+        subentity_kind__in=subquery(
+            Entity.objects.filter(id=relationship.sub_entity_id).values_list('entity_kind', flat=True)
+        ),
+    ).values_list('source', 'medium')
+    wildcards = _Wildcards()
+    pairs = set()
+    for source_id, medium_id in group_subscriptions:
+        pairs.update(wildcards.expand(source_id, medium_id))
+    changed = _uncovered_keys(
+        [relationship.sub_entity_id], pairs, relationships=_excluding(EntityRelationship, relationship)
+    )
+    return _delta(changed, deleted)
+
+
+def _uncovered_keys(entity_ids, pairs, subscriptions=None, relationships=None):
+    """Return the (entity, source, medium) keys not already subscribed to, nor unsubscribed from.
+
+    Unsubscribes are read in chunks of entities on backends that can
+    not bind an id list as one parameter.
+    """
+    if not entity_ids or not pairs:
+        return set()
+    source_ids = set(source_id for source_id, _ in pairs)
+    entity_ids, _, subscribed = Subscription.objects._subscription_keys(
+        entity_ids, source_ids, subscriptions=subscriptions, relationships=relationships
+    )
+    unsubscribed = set()
+    for chunk in id_chunks(entity_ids, Unsubscribe):
+        unsubscribed.update(Unsubscribe.objects.filter(
+            Q(source__in=source_ids) | Q(source__isnull=True), entity__id__in=id_list(chunk, Unsubscribe)
+        ).values_list('entity', 'source', 'medium'))
+    return set(
+        (entity_id, source_id, medium_id)
+        for entity_id in entity_ids for source_id, medium_id in pairs
+        if (entity_id, source_id, medium_id) not in subscribed and
+        not _matches_any((entity_id, source_id, medium_id), unsubscribed)
+    )
+
+
+def _delta(keys, deleted):
+    changed = {}
+    for entity_id, source_id, medium_id in keys:
+        changed.setdefault((source_id, medium_id), set()).add(entity_id)
+    return AudienceDelta({}, changed) if deleted else AudienceDelta(changed, {})
+
+
+def _excluding(model, instance):
+    """Return every row of a model but the instance, if it is saved.
+    """
+    rows = model.objects.all()
+    return rows if instance.pk is None else rows.exclude(pk=instance.pk)
@@ -0,0 +1,154 @@
+"""Sampled capture of slow subscription queries, with their query plans.
+
+With the `ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE` setting above
+zero, that fraction of calls to the subscription manager methods
+records the queries they run. Every query slower than
+`ENTITY_SUBSCRIPTION_SLOW_QUERY_MS` milliseconds (100 by default) is
+logged as a warning on the `entity_subscription.slow_queries` logger,
+with the method name, its arguments and the plan of the query,
+explained on the spot: EXPLAIN ANALYZE on PostgreSQL, EXPLAIN QUERY
+PLAN on SQLite.
+
+Calls that are not sampled only pay for a random number. In sampled
+calls, querysets returned by the methods are evaluated before
+returning, so the queries they run are captured too; iterating the
+result afterwards does not query again.
+"""
+import functools
+import inspect
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.backends.util import CursorWrapper
+from django.db.models.query import QuerySet
+
+from entity_subscription.utils import get_id, subscription_connection as connection
+
+
+logger = logging.getLogger('entity_subscription.slow_queries')
+
+
+def sample_rate():
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE', 0)
+
+
+def threshold_ms():
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_SLOW_QUERY_MS', 100)
+
+
+def diagnosed(method):
+    """Capture the slow queries of a sample of calls to a manager method.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        rate = sample_rate()
+        if not rate or random.random() >= rate:
+            return method(self, *args, **kwargs)
+
+        arguments = inspect.getcallargs(method, self, *args, **kwargs)
+        arguments.pop('self')
+        queries = []
+        with _recording_queries(queries):
+            result = method(self, *args, **kwargs)
+            if isinstance(result, QuerySet):
+                len(result)
+        for sql, params, duration_ms in queries:
+            if duration_ms >= threshold_ms():
+                _log_slow_query(method.__name__, arguments, sql, params, duration_ms)
+        return result
+    return wrapper
+
+
+def explain(sql, params=None):
+    """Return the plan of a query as text, or the error explaining it raised.
+
+    On PostgreSQL the query is run by EXPLAIN ANALYZE, within a
+    savepoint, so the plan includes actual row counts and timings.
+    """
+    if connection.vendor == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    elif connection.vendor == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+    try:
+        with transaction.atomic(using=connection.alias):
+            cursor = connection.cursor()
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as e:
+        return 'EXPLAIN failed: {0}'.format(e)
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+
+class _RecordingCursor(object):
+    """Wraps a cursor, appending the (sql, params, milliseconds) of every query to a list.
+    """
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.queries.append((sql, params, (time.time() - start) * 1000))
+
+
+class _recording_queries(object):
+    """Record the queries run on the subscription database into a list.
+
+    Cursors created meanwhile are wrapped in a `_RecordingCursor`.
+    Queries keep being logged to `connection.queries` if they already
+    were, as with DEBUG on.
+    """
+    def __init__(self, queries):
+        self.queries = queries
+
+    def __enter__(self):
+        self.use_debug_cursor = connection.use_debug_cursor
+        already_recording = self.use_debug_cursor or (self.use_debug_cursor is None and settings.DEBUG)
+        original_make_debug_cursor = connection.make_debug_cursor
+
+        def make_debug_cursor(cursor):
+            if already_recording:
+                cursor = original_make_debug_cursor(cursor)
+            else:
+                cursor = CursorWrapper(cursor, connection)
+            return _RecordingCursor(cursor, self.queries)
+
+        connection.make_debug_cursor = make_debug_cursor
+        connection.use_debug_cursor = True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        connection.use_debug_cursor = self.use_debug_cursor
+        del connection.make_debug_cursor
+
+
+def _log_slow_query(method_name, arguments, sql, params, duration_ms):
+    arguments = dict((name, _describe(value)) for name, value in arguments.items())
+    plan = explain(sql, params)
+    logger.warning(
+        'Slow subscription query in %s (%.1f ms), arguments %s:\n%s\nparams %s\n%s',
+        method_name, duration_ms, arguments, sql, params, plan,
+        extra={
+            'method': method_name, 'arguments': arguments, 'sql': sql, 'params': params,
+            'duration_ms': duration_ms, 'plan': plan,
+        },
+    )
+
+
+def _describe(value, limit=10):
+    """Return model instances as ids, and lists of them as their first ids and a count.
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        ids = [get_id(item) for item in list(value)[:limit]]
+        return ids if len(value) <= limit else '{0} ... ({1} in total)'.format(ids, len(value))
+    return get_id(value)
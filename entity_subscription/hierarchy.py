@@ -0,0 +1,173 @@
+"""An optional cache of each entity's kind and super-entities.
+
+Every individual subscription check needs the super-entities of the
+entity checked, to find the group subscriptions that apply to it, and
+otherwise joins the relationship table on every call. Memberships
+change far less often than they are read, so when enabled, the
+`HierarchyCache` keeps the kind and super-entity ids of recently
+checked entities in process, with least recently used entries evicted,
+and optionally in one of Django's caches shared between processes.
+
+Entries are invalidated from the `post_save` and `post_delete` signals
+of `Entity` and `EntityRelationship`. The entries held in process are
+all dropped on the `post_bulk_operation` signal of django-manager-utils
+for either model, which `sync_entities` sends when it writes
+relationships in bulk. Other changes that send no signal, such as raw
+SQL, and changes made by other processes to entries held in process,
+are only picked up once entries expire or the cache is cleared.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import get_cache
+from django.db.models.signals import post_delete, post_save
+from entity.models import Entity, EntityRelationship
+from manager_utils import post_bulk_operation
+
+from entity_subscription.utils import get_id
+
+
+class HierarchyCache(object):
+    """The kind and super-entity ids of entities, by entity id.
+
+    Args:
+
+      max_entries - The number of entities kept in process. With 0,
+      nothing is kept in process.
+
+      cache - (Optional) A Django cache backend to share entries
+      between processes.
+
+      timeout - The number of seconds entries are kept, or None to
+      keep them until they are invalidated or evicted.
+
+      prefix - Prepended to the keys of entries in the Django cache.
+    """
+    def __init__(self, max_entries=10000, cache=None, timeout=300, prefix='entity_subscription_hierarchy'):
+        self.max_entries = max_entries
+        self.cache = cache
+        self.timeout = timeout
+        self.prefix = prefix
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, entity_id):
+        return '{0}:{1}'.format(self.prefix, entity_id)
+
+    def get(self, entity):
+        """Return the kind id and the super-entity ids of an entity.
+
+        An entity that does not exist has a None kind and no
+        super-entities.
+        """
+        entity_id = get_id(entity)
+        hierarchy = self._get_local(entity_id)
+        if hierarchy is None and self.cache is not None:
+            hierarchy = self.cache.get(self.key(entity_id))
+            if hierarchy is not None:
+                self._set_local(entity_id, hierarchy)
+        if hierarchy is None:
+            hierarchy = _load(entity_id)
+            self._set_local(entity_id, hierarchy)
+            if self.cache is not None:
+                self.cache.set(self.key(entity_id), hierarchy, self.timeout)
+        return hierarchy
+
+    def invalidate(self, entity_ids):
+        entity_ids = [get_id(entity) for entity in entity_ids]
+        with self._lock:
+            for entity_id in entity_ids:
+                self._entries.pop(entity_id, None)
+        if self.cache is not None:
+            self.cache.delete_many([self.key(entity_id) for entity_id in entity_ids])
+
+    def clear(self):
+        """Drop the entries kept in process. Entries in the Django cache expire on their own.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_local(self, entity_id):
+        with self._lock:
+            entry = self._entries.pop(entity_id, None)
+            if entry is None or (entry[0] is not None and entry[0] < time.time()):
+                return None
+            self._entries[entity_id] = entry
+            return entry[1]
+
+    def _set_local(self, entity_id, hierarchy):
+        if not self.max_entries:
+            return
+        expires = None if self.timeout is None else time.time() + self.timeout
+        with self._lock:
+            self._entries.pop(entity_id, None)
+            self._entries[entity_id] = (expires, hierarchy)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _load(entity_id):
+    """Fetch the kind and super-entity ids of an entity with one query.
+    """
+    rows = list(Entity.objects.filter(id=entity_id).values_list('entity_kind', 'super_relationships__super_entity'))
+    entity_kind_id = rows[0][0] if rows else None
+    return entity_kind_id, tuple(sorted(set(row[1] for row in rows if row[1] is not None)))
+
+
+_hierarchy_cache = None
+
+
+def get_hierarchy_cache():
+    """Return the enabled `HierarchyCache`, or None.
+    """
+    return _hierarchy_cache
+
+
+def enable_hierarchy_cache(max_entries=10000, cache_alias=None, timeout=300):
+    """Create a `HierarchyCache` and use it for individual subscription checks.
+
+    Args:
+
+      max_entries - The number of entities kept in process.
+
+      cache_alias - (Optional) The alias of a Django cache in which to
+      share entries between processes.
+
+      timeout - The number of seconds entries are kept, or None.
+    """
+    global _hierarchy_cache
+
+    cache = None if cache_alias is None else get_cache(cache_alias)
+    _hierarchy_cache = HierarchyCache(max_entries, cache, timeout)
+    for signal in (post_save, post_delete):
+        signal.connect(_entity_changed, sender=Entity, dispatch_uid='entity_subscription_hierarchy')
+        signal.connect(_relationship_changed, sender=EntityRelationship, dispatch_uid='entity_subscription_hierarchy')
+    post_bulk_operation.connect(_bulk_operation, dispatch_uid='entity_subscription_hierarchy')
+    return _hierarchy_cache
+
+
+def disable_hierarchy_cache():
+    global _hierarchy_cache
+
+    for signal in (post_save, post_delete):
+        for sender in (Entity, EntityRelationship):
+            signal.disconnect(sender=sender, dispatch_uid='entity_subscription_hierarchy')
+    post_bulk_operation.disconnect(dispatch_uid='entity_subscription_hierarchy')
+    _hierarchy_cache = None
+
+
+def _entity_changed(sender, instance, **kwargs):
+    _hierarchy_cache.invalidate([instance.id])
+
+
+def _relationship_changed(sender, instance, **kwargs):
+    _hierarchy_cache.invalidate([instance.sub_entity_id])
+
+
+def _bulk_operation(sender, model, **kwargs):
+    if model in (Entity, EntityRelationship):
+        _hierarchy_cache.clear()
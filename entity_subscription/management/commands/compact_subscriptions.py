@@ -0,0 +1,35 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from entity_subscription import redundancy
+from entity_subscription.models import Subscription, Unsubscribe
+
+
+class Command(BaseCommand):
+    help = (
+        'Report Subscription and Unsubscribe rows that do not change any effective subscription, '
+        'and optionally delete them in small batches.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--delete', action='store_true', dest='delete', default=False,
+                    help='Delete the redundant rows instead of only reporting them.'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+                    help='Number of rows deleted per transaction.'),
+        make_option('--sleep', action='store', type='float', dest='sleep', default=0,
+                    help='Seconds to pause between delete batches.'),
+    )
+
+    def handle(self, *args, **options):
+        categories = [
+            ('duplicate subscriptions', Subscription, redundancy.duplicate_subscription_ids),
+            ('duplicate unsubscribes', Unsubscribe, redundancy.duplicate_unsubscribe_ids),
+            ('subscriptions covered by a group subscription', Subscription, redundancy.covered_subscription_ids),
+            ('unsubscribes from unsubscribed combinations', Unsubscribe, redundancy.unneeded_unsubscribe_ids),
+        ]
+        for name, model, find_ids in categories:
+            ids = list(find_ids())
+            self.stdout.write('{0}: {1}'.format(name, len(ids)))
+            if options['delete'] and ids:
+                deleted = redundancy.delete_in_batches(model, ids, options['batch_size'], options['sleep'])
+                self.stdout.write('  deleted {0}'.format(deleted))
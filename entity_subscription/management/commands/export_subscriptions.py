@@ -0,0 +1,38 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription.transfer import export_effective, export_rows, open_csv, transfer_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Write every Subscription or Unsubscribe row, or every effective subscription, as CSV. '
+        'Uses COPY on PostgreSQL.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='store', dest='model', default='subscription',
+                    help='The rows to export: "subscription" (the default) or "unsubscribe".'),
+        make_option('--effective', action='store_true', dest='effective', default=False,
+                    help='Export the effective subscription of every entity instead of raw rows.'),
+        make_option('--output', action='store', dest='output', default='-',
+                    help='Path of the file to write. Defaults to standard output.'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=1000,
+                    help='Number of entities resolved per batch of queries, with --effective.'),
+    )
+
+    def handle(self, *args, **options):
+        model = transfer_models().get(options['model'])
+        if model is None:
+            raise CommandError('Unknown model "{0}".'.format(options['model']))
+        # The rows go to the wrapped stream, since the command's own
+        # output wrapper would end every write with a newline.
+        output = self.stdout._out if options['output'] == '-' else open_csv(options['output'], 'w')
+        try:
+            if options['effective']:
+                export_effective(output, chunk_size=options['chunk_size'])
+            else:
+                export_rows(model, output)
+        finally:
+            if output is not self.stdout._out:
+                output.close()
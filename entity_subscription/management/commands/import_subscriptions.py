@@ -0,0 +1,38 @@
+from optparse import make_option
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription.transfer import import_rows, open_csv, transfer_models
+
+
+class Command(BaseCommand):
+    args = '<path>'
+    help = (
+        'Load Subscription or Unsubscribe rows from a CSV file, as written by export_subscriptions. '
+        'Uses COPY on PostgreSQL. Model signals are not sent.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='store', dest='model', default='subscription',
+                    help='The rows to import: "subscription" (the default) or "unsubscribe".'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=10000,
+                    help='Number of rows validated and written at a time.'),
+        make_option('--replace', action='store_true', dest='replace', default=False,
+                    help='Delete every existing row of the model first.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of one CSV file, or "-" for standard input.')
+        model = transfer_models().get(options['model'])
+        if model is None:
+            raise CommandError('Unknown model "{0}".'.format(options['model']))
+        input = sys.stdin if args[0] == '-' else open_csv(args[0])
+        try:
+            loaded = import_rows(model, input, batch_size=options['batch_size'], replace=options['replace'])
+        except ValueError as error:
+            raise CommandError(error.args[0])
+        finally:
+            if input is not sys.stdin:
+                input.close()
+        self.stdout.write('Imported {0} rows.'.format(loaded))
@@ -0,0 +1,20 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription.mirror import get_mirror
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Redis mirror of effective subscriptions from the database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=1000,
+                    help='Number of entities resolved per batch of queries.'),
+    )
+
+    def handle(self, *args, **options):
+        mirror = get_mirror()
+        if mirror is None:
+            raise CommandError('ENTITY_SUBSCRIPTION_REDIS_URL is not set.')
+        mirror.rebuild(chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt the subscription mirror.')
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from entity_subscription import partitioning
+from entity_subscription.utils import subscription_connection as connection
+
+
+class Command(BaseCommand):
+    help = (
+        'Report the per-source partitions of the Subscription and Unsubscribe tables on PostgreSQL, '
+        'and optionally convert the tables or create missing partitions.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--convert', action='store_true', dest='convert', default=False,
+                    help='Convert tables that are not partitioned yet. Locks each table while its rows are copied.'),
+        make_option('--create-missing', action='store_true', dest='create_missing', default=False,
+                    help='Create the partitions of sources without one.'),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning subscription tables requires PostgreSQL.')
+
+        for model in partitioning.partitioned_models():
+            table = model._meta.db_table
+            if options['convert'] and partitioning.partition_table(model):
+                self.stdout.write('{0}: converted'.format(table))
+            if not partitioning.is_partitioned(model):
+                self.stdout.write('{0}: not partitioned'.format(table))
+                continue
+            if options['create_missing']:
+                source_ids = partitioning.create_missing_partitions(model)
+                self.stdout.write('{0}: created {1} partitions'.format(table, len(source_ids)))
+            else:
+                source_ids = partitioning.missing_source_ids(model)
+                self.stdout.write('{0}: {1} sources without a partition'.format(table, len(source_ids)))
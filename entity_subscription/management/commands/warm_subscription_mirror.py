@@ -0,0 +1,54 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from entity.models import EntityKind
+
+from entity_subscription.mirror import get_mirror, warm
+from entity_subscription.models import Medium, Source
+
+
+class Command(BaseCommand):
+    help = (
+        'Load the current subscriptions of chosen sources, mediums and entity kinds into the Redis mirror, '
+        'ahead of a broadcast.'
+    )
+    option_list = BaseCommand.option_list + (
+        make_option('--source', action='append', dest='sources', default=None,
+                    help='Name of a source to warm. May be repeated. Defaults to every source.'),
+        make_option('--medium', action='append', dest='mediums', default=None,
+                    help='Name of a medium to warm. May be repeated. Defaults to every medium.'),
+        make_option('--entity-kind', action='append', dest='entity_kinds', default=None,
+                    help='Name of an entity kind to warm. May be repeated. Defaults to every kind.'),
+        make_option('--chunk-size', action='store', type='int', dest='chunk_size', default=1000,
+                    help='Number of entities resolved per batch of queries.'),
+        make_option('--workers', action='store', type='int', dest='workers', default=1,
+                    help='Number of batches resolved in parallel.'),
+    )
+
+    def handle(self, *args, **options):
+        mirror = get_mirror()
+        if mirror is None:
+            raise CommandError('ENTITY_SUBSCRIPTION_REDIS_URL is not set.')
+
+        def progress(warmed, total):
+            self.stdout.write('Warmed {0}/{1} entities.'.format(warmed, total))
+
+        warm(
+            mirror,
+            sources=_by_name(Source, options['sources']),
+            mediums=_by_name(Medium, options['mediums']),
+            entity_kinds=_by_name(EntityKind, options['entity_kinds']),
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            progress=progress,
+        )
+
+
+def _by_name(model, names):
+    if names is None:
+        return None
+    objects = list(model.objects.filter(name__in=names))
+    missing = set(names) - set(obj.name for obj in objects)
+    if missing:
+        raise CommandError('Unknown {0} name: {1}'.format(model._meta.verbose_name, ', '.join(sorted(missing))))
+    return objects
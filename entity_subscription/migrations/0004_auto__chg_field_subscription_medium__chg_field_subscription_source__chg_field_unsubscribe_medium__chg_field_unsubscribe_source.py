@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+
+        # Changing field 'Subscription.medium'
+        db.alter_column(u'entity_subscription_subscription', 'medium_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Medium'], null=True))
+
+        # Changing field 'Subscription.source'
+        db.alter_column(u'entity_subscription_subscription', 'source_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Source'], null=True))
+
+        # Changing field 'Unsubscribe.medium'
+        db.alter_column(u'entity_subscription_unsubscribe', 'medium_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Medium'], null=True))
+
+        # Changing field 'Unsubscribe.source'
+        db.alter_column(u'entity_subscription_unsubscribe', 'source_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Source'], null=True))
+
+    def backwards(self, orm):
+
+        # User chose to not deal with backwards NULL issues for 'Subscription.medium'
+        raise RuntimeError("Cannot reverse this migration. 'Subscription.medium' and its values cannot be restored.")
+
+        # The following code is provided here to aid in writing a correct migration
+        # Changing field 'Subscription.medium'
+        db.alter_column(u'entity_subscription_subscription', 'medium_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Medium']))
+
+        # User chose to not deal with backwards NULL issues for 'Subscription.source'
+        raise RuntimeError("Cannot reverse this migration. 'Subscription.source' and its values cannot be restored.")
+
+        # The following code is provided here to aid in writing a correct migration
+        # Changing field 'Subscription.source'
+        db.alter_column(u'entity_subscription_subscription', 'source_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Source']))
+
+        # User chose to not deal with backwards NULL issues for 'Unsubscribe.medium'
+        raise RuntimeError("Cannot reverse this migration. 'Unsubscribe.medium' and its values cannot be restored.")
+
+        # The following code is provided here to aid in writing a correct migration
+        # Changing field 'Unsubscribe.medium'
+        db.alter_column(u'entity_subscription_unsubscribe', 'medium_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Medium']))
+
+        # User chose to not deal with backwards NULL issues for 'Unsubscribe.source'
+        raise RuntimeError("Cannot reverse this migration. 'Unsubscribe.source' and its values cannot be restored.")
+
+        # The following code is provided here to aid in writing a correct migration
+        # Changing field 'Unsubscribe.source'
+        db.alter_column(u'entity_subscription_unsubscribe', 'source_id', self.gf('django.db.models.fields.related.ForeignKey')(to=orm['entity_subscription.Source']))
+
+    models = {
+        u'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        u'entity.entity': {
+            'Meta': {'unique_together': "(('entity_id', 'entity_type', 'entity_kind'),)", 'object_name': 'Entity'},
+            'display_name': ('django.db.models.fields.TextField', [], {'db_index': 'True', 'blank': 'True'}),
+            'entity_id': ('django.db.models.fields.IntegerField', [], {}),
+            'entity_kind': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.EntityKind']"}),
+            'entity_meta': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'entity_type': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['contenttypes.ContentType']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'is_active': ('django.db.models.fields.BooleanField', [], {'default': 'True', 'db_index': 'True'})
+        },
+        u'entity.entitykind': {
+            'Meta': {'object_name': 'EntityKind'},
+            'display_name': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '256', 'db_index': 'True'})
+        },
+        u'entity_subscription.medium': {
+            'Meta': {'object_name': 'Medium'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.source': {
+            'Meta': {'object_name': 'Source'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'display_name': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '64'})
+        },
+        u'entity_subscription.subscription': {
+            'Meta': {'object_name': 'Subscription'},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']", 'null': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']", 'null': 'True'}),
+            'subentity_kind': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.EntityKind']", 'null': 'True'})
+        },
+        u'entity_subscription.unsubscribe': {
+            'Meta': {'object_name': 'Unsubscribe'},
+            'entity': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity.Entity']"}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'medium': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Medium']", 'null': 'True'}),
+            'source': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['entity_subscription.Source']", 'null': 'True'})
+        }
+    }
+
+    complete_apps = ['entity_subscription']
\ No newline at end of file
@@ -0,0 +1,291 @@
+"""An optional mirror of effective subscriptions in Redis.
+
+The mirror keeps one Redis set per (source, medium), holding the ids
+of every entity effectively subscribed to it: individual and group
+subscriptions with unsubscriptions removed. Checking a subscription is
+then a single SISMEMBER, and reading an audience is an SSCAN.
+
+The mirror is kept up to date from the `Subscription` and
+`Unsubscribe` model signals, with `connect_mirror`. Changes that do
+not go through those signals, such as entity relationship changes,
+bulk updates or raw SQL, are only picked up by `rebuild`.
+"""
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from entity.models import Entity, EntityRelationship
+
+from entity_subscription.signals import preferences_changed
+from entity_subscription.utils import get_id, subquery
+
+
+class RedisSubscriptionMirror(object):
+    """Effective subscriptions stored as Redis sets of entity ids.
+
+    Args:
+
+      client - A `redis.StrictRedis` client, or anything with the same
+      interface.
+
+      prefix - Prepended to every key the mirror uses.
+    """
+    def __init__(self, client, prefix='entity_subscription'):
+        self.client = client
+        self.prefix = prefix
+
+    def key(self, source, medium):
+        return '{0}:{1}:{2}'.format(self.prefix, get_id(source), get_id(medium))
+
+    def is_subscribed(self, source, medium, entity):
+        """Return True if the entity is subscribed, like `Subscription.objects.is_subscribed`.
+        """
+        return bool(self.client.sismember(self.key(source, medium), get_id(entity)))
+
+    def filter_not_subscribed(self, source, medium, entities):
+        """Return the ids of the entities subscribed to the source and medium.
+
+        Behaves like `Subscription.objects.filter_not_subscribed`, but
+        returns a list of ids, in the order given, using one round trip.
+        """
+        entity_ids = [get_id(entity) for entity in entities]
+        pipeline = self.client.pipeline(transaction=False)
+        for entity_id in entity_ids:
+            pipeline.sismember(self.key(source, medium), entity_id)
+        return [entity_id for entity_id, is_member in zip(entity_ids, pipeline.execute()) if is_member]
+
+    def subscribed_entity_ids(self, source, medium):
+        """Yield the ids of every entity subscribed to the source and medium.
+        """
+        for member in self.client.sscan_iter(self.key(source, medium)):
+            yield int(member)
+
+    def update(self, source, medium, entities):
+        """Recompute the subscription state of some entities from the database.
+        """
+        self.update_many(entities, [source], [medium])
+
+    def update_many(self, entities, sources, mediums):
+        """Recompute the state of some entities for every pair of the sources and mediums.
+
+        The subscriptions are resolved with one set of queries, and
+        written with one pipeline.
+        """
+        from entity_subscription.models import Subscription
+
+        entity_ids = set(get_id(entity) for entity in entities)
+        if not entity_ids:
+            return
+        subscribed = Subscription.objects._effective_subscriptions(entity_ids, sources)
+        pipeline = self.client.pipeline()
+        for source in sources:
+            for medium in mediums:
+                key = self.key(source, medium)
+                for entity_id in entity_ids:
+                    if (entity_id, get_id(source), get_id(medium)) in subscribed:
+                        pipeline.sadd(key, entity_id)
+                    else:
+                        pipeline.srem(key, entity_id)
+        pipeline.execute()
+
+    def rebuild(self, chunk_size=1000):
+        """Rebuild every set from the database.
+
+        Each source's sets are built under temporary keys and renamed
+        into place, so readers never see a partially built set.
+        """
+        from entity_subscription.models import Medium, Source, Subscription
+
+        medium_ids = list(Medium.objects.values_list('id', flat=True))
+        for source_id in Source.objects.values_list('id', flat=True):
+            members = defaultdict(set)
+            for chunk in _chunks(sorted(_candidate_entity_ids(source_id)), chunk_size):
+                for entity_id, _, medium_id in Subscription.objects._effective_subscriptions(chunk, [source_id]):
+                    members[medium_id].add(entity_id)
+
+            pipeline = self.client.pipeline()
+            for medium_id in medium_ids:
+                key = self.key(source_id, medium_id)
+                if members[medium_id]:
+                    pipeline.delete(key + ':rebuild')
+                    for chunk in _chunks(sorted(members[medium_id]), chunk_size):
+                        pipeline.sadd(key + ':rebuild', *chunk)
+                    pipeline.rename(key + ':rebuild', key)
+                else:
+                    pipeline.delete(key)
+            pipeline.execute()
+
+
+def _candidate_entity_ids(source_id, entity_kinds=None):
+    """Return the ids of every entity a subscription to the source might apply to.
+
+    Only entities of the given kinds are returned, if any are given.
+    """
+    from entity_subscription.models import Subscription
+
+    subscriptions = Subscription.objects.filter(Q(source=source_id) | Q(source__isnull=True))
+    individual_subscriptions = subscriptions.filter(subentity_kind__isnull=True)
+    relationships = EntityRelationship.objects.filter(
+        super_entity__in=subquery(subscriptions.filter(subentity_kind__isnull=False).values_list('entity', flat=True))
+    )
+    if entity_kinds is not None:
+        entity_kind_ids = [get_id(entity_kind) for entity_kind in entity_kinds]
+        individual_subscriptions = individual_subscriptions.filter(
+            entity__in=subquery(Entity.objects.filter(entity_kind__in=entity_kind_ids).values_list('id', flat=True))
+        )
+        relationships = relationships.filter(sub_entity__entity_kind__in=entity_kind_ids)
+    entity_ids = set(individual_subscriptions.values_list('entity', flat=True))
+    entity_ids.update(relationships.values_list('sub_entity', flat=True))
+    return entity_ids
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def warm(mirror, sources=None, mediums=None, entity_kinds=None, chunk_size=1000, workers=1, progress=None):
+    """Load the current subscriptions of chosen sources, mediums and entity kinds into a mirror.
+
+    Meant to run ahead of a known broadcast, so the reads it makes hit
+    a complete mirror rather than falling back to the database.
+
+    Args:
+
+      mirror - The `RedisSubscriptionMirror` to load.
+
+      sources, mediums, entity_kinds - (Optional) Iterables of model
+      instances or ids. Default to every source, medium and kind.
+
+      chunk_size - The number of entities resolved per set of queries.
+
+      workers - The number of chunks resolved in parallel, each in its
+      own thread and database connection.
+
+      progress - (Optional) A callable taking the number of entities
+      warmed so far and the total, called after every chunk.
+
+    Returns:
+
+      The number of entities warmed.
+    """
+    from entity_subscription.models import Medium, Source
+
+    source_ids = _ids(sources, Source)
+    medium_ids = _ids(mediums, Medium)
+    entity_ids = set()
+    for source_id in source_ids:
+        entity_ids.update(_candidate_entity_ids(source_id, entity_kinds))
+    entity_chunks = list(_chunks(sorted(entity_ids), chunk_size))
+
+    def warm_chunk(chunk):
+        try:
+            mirror.update_many(chunk, source_ids, medium_ids)
+        finally:
+            if workers > 1:
+                connection.close()
+        return len(chunk)
+
+    if workers > 1:
+        pool = ThreadPool(workers)
+        warmed_chunks = pool.imap_unordered(warm_chunk, entity_chunks)
+    else:
+        pool = None
+        warmed_chunks = (warm_chunk(chunk) for chunk in entity_chunks)
+    warmed = 0
+    try:
+        for chunk_warmed in warmed_chunks:
+            warmed += chunk_warmed
+            if progress is not None:
+                progress(warmed, len(entity_ids))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return warmed
+
+
+def _ids(objects, model):
+    if objects is None:
+        return list(model.objects.values_list('id', flat=True))
+    return [get_id(obj) for obj in objects]
+
+
+def get_mirror():
+    """Return a mirror for the `ENTITY_SUBSCRIPTION_REDIS_URL` setting, or None.
+
+    Requires the `redis` package.
+    """
+    url = getattr(settings, 'ENTITY_SUBSCRIPTION_REDIS_URL', None)
+    if url is None:
+        return None
+    import redis
+
+    prefix = getattr(settings, 'ENTITY_SUBSCRIPTION_REDIS_PREFIX', 'entity_subscription')
+    return RedisSubscriptionMirror(redis.StrictRedis.from_url(url), prefix)
+
+
+def connect_mirror(mirror, dispatch=None):
+    """Keep a mirror up to date as subscriptions and unsubscribes change.
+
+    Args:
+
+      mirror - The `RedisSubscriptionMirror` to update.
+
+      dispatch - (Optional) A callable taking a source id, a medium id
+      and a list of entity ids whose state changed. Defaults to
+      updating the mirror synchronously; pass a function that enqueues
+      a call to `mirror.update` to update it from a task queue instead.
+    """
+    from entity_subscription.models import Subscription, Unsubscribe, _Wildcards
+
+    dispatch = dispatch or mirror.update
+
+    def changed(pairs, entity_ids):
+        wildcards = _Wildcards()
+        for source_id, medium_id in pairs:
+            for key_source_id, key_medium_id in wildcards.expand(source_id, medium_id):
+                dispatch(key_source_id, key_medium_id, entity_ids)
+
+    def subscription_changed(sender, instance, **kwargs):
+        entity_ids = _subscribed_entity_ids(instance.entity_id, instance.subentity_kind_id)
+        changed([(instance.source_id, instance.medium_id)], entity_ids)
+
+    def unsubscribe_changed(sender, instance, **kwargs):
+        changed([(instance.source_id, instance.medium_id)], [instance.entity_id])
+
+    def preferences_changed_(sender, entity, added, removed, subentity_kind=None, **kwargs):
+        changed(added | removed, _subscribed_entity_ids(entity, subentity_kind))
+
+    for signal in (post_save, post_delete):
+        signal.connect(
+            subscription_changed, sender=Subscription, weak=False, dispatch_uid='entity_subscription_mirror'
+        )
+        signal.connect(
+            unsubscribe_changed, sender=Unsubscribe, weak=False, dispatch_uid='entity_subscription_mirror'
+        )
+    for sender in (Subscription, Unsubscribe):
+        preferences_changed.connect(
+            preferences_changed_, sender=sender, weak=False, dispatch_uid='entity_subscription_mirror'
+        )
+
+
+def _subscribed_entity_ids(entity_id, subentity_kind_id):
+    """Return the ids of the entities a subscription of an entity applies to.
+    """
+    if subentity_kind_id is None:
+        return [entity_id]
+    return list(EntityRelationship.objects.filter(
+        super_entity=entity_id, sub_entity__entity_kind=subentity_kind_id
+    ).values_list('sub_entity', flat=True))
+
+
+def disconnect_mirror():
+    from entity_subscription.models import Subscription, Unsubscribe
+
+    for sender in (Subscription, Unsubscribe):
+        for signal in (post_save, post_delete, preferences_changed):
+            signal.disconnect(sender=sender, dispatch_uid='entity_subscription_mirror')
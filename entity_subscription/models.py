@@ -1,23 +1,211 @@
-from django.db import models
+import itertools
+from collections import defaultdict
+
+from django.db import models, transaction
 from django.db.models import Q
+from django.db.models.signals import post_save
 from entity.models import Entity, EntityRelationship, EntityKind
 
+from entity_subscription import partitioning, statements
+from entity_subscription.batching import current_batch
+from entity_subscription.bloom import get_unsubscribe_filter
+from entity_subscription.diagnostics import diagnosed
+from entity_subscription.hierarchy import get_hierarchy_cache
+from entity_subscription.signals import preferences_changed
+from entity_subscription.utils import get_id, id_chunks, id_list, split_databases, subquery
+
+
+def _entity_kind_lookup(entity):
+    """Return a filter matching the kind of an entity without loading it.
+
+    Entity instances already carry their kind's id. For raw entity
+    ids, the kind is matched with a subquery, so no extra round trip
+    is made, unless entities are on another database.
+    """
+    if isinstance(entity, Entity):
+        return {'subentity_kind_id': entity.entity_kind_id}
+    return {'subentity_kind__in': subquery(Entity.objects.filter(id=entity).values_list('entity_kind', flat=True))}
+
+
+def _entity_kind_ids(entities):
+    """Return the set of the kind ids of some entities.
+
+    Entity instances already carry their kind's id. The kinds of raw
+    entity ids are fetched with one query, or one per chunk of ids on
+    backends that can not bind an id list as one parameter.
+    """
+    entity_kind_ids = set(e.entity_kind_id for e in entities if isinstance(e, Entity))
+    raw_ids = [e for e in entities if not isinstance(e, Entity)]
+    if raw_ids:
+        for chunk in id_chunks(raw_ids, Entity):
+            entity_kinds = Entity.objects.filter(id__in=id_list(chunk, Entity)).values_list('entity_kind', flat=True)
+            entity_kind_ids.update(entity_kinds.order_by().distinct())
+    return entity_kind_ids
+
+
+def _super_entity_subscribed_q(entity):
+    """Return a filter matching the group subscriptions that apply to an entity.
+
+    With a `HierarchyCache` enabled, the entity's kind and super-entity
+    ids come from it, rather than from subqueries of every check.
+    """
+    hierarchy_cache = get_hierarchy_cache()
+    if hierarchy_cache is None:
+        super_entities = subquery(
+            EntityRelationship.objects.filter(sub_entity=get_id(entity)).values_list('super_entity', flat=True)
+        )
+        return Q(entity__in=super_entities, **_entity_kind_lookup(entity))
+    entity_kind_id, super_entity_ids = hierarchy_cache.get(entity)
+    return Q(entity__in=super_entity_ids, subentity_kind=entity_kind_id)
+
+
+def _values(queryset, ids):
+    """Return a queryset, or with `ids` the frozenset of its ids, streamed from `values_list`.
+    """
+    return frozenset(queryset.values_list('id', flat=True).iterator()) if ids else queryset
+
+
+def _wildcard_q(**lookups):
+    """Return a Q matching each field's value, or a null wildcard in its place.
+
+    A null source or medium on a `Subscription` or `Unsubscribe`
+    applies to every source or medium.
+    """
+    q = Q()
+    for field, value in lookups.items():
+        q &= Q(**{field: value}) | Q(**{'{0}__isnull'.format(field): True})
+    return q
+
+
+def _all_if_exists(model, queryset):
+    """Return every row of `model` if `queryset` has any row, none otherwise.
+
+    Used to expand wildcard rows into every medium within the same
+    query, through an uncorrelated EXISTS.
+    """
+    sql, params = queryset.values('id').query.sql_with_params()
+    return model.objects.extra(where=['EXISTS ({0})'.format(sql)], params=params)
+
+
+class _Wildcards(object):
+    """Expands null wildcard sources and mediums into ids.
+
+    The ids of every source or medium are fetched at most once, and
+    only if a wildcard is actually expanded.
+    """
+    def __init__(self, source_ids=None):
+        self._source_ids = source_ids
+        self._medium_ids = None
+
+    def expand(self, source_id, medium_id):
+        if source_id is None and self._source_ids is None:
+            self._source_ids = list(Source.objects.values_list('id', flat=True))
+        if medium_id is None and self._medium_ids is None:
+            self._medium_ids = list(Medium.objects.values_list('id', flat=True))
+        source_ids = self._source_ids if source_id is None else [source_id]
+        medium_ids = self._medium_ids if medium_id is None else [medium_id]
+        return itertools.product(source_ids, medium_ids)
+
+
+def _maybe_unsubscribed(entity_ids, sources=None, medium=None):
+    """Return the entity ids that might be unsubscribed from any source.
+
+    Without an enabled `UnsubscribeFilter` every id is returned. With
+    one, ids that are definitely not unsubscribed are dropped, so the
+    `Unsubscribe` query can be narrowed or skipped. No sources means
+    any source, and no medium any medium.
+    """
+    unsubscribe_filter = get_unsubscribe_filter()
+    if unsubscribe_filter is None:
+        return list(entity_ids)
+    return [
+        entity_id for entity_id in entity_ids
+        if any(unsubscribe_filter.might_be_unsubscribed(entity_id, source, medium) for source in sources or [None])
+    ]
+
+
+def _wildcard_patterns(key):
+    """Return the (entity, source, medium) patterns matching a key.
+
+    In a pattern, a null source or medium matches any value.
+    """
+    entity_id, source_id, medium_id = key
+    return [
+        (entity_id, pattern_source_id, pattern_medium_id)
+        for pattern_source_id in (source_id, None) for pattern_medium_id in (medium_id, None)
+    ]
+
+
+def _matches_any(key, patterns):
+    """Return True if an (entity, source, medium) key matches any of a set of patterns.
+    """
+    return any(pattern in patterns for pattern in _wildcard_patterns(key))
+
+
+def _set_preferences(manager, pairs, **lookups):
+    """Replace the rows matching the lookups with one row per (source, medium) pair.
+
+    The current rows are read with one query, and only the difference
+    is written, with bulk statements in one transaction. Duplicate rows
+    of a kept pair are deleted too. The bulk insert sends no row
+    signals, and the delete only sends them to connected receivers;
+    `preferences_changed` is sent once, if anything changed. Returns
+    the sets of pairs added and removed.
+    """
+    desired = set((get_id(source), get_id(medium)) for source, medium in pairs)
+    with transaction.atomic(using=manager.db):
+        current = defaultdict(list)
+        rows = manager.filter(**lookups).select_for_update().values_list('id', 'source', 'medium').order_by('id')
+        for row_id, source_id, medium_id in rows:
+            current[(source_id, medium_id)].append(row_id)
+        added, removed = desired - set(current), set(current) - desired
+        delete_ids = [
+            row_id for pair, row_ids in current.items() for row_id in (row_ids if pair in removed else row_ids[1:])
+        ]
+        if delete_ids:
+            manager.filter(id__in=delete_ids).delete()
+        if added:
+            field_values = dict(('{0}_id'.format(field), value) for field, value in lookups.items())
+            manager.bulk_create([
+                manager.model(source_id=source_id, medium_id=medium_id, **field_values)
+                for source_id, medium_id in added
+            ])
+    if added or removed:
+        preferences_changed.send(sender=manager.model, added=added, removed=removed, **lookups)
+    return added, removed
+
+
+def _subscribed_mediums(queryset):
+    """Return the mediums of a `Subscription` or `Unsubscribe` queryset.
+
+    Rows with a null medium apply to every medium.
+    """
+    return Medium.objects.filter(
+        Q(id__in=queryset.filter(medium__isnull=False).values('medium')) |
+        Q(id__in=_all_if_exists(Medium, queryset.filter(medium__isnull=True)).values('id'))
+    )
+
 
 class SubscriptionManager(models.Manager):
-    def mediums_subscribed(self, source, entity, subentity_kind=None):
+    @diagnosed
+    def mediums_subscribed(self, source, entity, subentity_kind=None, ids=False):
         """Return all mediums subscribed to for a source.
 
         Args:
 
-          source - A `Source` object. Check the mediums subscribed to,
-          for this source of notifications.
+          source - A `Source` object or id. Check the mediums
+          subscribed to, for this source of notifications.
 
-          entity - An `Entity` object. The entity to check
+          entity - An `Entity` object or id. The entity to check
           subscriptions for.
 
-          subentity_kind - (Optional) An EntityKind indicating we're
-          interested in the mediums subscribed to by all sub-entities
-          of the `entity` argument matching this subentity_kind.
+          subentity_kind - (Optional) An EntityKind or id indicating
+          we're interested in the mediums subscribed to by all
+          sub-entities of the `entity` argument matching this
+          subentity_kind.
+
+          ids - (Optional) If True, return a frozenset of medium ids
+          rather than a queryset, without instantiating any `Medium`.
 
         Returns:
 
@@ -30,29 +218,40 @@ class SubscriptionManager(models.Manager):
            all mediums that any of the subenties might be subscribed
            to, *without* any unsubscribed mediums filtered out.
 
+           With `ids`, a frozenset of the ids of these mediums.
+
+           Inside a `subscription_batch` scope, individual checks
+           return a lazy collection of mediums, or of medium ids,
+           instead, resolved together with every other check in the
+           scope.
+
         """
         if subentity_kind is None:
-            return self._mediums_subscribed_individual(source, entity)
+            batch = current_batch()
+            if batch is not None:
+                return batch.mediums_subscribed(source, entity, ids)
+            return _values(self._mediums_subscribed_individual(source, entity), ids)
         else:
-            return self._mediums_subscribed_group(source, entity, subentity_kind)
+            return _values(self._mediums_subscribed_group(source, entity, subentity_kind), ids)
 
+    @diagnosed
     def is_subscribed(self, source, medium, entity, subentity_kind=None):
         """Return True if subscribed to this medium/source combination.
 
         Args:
 
-          source - A `Source` object. Check that there is a
+          source - A `Source` object or id. Check that there is a
           subscription for this source and the given medium.
 
-          medium - A `Medium` object. Check that there is a
+          medium - A `Medium` object or id. Check that there is a
           subscription for this medium and the given source
 
-          entity - An `Entity` object. The entity to check
+          entity - An `Entity` object or id. The entity to check
           subscriptions for.
 
-          subentity_kind - (Optional) An EntityKind indicating we're
-          interested in the subscriptions by all sub-entities of the
-          `entity` argument matching this subentity_kind.
+          subentity_kind - (Optional) An EntityKind or id indicating
+          we're interested in the subscriptions by all sub-entities of
+          the `entity` argument matching this subentity_kind.
 
         Returns:
 
@@ -67,106 +266,293 @@ class SubscriptionManager(models.Manager):
            combination of source/medium, *without* any unsubscriptions
            filtered out.
 
+           Inside a `subscription_batch` scope, individual checks
+           return a lazy boolean instead, resolved together with
+           every other check in the scope.
+
+           With the `ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS` setting
+           enabled, individual checks outside a batch run a single
+           precompiled statement instead of the ORM queries.
+
         """
         if subentity_kind is None:
+            batch = current_batch()
+            if batch is not None:
+                return batch.is_subscribed(source, medium, entity)
+            if statements.use_prepared_statements():
+                return statements.is_subscribed(source, medium, entity)
             return self._is_subscribed_individual(source, medium, entity)
         else:
             return self._is_subscribed_group(source, medium, entity, subentity_kind)
 
-    def filter_not_subscribed(self, source, medium, entities):
+    @diagnosed
+    def filter_not_subscribed(self, source, medium, entities, ids=False):
         """Return only the entities subscribed to the source and medium.
 
         Args:
 
-          source - A `Source` object. Check that there is a
+          source - A `Source` object or id. Check that there is a
           subscription for this source and the given medium.
 
-          medium - A `Medium` object. Check that there is a
+          medium - A `Medium` object or id. Check that there is a
           subscription for this medium and the given source
 
-          entities - An iterable of `Entity` objects. The iterable
-          will be filtered down to only those with a subscription to
-          the source and medium. All entities in this iterable must be
-          of the same type.
+          entities - An iterable of `Entity` objects or ids. The
+          iterable will be filtered down to only those with a
+          subscription to the source and medium. All entities in this
+          iterable must be of the same type.
+
+          ids - (Optional) If True, return a frozenset of entity ids
+          rather than a queryset, without instantiating any `Entity`.
 
         Raises:
 
           ValueError - if not all entities provided are of the same
-          type.
+          type. The kinds of raw entity ids are fetched with one
+          extra query.
 
         Returns:
 
           A queryset of entities which are in the initially provided
-          list and are subscribed to the source and medium.
+          list and are subscribed to the source and medium, or with
+          `ids`, a frozenset of their ids.
+
+          With entities on another database than subscriptions, the
+          entities are resolved in bulk, with a fixed number of
+          queries to each database.
+
+          On backends that can not bind an id list as one parameter,
+          many entities are resolved in chunks, each with its own
+          query, and the queryset returned binds only the ids of the
+          subscribed entities.
 
         """
-        entity_kind_id = entities[0].entity_kind_id
-        if not all(e.entity_kind_id == entity_kind_id for e in entities):
+        entities = list(entities)
+        entity_kind_ids = _entity_kind_ids(entities)
+        if len(entity_kind_ids) > 1:
             msg = 'All entities provided must be of the same kind.'
             raise ValueError(msg)
+        if split_databases():
+            return self._filter_not_subscribed_split(source, medium, entities, ids)
+
+        # Without a kind, none of the entities exist, so no group
+        # subscription can apply.
+        entity_kind_id = entity_kind_ids.pop() if entity_kind_ids else None
+        entity_chunks = id_chunks(get_id(e) for e in entities)
+        if len(entity_chunks) == 1:
+            return _values(self._subscribed_entities(source, medium, entity_chunks[0], entity_kind_id), ids)
+        entity_ids = frozenset().union(*[
+            _values(self._subscribed_entities(source, medium, chunk, entity_kind_id), True) for chunk in entity_chunks
+        ])
+        return entity_ids if ids else Entity.objects.filter(id__in=id_list(entity_ids, Entity))
+
+    @diagnosed
+    def first_subscribed_mediums(self, source, mediums, entities):
+        """Return the first medium, in order of priority, each entity is subscribed to.
+
+        Args:
+
+          source - A `Source` object or id. Check the mediums
+          subscribed to, for this source of notifications.
+
+          mediums - An iterable of `Medium` objects or ids, from the
+          most preferred to the least.
+
+          entities - An iterable of `Entity` objects or ids.
+
+        Returns:
+
+          A dictionary mapping the id of every entity to the id of the
+          first of the mediums it is subscribed to, with group
+          subscriptions and unsubscriptions applied, or None if it is
+          subscribed to none of them. Resolved with the same fixed
+          number of queries however many entities there are.
+
+        """
+        entities = list(entities)
+        source_id = get_id(source)
+        medium_ids = [get_id(medium) for medium in mediums]
+        subscribed = self._effective_subscriptions(entities, [source_id])
+        return dict(
+            (entity_id, next((m for m in medium_ids if (entity_id, source_id, m) in subscribed), None))
+            for entity_id in (get_id(entity) for entity in entities)
+        )
+
+    def set_preferences(self, entity, pairs, subentity_kind=None):
+        """Make an entity's subscriptions exactly the given (source, medium) pairs.
+
+        Args:
+
+          entity - An `Entity` object or id.
+
+          pairs - An iterable of (source, medium) pairs, of objects or
+          ids, or None for every source or medium.
+
+          subentity_kind - (Optional) An `EntityKind` object or id, to
+          set the group subscriptions of the entity's sub-entities of
+          that kind, rather than the entity's individual subscriptions.
+
+        Returns:
+
+          The sets of (source id, medium id) pairs added and removed.
+          Only the difference with the current subscriptions is
+          written, in one transaction, and `preferences_changed` is
+          sent once rather than a signal per row.
+
+        """
+        return _set_preferences(self, pairs, entity=get_id(entity), subentity_kind=get_id(subentity_kind))
+
+    def _effective_subscriptions(self, entities, sources=None):
+        """Return the (entity, source, medium) id triples subscribed to.
 
-        group_subs = self.filter(source=source, medium=medium, subentity_kind_id=entity_kind_id)
+        Resolves individual subscriptions, group subscriptions through
+        super-entities, and unsubscriptions for many entities and
+        sources at once, in a fixed number of queries. Entities and
+        sources may be model instances or ids; the kinds of raw entity
+        ids are fetched with one extra query. No sources means every
+        source. Wildcard subscriptions are expanded into one triple
+        per source and medium they apply to.
+
+        On backends that can not bind an id list as one parameter, the
+        entities are resolved in chunks, each in its own queries.
+        """
+        entity_chunks = id_chunks(entities)
+        if len(entity_chunks) > 1:
+            return set().union(*[self._effective_subscriptions(chunk, sources) for chunk in entity_chunks])
+        entity_ids, sources, subscribed = self._subscription_keys(entities, sources)
+        maybe_unsubscribed = _maybe_unsubscribed(entity_ids, sources)
+        if not maybe_unsubscribed:
+            return subscribed
+        unsubscribes = Unsubscribe.objects.filter(entity__id__in=id_list(maybe_unsubscribed))
+        if sources is not None:
+            unsubscribes = unsubscribes.filter(Q(source__in=sources) | Q(source__isnull=True))
+        unsubscribed = set(unsubscribes.values_list('entity', 'source', 'medium'))
+        return set(key for key in subscribed if not _matches_any(key, unsubscribed))
+
+    def _subscription_keys(self, entities, sources=None, subscriptions=None, relationships=None):
+        """Return the (entity, source, medium) id triples with a subscription.
+
+        Like `_effective_subscriptions`, without taking unsubscriptions
+        into account. Also returns the entity and source ids resolved.
+        The subscriptions and entity relationships considered can be
+        narrowed with querysets of them, by default every row is.
+        """
+        entity_chunks = id_chunks(entities)
+        if len(entity_chunks) > 1:
+            entity_ids, subscribed = [], set()
+            for chunk in entity_chunks:
+                chunk_entity_ids, chunk_sources, chunk_subscribed = self._subscription_keys(
+                    chunk, sources, subscriptions, relationships
+                )
+                entity_ids.extend(chunk_entity_ids)
+                subscribed.update(chunk_subscribed)
+            return entity_ids, chunk_sources, subscribed
+        entities = entity_chunks[0]
+        entity_kinds = dict((e.id, e.entity_kind_id) for e in entities if isinstance(e, Entity))
+        entity_ids = [get_id(e) for e in entities if not isinstance(e, Entity)]
+        if entity_ids:
+            entity_kinds.update(
+                Entity.objects.filter(id__in=id_list(entity_ids, Entity)).values_list('id', 'entity_kind')
+            )
+        entity_ids = list(entity_kinds)
+        relationships = (EntityRelationship.objects.all() if relationships is None else relationships).filter(
+            sub_entity__id__in=id_list(entity_ids, EntityRelationship)
+        ).values_list('super_entity', 'sub_entity')
+        sub_entities = defaultdict(set)
+        for super_entity_id, sub_entity_id in relationships:
+            sub_entities[super_entity_id].add(sub_entity_id)
+
+        entity_is_subscribed = Q(subentity_kind__isnull=True, entity__id__in=id_list(entity_ids))
+        super_entity_is_subscribed = Q(
+            subentity_kind__in=set(entity_kinds.values()), entity__id__in=id_list(sub_entities)
+        )
+        subscriptions = (self.all() if subscriptions is None else subscriptions).filter(
+            entity_is_subscribed | super_entity_is_subscribed
+        )
+        if sources is not None:
+            sources = [get_id(source) for source in sources]
+            subscriptions = subscriptions.filter(Q(source__in=sources) | Q(source__isnull=True))
+
+        subscribed = set()
+        wildcards = _Wildcards(sources)
+        rows = subscriptions.values_list('entity', 'subentity_kind', 'source', 'medium')
+        for entity_id, subentity_kind_id, source_id, medium_id in rows:
+            subscribed_entity_ids = [
+                sub_entity_id for sub_entity_id in sub_entities.get(entity_id, ())
+                if entity_kinds[sub_entity_id] == subentity_kind_id
+            ]
+            if subentity_kind_id is None:
+                subscribed_entity_ids.append(entity_id)
+            for key_source_id, key_medium_id in wildcards.expand(source_id, medium_id):
+                subscribed.update((e, key_source_id, key_medium_id) for e in subscribed_entity_ids)
+        return entity_ids, sources, subscribed
+
+    def _subscribed_entities(self, source, medium, entity_ids, entity_kind_id):
+        """Return a queryset of the entities subscribed to a source and medium, among entities of one kind.
+        """
+        group_subs = self.filter(_wildcard_q(source=source, medium=medium), subentity_kind_id=entity_kind_id)
         group_subscribed_entities = EntityRelationship.objects.filter(
-            sub_entity__in=entities, super_entity__in=group_subs.values('entity')
+            sub_entity__id__in=id_list(entity_ids, EntityRelationship), super_entity__in=group_subs.values('entity')
         ).values_list('sub_entity', flat=True)
 
         individual_subs = self.filter(
-            source=source, medium=medium, subentity_kind=None
-        ).values_list('entity', flat=True)
-
-        relevant_unsubscribes = Unsubscribe.objects.filter(
-            source=source, medium=medium, entity__in=entities
+            _wildcard_q(source=source, medium=medium), subentity_kind=None
         ).values_list('entity', flat=True)
 
         subscribed_entities = Entity.objects.filter(
             Q(pk__in=group_subscribed_entities) | Q(pk__in=individual_subs),
-            id__in=[e.id for e in entities]
-        ).exclude(pk__in=relevant_unsubscribes)
-
+            id__in=id_list(entity_ids, Entity)
+        )
+
+        maybe_unsubscribed = _maybe_unsubscribed(entity_ids, [source], medium)
+        if maybe_unsubscribed:
+            relevant_unsubscribes = Unsubscribe.objects.filter(
+                _wildcard_q(source=source, medium=medium), entity__id__in=id_list(maybe_unsubscribed)
+            ).values_list('entity', flat=True)
+            subscribed_entities = subscribed_entities.exclude(pk__in=relevant_unsubscribes)
         return subscribed_entities
 
+    def _filter_not_subscribed_split(self, source, medium, entities, ids):
+        """Return the subscribed entities, without subqueries across databases.
+        """
+        key = (get_id(source), get_id(medium))
+        subscribed = self._effective_subscriptions(entities, [source])
+        entity_ids = frozenset(
+            entity_id for entity_id, source_id, medium_id in subscribed if (source_id, medium_id) == key
+        )
+        return entity_ids if ids else Entity.objects.filter(id__in=id_list(entity_ids, Entity))
+
     def _mediums_subscribed_individual(self, source, entity):
         """Return the mediums a single entity is subscribed to for a source.
         """
-        super_entities = entity.super_relationships.all().values_list('super_entity')
-        entity_is_subscribed = Q(subentity_kind__isnull=True, entity=entity)
-        super_entity_is_subscribed = Q(subentity_kind=entity.entity_kind, entity__in=super_entities)
-        subscribed_mediums = self.filter(
-            entity_is_subscribed | super_entity_is_subscribed, source=source
-        ).select_related('medium').values_list('medium', flat=True)
-        unsubscribed_mediums = Unsubscribe.objects.filter(
-            entity=entity, source=source
-        ).select_related('medium').values_list('medium', flat=True)
-        return Medium.objects.filter(id__in=subscribed_mediums).exclude(id__in=unsubscribed_mediums)
+        entity_is_subscribed = Q(subentity_kind__isnull=True, entity=get_id(entity))
+        super_entity_is_subscribed = _super_entity_subscribed_q(entity)
+        subscriptions = self.filter(entity_is_subscribed | super_entity_is_subscribed, _wildcard_q(source=source))
+        mediums = _subscribed_mediums(subscriptions)
+        if _maybe_unsubscribed([get_id(entity)], [source]):
+            unsubscribes = Unsubscribe.objects.filter(_wildcard_q(source=source), entity=get_id(entity))
+            mediums = mediums.exclude(id__in=_subscribed_mediums(unsubscribes).values('id'))
+        return mediums
 
     def _mediums_subscribed_group(self, source, entity, subentity_kind):
         """Return all the mediums any subentity in a group is subscrbed to.
         """
-        all_group_sub_entities = entity.sub_relationships.select_related('sub_entity').filter(
-            sub_entity__entity_kind=subentity_kind
-        ).values_list('sub_entity')
-        related_super_entities = EntityRelationship.objects.filter(
-            sub_entity__in=all_group_sub_entities
-        ).values_list('super_entity')
-        group_subscribed_mediums = self.filter(
-            source=source, subentity_kind=subentity_kind, entity__in=related_super_entities
-        ).select_related('medium').values_list('medium', flat=True)
-        return Medium.objects.filter(id__in=group_subscribed_mediums)
+        group_subscriptions = self._group_subscriptions(entity, subentity_kind).filter(
+            _wildcard_q(source=get_id(source))
+        )
+        return _subscribed_mediums(group_subscriptions)
 
     def _is_subscribed_individual(self, source, medium, entity):
         """Return true if an entity is subscribed to that source/medium combo.
         """
-        super_entities = entity.super_relationships.all().values_list('super_entity')
-        entity_is_subscribed = Q(subentity_kind__isnull=True, entity=entity)
-        super_entity_is_subscribed = Q(subentity_kind=entity.entity_kind, entity__in=super_entities)
+        entity_is_subscribed = Q(subentity_kind__isnull=True, entity=get_id(entity))
+        super_entity_is_subscribed = _super_entity_subscribed_q(entity)
         is_subscribed = self.filter(
             entity_is_subscribed | super_entity_is_subscribed,
-            source=source,
-            medium=medium,
+            _wildcard_q(source=source, medium=medium),
         ).exists()
-        unsubscribed = Unsubscribe.objects.filter(
-            source=source,
-            medium=medium,
+        unsubscribed = bool(_maybe_unsubscribed([get_id(entity)], [source], medium)) and Unsubscribe.objects.filter(
+            _wildcard_q(source=source, medium=medium),
             entity=entity
         ).exists()
         return is_subscribed and not unsubscribed
@@ -174,20 +560,35 @@ class SubscriptionManager(models.Manager):
     def _is_subscribed_group(self, source, medium, entity, subentity_kind):
         """Return true if any subentity is subscribed to that source & medium.
         """
-        all_group_sub_entities = entity.sub_relationships.select_related('sub_entity').filter(
-            sub_entity__entity_kind=subentity_kind
-        ).values_list('sub_entity')
-        related_super_entities = EntityRelationship.objects.filter(
-            sub_entity__in=all_group_sub_entities,
-        ).values_list('super_entity')
-        is_subscribed = self.filter(
-            source=source,
-            medium=medium,
-            subentity_kind=subentity_kind,
-            entity__in=related_super_entities
+        is_subscribed = self._group_subscriptions(entity, subentity_kind).filter(
+            _wildcard_q(source=get_id(source), medium=get_id(medium))
         ).exists()
         return is_subscribed
 
+    def _group_subscriptions(self, entity, subentity_kind):
+        """Return the group subscriptions of any super-entity of the group's members.
+
+        The group's sub-entities and their super-entities are joined
+        to the subscriptions rather than expanded into subqueries, so
+        the database can run it as a semi-join and stop at the first
+        match, however large the group is.
+
+        With entities on another database, the super-entities of the
+        group's members are fetched from it first, with one query.
+        """
+        if split_databases():
+            super_entity_ids = EntityRelationship.objects.filter(
+                sub_entity__entity_kind=get_id(subentity_kind),
+                sub_entity__super_relationships__super_entity=get_id(entity),
+            ).values_list('super_entity', flat=True).distinct()
+            return self.filter(subentity_kind=get_id(subentity_kind), entity__id__in=id_list(super_entity_ids))
+        member_super_entity = 'entity__sub_relationships__sub_entity__super_relationships__super_entity'
+        return self.filter(**{
+            'subentity_kind': get_id(subentity_kind),
+            'entity__sub_relationships__sub_entity__entity_kind': get_id(subentity_kind),
+            member_super_entity: get_id(entity),
+        })
+
 
 class Subscription(models.Model):
     """Include groups of entities to subscriptions.
@@ -200,9 +601,12 @@ class Subscription(models.Model):
     If, however, you want to subscribe an individual entity to a
     source/medium combination, setting the `subentity_kind` field to
     None will create an individual subscription.
+
+    Setting the `medium` or `source` field to None subscribes to every
+    medium or source, including those created later.
     """
-    medium = models.ForeignKey('Medium')
-    source = models.ForeignKey('Source')
+    medium = models.ForeignKey('Medium', null=True)
+    source = models.ForeignKey('Source', null=True)
     entity = models.ForeignKey(Entity)
     subentity_kind = models.ForeignKey(EntityKind, null=True)
 
@@ -211,16 +615,28 @@ class Subscription(models.Model):
     def __unicode__(self):
         s = "{entity} to {source} by {medium}"
         entity = self.entity.__unicode__()
-        source = self.source.__unicode__()
-        medium = self.medium.__unicode__()
+        source = self.source.__unicode__() if self.source_id else 'all sources'
+        medium = self.medium.__unicode__() if self.medium_id else 'all mediums'
         return s.format(entity=entity, source=source, medium=medium)
 
 
 class UnsubscribeManager(models.Manager):
+    @diagnosed
     def is_unsubscribed(self, source, medium, entity):
         """Return True if the entity is unsubscribed
+
+        The source, medium and entity may be model instances or ids.
         """
-        return self.filter(source=source, medium=medium, entity=entity).exists()
+        return self.filter(_wildcard_q(source=get_id(source), medium=get_id(medium)), entity=get_id(entity)).exists()
+
+    def set_preferences(self, entity, pairs):
+        """Make an entity's unsubscribes exactly the given (source, medium) pairs.
+
+        Like `SubscriptionManager.set_preferences`, the pairs may use
+        None for every source or medium, only the difference is
+        written, and the sets of pairs added and removed are returned.
+        """
+        return _set_preferences(self, pairs, entity=get_id(entity))
 
 
 class Unsubscribe(models.Model):
@@ -228,18 +644,21 @@ class Unsubscribe(models.Model):
 
     Entities can opt-out individually from recieving any notification
     of a given source/medium combination.
+
+    Setting the `medium` or `source` field to None opts out of every
+    medium or source; with both None the entity opts out of everything.
     """
     entity = models.ForeignKey(Entity)
-    medium = models.ForeignKey('Medium')
-    source = models.ForeignKey('Source')
+    medium = models.ForeignKey('Medium', null=True)
+    source = models.ForeignKey('Source', null=True)
 
     objects = UnsubscribeManager()
 
     def __unicode__(self):
         s = "{entity} from {source} by {medium}"
         entity = self.entity.__unicode__()
-        source = self.source.__unicode__()
-        medium = self.medium.__unicode__()
+        source = self.source.__unicode__() if self.source_id else 'all sources'
+        medium = self.medium.__unicode__() if self.medium_id else 'all mediums'
         return s.format(entity=entity, source=source, medium=medium)
 
 
@@ -273,3 +692,6 @@ class Source(models.Model):
 
     def __unicode__(self):
         return self.display_name
+
+
+post_save.connect(partitioning.source_saved, sender=Source, dispatch_uid='entity_subscription_source_partitions')
@@ -0,0 +1,230 @@
+"""Optional partitioning of the subscription tables by source, on PostgreSQL.
+
+Every query of the subscription managers filters `Subscription` and
+`Unsubscribe` rows on a single source, or on a source and the null
+wildcard. With the tables list partitioned on `source_id`, the planner
+only scans the partitions of that source and of the wildcard rows, so
+lookups, index sizes and vacuums scale with one source's rows rather
+than the whole table.
+
+Each table gets a partition per source, one for rows with a null
+(wildcard) source, and a default partition catching rows of sources
+without a partition of their own yet. Since `source_id` is nullable,
+it can not be part of a primary key, so partitioned tables have an
+index on `id` instead of a primary key constraint; ids still come from
+the table's sequence.
+
+Requires PostgreSQL 11 or later. Enabled with the
+`ENTITY_SUBSCRIPTION_PARTITION_BY_SOURCE` setting, before migrating,
+or by running the `subscription_partitions --convert` command later.
+Partitions for new sources are created as the sources are saved, and
+by `subscription_partitions --create-missing`.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from entity_subscription.utils import subscription_connection as connection
+
+
+def partitioning_enabled():
+    """Return True if the setting is enabled and the database is PostgreSQL.
+    """
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_PARTITION_BY_SOURCE', False) and connection.vendor == 'postgresql'
+
+
+def partitioned_models():
+    from entity_subscription.models import Subscription, Unsubscribe
+
+    return [Subscription, Unsubscribe]
+
+
+def partition_name(model, source_id):
+    """Return the name of a table's partition for a source id, or a null source id for wildcard rows.
+    """
+    return '{0}_source_{1}'.format(model._meta.db_table, 'null' if source_id is None else source_id)
+
+
+def default_partition_name(model):
+    return '{0}_default'.format(model._meta.db_table)
+
+
+def is_partitioned(model):
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s',
+        [model._meta.db_table]
+    )
+    return cursor.fetchone() is not None
+
+
+def existing_partitions(model):
+    """Return the names of a partitioned table's partitions.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = %s',
+        [model._meta.db_table]
+    )
+    return set(row[0] for row in cursor.fetchall())
+
+
+def missing_source_ids(model):
+    """Return the ids of the sources without a partition in a partitioned table.
+    """
+    from entity_subscription.models import Source
+
+    partitions = existing_partitions(model)
+    return [
+        source_id for source_id in Source.objects.order_by('id').values_list('id', flat=True)
+        if partition_name(model, source_id) not in partitions
+    ]
+
+
+def partition_statements(model, source_ids, sequence):
+    """Return the SQL converting a table into one partitioned by source.
+
+    The rows are copied into the partitioned table, so this takes an
+    exclusive lock on the table for as long as the copy lasts.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    old_table = table + '_unpartitioned'
+    statements = [
+        'ALTER TABLE {0} RENAME TO {1}'.format(qn(table), qn(old_table)),
+        'ALTER SEQUENCE {0} OWNED BY NONE'.format(sequence),
+        'CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS) PARTITION BY LIST (source_id)'.format(
+            qn(table), qn(old_table)
+        ),
+        'ALTER SEQUENCE {0} OWNED BY {1}.id'.format(sequence, qn(table)),
+        'CREATE TABLE {0} PARTITION OF {1} FOR VALUES IN (NULL)'.format(qn(partition_name(model, None)), qn(table)),
+        'CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(qn(default_partition_name(model)), qn(table)),
+    ]
+    statements.extend(
+        'CREATE TABLE {0} PARTITION OF {1} FOR VALUES IN ({2})'.format(
+            qn(partition_name(model, source_id)), qn(table), int(source_id)
+        )
+        for source_id in source_ids
+    )
+    statements.extend(_index_and_foreign_key_statements(model, '_partitioned'))
+    statements.extend([
+        'INSERT INTO {0} SELECT * FROM {1}'.format(qn(table), qn(old_table)),
+        'DROP TABLE {0}'.format(qn(old_table)),
+    ])
+    return statements
+
+
+def unpartition_statements(model, sequence):
+    """Return the SQL converting a partitioned table back into a plain table.
+    """
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    old_table = table + '_partitioned'
+    statements = [
+        'ALTER TABLE {0} RENAME TO {1}'.format(qn(table), qn(old_table)),
+        'ALTER SEQUENCE {0} OWNED BY NONE'.format(sequence),
+        'CREATE TABLE {0} (LIKE {1} INCLUDING DEFAULTS)'.format(qn(table), qn(old_table)),
+        'ALTER TABLE {0} ADD PRIMARY KEY (id)'.format(qn(table)),
+        'ALTER SEQUENCE {0} OWNED BY {1}.id'.format(sequence, qn(table)),
+    ]
+    statements.extend(_index_and_foreign_key_statements(model, '')[1:])
+    statements.extend([
+        'INSERT INTO {0} SELECT * FROM {1}'.format(qn(table), qn(old_table)),
+        'DROP TABLE {0}'.format(qn(old_table)),
+    ])
+    return statements
+
+
+def create_partition_statements(model, source_id):
+    """Return the SQL adding a partition for a source to a partitioned table.
+
+    Rows of the source already in the default partition are moved
+    into the new partition.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    partition = qn(partition_name(model, source_id))
+    default_partition = qn(default_partition_name(model))
+    source_id = int(source_id)
+    return [
+        'ALTER TABLE {0} DETACH PARTITION {1}'.format(table, default_partition),
+        'CREATE TABLE {0} PARTITION OF {1} FOR VALUES IN ({2})'.format(partition, table, source_id),
+        'INSERT INTO {0} SELECT * FROM {1} WHERE source_id = {2}'.format(table, default_partition, source_id),
+        'DELETE FROM {0} WHERE source_id = {1}'.format(default_partition, source_id),
+        'ALTER TABLE {0} ATTACH PARTITION {1} DEFAULT'.format(table, default_partition),
+    ]
+
+
+def partition_table(model):
+    """Convert a table into one partitioned by source, if it is not already.
+    """
+    from entity_subscription.models import Source
+
+    if is_partitioned(model):
+        return False
+    source_ids = Source.objects.order_by('id').values_list('id', flat=True)
+    _execute(partition_statements(model, source_ids, _sequence(model)))
+    return True
+
+
+def unpartition_table(model):
+    """Convert a partitioned table back into a plain table, if it is partitioned.
+    """
+    if not is_partitioned(model):
+        return False
+    _execute(unpartition_statements(model, _sequence(model)))
+    return True
+
+
+def create_missing_partitions(model):
+    """Create the partitions of every source without one. Returns the source ids.
+    """
+    source_ids = missing_source_ids(model)
+    for source_id in source_ids:
+        _execute(create_partition_statements(model, source_id))
+    return source_ids
+
+
+def source_saved(sender, instance, created, **kwargs):
+    """Create the partitions of a new source, when partitioning is enabled.
+    """
+    if not created or not partitioning_enabled():
+        return
+    for model in partitioned_models():
+        if is_partitioned(model):
+            _execute(create_partition_statements(model, instance.id))
+
+
+def _index_and_foreign_key_statements(model, suffix):
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    statements = ['CREATE INDEX {0} ON {1} (id)'.format(qn('{0}_id{1}'.format(table, suffix)), qn(table))]
+    for field in model._meta.fields:
+        if field.rel is None:
+            continue
+        statements.append('CREATE INDEX {0} ON {1} ({2})'.format(
+            qn('{0}_{1}{2}'.format(table, field.column, suffix)), qn(table), qn(field.column)
+        ))
+        statements.append(
+            'ALTER TABLE {0} ADD FOREIGN KEY ({1}) REFERENCES {2} ({3}) DEFERRABLE INITIALLY DEFERRED'.format(
+                qn(table), qn(field.column), qn(field.rel.to._meta.db_table), qn(field.rel.get_related_field().column)
+            )
+        )
+    return statements
+
+
+def _sequence(model):
+    cursor = connection.cursor()
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [model._meta.db_table, 'id'])
+    return cursor.fetchone()[0]
+
+
+def _execute(statements):
+    with transaction.atomic(using=connection.alias):
+        cursor = connection.cursor()
+        # Tables with deferred foreign key checks still pending, from
+        # rows written earlier in the transaction, can not be dropped
+        # or detached.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        for statement in statements:
+            cursor.execute(statement)
@@ -0,0 +1,130 @@
+"""Find and remove rows that do not change any effective subscription.
+
+Three kinds of rows are redundant:
+
+- Duplicates: `Subscription` or `Unsubscribe` rows with the same key
+  as an older row.
+
+- Covered subscriptions: individual `Subscription` rows for an entity
+  that a group `Subscription` on one of its super-entities already
+  subscribes to the same source and medium, or to every source or
+  medium.
+
+- Unneeded unsubscribes: `Unsubscribe` rows for a source and medium
+  the entity is not subscribed to in the first place.
+
+Removing covered subscriptions and unneeded unsubscribes keeps the
+current effective state, but not necessarily future states: if the
+group subscription is later removed, or a new one is added, the
+removed rows would have made a difference.
+"""
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+
+from entity_subscription.models import Subscription, Unsubscribe, _wildcard_patterns
+from entity_subscription.utils import id_chunks, id_list
+
+
+def duplicate_subscription_ids():
+    """Yield the ids of subscriptions duplicating an older subscription.
+    """
+    return _duplicate_ids(Subscription, ['entity', 'source', 'medium', 'subentity_kind'])
+
+
+def duplicate_unsubscribe_ids():
+    """Yield the ids of unsubscribes duplicating an older unsubscribe.
+    """
+    return _duplicate_ids(Unsubscribe, ['entity', 'source', 'medium'])
+
+
+def covered_subscription_ids():
+    """Return the ids of individual subscriptions a group subscription covers.
+    """
+    group_subscription = 'entity__super_relationships__super_entity__subscription__'
+    covers_source = Q(**{group_subscription + 'source__isnull': True}) | Q(**{
+        group_subscription + 'source': F('source'),
+    })
+    covers_medium = Q(**{group_subscription + 'medium__isnull': True}) | Q(**{
+        group_subscription + 'medium': F('medium'),
+    })
+    return Subscription.objects.filter(covers_source, covers_medium, **{
+        'subentity_kind__isnull': True,
+        group_subscription + 'subentity_kind': F('entity__entity_kind'),
+    }).values_list('id', flat=True).distinct()
+
+
+def unneeded_unsubscribe_ids(chunk_size=1000):
+    """Yield the ids of unsubscribes from something that is not subscribed to.
+
+    Unsubscribes are checked `chunk_size` at a time, each chunk with
+    the fixed number of queries of the bulk subscription resolution.
+    A wildcard unsubscribe is needed if the entity is subscribed to
+    any source or medium it covers.
+    """
+    rows = Unsubscribe.objects.values_list('id', 'entity', 'source', 'medium').order_by('id')
+    for chunk in _chunks(rows.iterator(), chunk_size):
+        entity_ids = set(row[1] for row in chunk)
+        source_ids = set(row[2] for row in chunk)
+        if None in source_ids:
+            source_ids = None
+        entity_ids, source_ids, subscribed = Subscription.objects._subscription_keys(entity_ids, source_ids)
+        unsubscribe_ids = defaultdict(list)
+        for row in chunk:
+            unsubscribe_ids[row[1:]].append(row[0])
+        needed = set()
+        for key in subscribed:
+            for pattern in _wildcard_patterns(key):
+                needed.update(unsubscribe_ids.get(pattern, ()))
+        for row in chunk:
+            if row[0] not in needed:
+                yield row[0]
+
+
+def delete_in_batches(model, ids, batch_size=1000, sleep=0):
+    """Delete rows by id, each batch in its own short transaction.
+
+    Returns the number of rows deleted. Sleeping between batches gives
+    concurrent writers a chance to take the locks they are waiting on.
+    """
+    deleted = 0
+    for chunk in _chunks(ids, batch_size):
+        with transaction.atomic():
+            model.objects.filter(id__in=chunk).delete()
+        deleted += len(chunk)
+        if sleep:
+            time.sleep(sleep)
+    return deleted
+
+
+def _duplicate_ids(model, fields):
+    """Yield the ids of the rows of a model with the same fields as an older row.
+
+    The keys with more than one row are found with a GROUP BY, so only
+    the rows of entities with duplicates are read afterwards, in
+    chunks of entities on backends that can not bind an id list as one
+    parameter.
+    """
+    groups = model.objects.values(*fields).annotate(n=Count('id'), first_id=Min('id')).filter(n__gt=1).order_by()
+    first_ids = dict((tuple(group[field] for field in fields), group['first_id']) for group in groups)
+    if not first_ids:
+        return
+    for entity_ids in id_chunks(set(key[0] for key in first_ids), model):
+        rows = model.objects.filter(entity__id__in=id_list(entity_ids, model)).values_list(*(fields + ['id']))
+        for row in rows.order_by('id').iterator():
+            first_id = first_ids.get(row[:-1])
+            if first_id is not None and row[-1] != first_id:
+                yield row[-1]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,59 @@
+"""A database router keeping the subscription tables on their own database.
+
+Add `entity_subscription.routers.SubscriptionRouter` to the
+`DATABASE_ROUTERS` setting, and name the database in the
+`ENTITY_SUBSCRIPTION_DATABASE` setting. Every model of the app is then
+read from and written to that database, while entities, entity kinds
+and relationships stay on theirs.
+"""
+from django.conf import settings
+
+
+APP_LABEL = 'entity_subscription'
+
+
+class SubscriptionRouter(object):
+    """Routes the models of the app to the `ENTITY_SUBSCRIPTION_DATABASE` database.
+
+    Models of other apps are left to the other routers, or the default
+    database.
+    """
+    def _database(self, model):
+        if model._meta.app_label == APP_LABEL:
+            return getattr(settings, 'ENTITY_SUBSCRIPTION_DATABASE', None)
+        return None
+
+    def _related_database(self, model, hints, method):
+        """Return the database of a model, with objects related to subscriptions kept on their own database.
+
+        Without it, Django would look up the entity of a subscription
+        on the subscription's own database.
+        """
+        # Imported here, since routers are loaded while `django.db` is.
+        from django.db import router
+
+        database = self._database(model)
+        instance = hints.get('instance')
+        if database is None and instance is not None and instance._meta.app_label == APP_LABEL:
+            return getattr(router, method)(model)
+        return database
+
+    def db_for_read(self, model, **hints):
+        return self._related_database(model, hints, 'db_for_read')
+
+    def db_for_write(self, model, **hints):
+        return self._related_database(model, hints, 'db_for_write')
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Subscriptions and unsubscribes point at entities and entity
+        # kinds on the other database.
+        app_labels = set([obj1._meta.app_label, obj2._meta.app_label])
+        if APP_LABEL in app_labels and app_labels <= set([APP_LABEL, 'entity']):
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        database = self._database(model)
+        if database is None:
+            return None
+        return db == database
@@ -0,0 +1,11 @@
+from django.dispatch import Signal
+
+
+# Sent once by `set_preferences`, after an entity's subscriptions or
+# unsubscribes have been replaced, and by `transfer.import_rows` for
+# every entity whose rows were imported or replaced, in place of the
+# row signals that their bulk statements do not send. The sender is
+# the `Subscription` or `Unsubscribe` model, `added` and `removed` are
+# sets of (source id, medium id) pairs, and `subentity_kind` is only
+# given for subscriptions.
+preferences_changed = Signal(providing_args=['entity', 'subentity_kind', 'added', 'removed'])
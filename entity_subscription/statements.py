@@ -0,0 +1,123 @@
+"""An optional raw SQL fast path for individual subscription checks.
+
+`Subscription.objects.is_subscribed` without a `subentity_kind` is
+usually the most frequent call an application makes. Through the ORM,
+it builds and compiles two querysets and makes two round trips on
+every call. With the `ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS` setting
+enabled, it instead runs a single precompiled statement that checks
+the subscription and the absence of an unsubscribe together.
+
+On PostgreSQL, the statement is prepared on the server once per
+database connection and run with EXECUTE afterwards, so it is neither
+parsed nor planned again. This does not work behind a connection
+pooler in transaction pooling mode, which may hand each transaction a
+different server session. Other backends run the same SQL text, which
+the sqlite3 module keeps compiled in its per-connection statement
+cache.
+
+The `UnsubscribeFilter` is not consulted, since the unsubscribe check
+costs no extra round trip here.
+"""
+import re
+
+from django.conf import settings
+
+from entity_subscription.utils import get_id, split_databases, subscription_connection as connection
+
+
+_IS_SUBSCRIBED = """
+SELECT EXISTS (
+    SELECT 1 FROM {subscription} s
+    WHERE (s.source_id = :source OR s.source_id IS NULL)
+    AND (s.medium_id = :medium OR s.medium_id IS NULL)
+    AND (
+        (s.subentity_kind_id IS NULL AND s.entity_id = :entity)
+        OR (
+            s.subentity_kind_id = COALESCE(:kind, (SELECT e.entity_kind_id FROM {entity} e WHERE e.id = :entity))
+            AND s.entity_id IN (SELECT r.super_entity_id FROM {relationship} r WHERE r.sub_entity_id = :entity)
+        )
+    )
+) AND NOT EXISTS (
+    SELECT 1 FROM {unsubscribe} u
+    WHERE u.entity_id = :entity
+    AND (u.source_id = :source OR u.source_id IS NULL)
+    AND (u.medium_id = :medium OR u.medium_id IS NULL)
+)
+"""
+
+_PARAMETERS = ('source', 'medium', 'entity', 'kind')
+
+_STATEMENT_NAME = 'entity_subscription_is_subscribed'
+
+
+def use_prepared_statements():
+    """Return True if the `ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS` setting is enabled.
+
+    The statement joins the subscription and entity tables, so it is
+    never used with them on different databases.
+    """
+    return getattr(settings, 'ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS', False) and not split_databases()
+
+
+def is_subscribed(source, medium, entity):
+    """Return True if an entity is subscribed to a source and medium.
+
+    Behaves exactly like `Subscription.objects.is_subscribed` without
+    a `subentity_kind`, with a single query. The arguments may be
+    model instances or ids.
+    """
+    from entity.models import Entity
+
+    values = {
+        'source': get_id(source),
+        'medium': get_id(medium),
+        'entity': get_id(entity),
+        'kind': entity.entity_kind_id if isinstance(entity, Entity) else None,
+    }
+    sql, parameters = _statement()
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        _prepare(cursor, sql)
+        cursor.execute(
+            'EXECUTE {0}({1})'.format(_STATEMENT_NAME, ', '.join(['%s'] * len(_PARAMETERS))),
+            [values[name] for name in _PARAMETERS]
+        )
+    else:
+        cursor.execute(_PARAMETER_RE.sub('%s', sql), [values[name] for name in parameters])
+    return bool(cursor.fetchone()[0])
+
+
+_PARAMETER_RE = re.compile(r':(\w+)')
+
+_statement_cache = []
+
+
+def _statement():
+    """Return the statement's SQL, with `:name` parameters, and the parameter names in order.
+
+    Built once, on first use.
+    """
+    if not _statement_cache:
+        from entity.models import Entity, EntityRelationship
+        from entity_subscription.models import Subscription, Unsubscribe
+
+        sql = _IS_SUBSCRIBED.format(
+            subscription=connection.ops.quote_name(Subscription._meta.db_table),
+            unsubscribe=connection.ops.quote_name(Unsubscribe._meta.db_table),
+            entity=connection.ops.quote_name(Entity._meta.db_table),
+            relationship=connection.ops.quote_name(EntityRelationship._meta.db_table),
+        )
+        _statement_cache.append((sql, _PARAMETER_RE.findall(sql)))
+    return _statement_cache[0]
+
+
+def _prepare(cursor, sql):
+    """Prepare the statement on the server, once per database connection.
+    """
+    if getattr(connection, '_entity_subscription_prepared', None) is connection.connection:
+        return
+    sql = _PARAMETER_RE.sub(lambda match: '${0}'.format(_PARAMETERS.index(match.group(1)) + 1), sql)
+    cursor.execute('PREPARE {0} ({1}) AS {2}'.format(
+        _STATEMENT_NAME, ', '.join(['integer'] * len(_PARAMETERS)), sql
+    ))
+    connection._entity_subscription_prepared = connection.connection
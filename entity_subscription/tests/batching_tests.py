@@ -0,0 +1,172 @@
+from django.http import HttpRequest
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+
+from entity_subscription.batching import current_batch, subscription_batch, SubscriptionBatchMiddleware
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class SubscriptionBatchTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source_1, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source_1)
+
+    def test_is_subscribed_matches_unbatched(self):
+        checks = [
+            (source, medium, entity)
+            for source in [self.source_1, self.source_2]
+            for medium in [self.medium_1, self.medium_2]
+            for entity in [self.sub_e1, self.sub_e2, self.ind_e]
+        ]
+        expected = [Subscription.objects.is_subscribed(*check) for check in checks]
+        with subscription_batch():
+            results = [Subscription.objects.is_subscribed(*check) for check in checks]
+        self.assertEqual([bool(r) for r in results], expected)
+
+    def test_mediums_subscribed_matches_unbatched(self):
+        with subscription_batch():
+            sub_e1_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1)
+            sub_e2_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e2)
+            ind_e_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.ind_e)
+        self.assertEqual(list(sub_e1_mediums), [self.medium_1])
+        self.assertEqual(len(sub_e2_mediums), 0)
+        self.assertFalse(sub_e2_mediums)
+        self.assertIn(self.medium_2, ind_e_mediums)
+        self.assertNotIn(self.medium_1, ind_e_mediums)
+
+    def test_medium_ids(self):
+        with subscription_batch():
+            sub_e1_medium_ids = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1, ids=True)
+            ind_e_medium_ids = Subscription.objects.mediums_subscribed(self.source_1, self.ind_e, ids=True)
+            with self.assertNumQueries(3):
+                self.assertEqual(sub_e1_medium_ids.value, frozenset([self.medium_1.id]))
+            self.assertIn(self.medium_2, ind_e_medium_ids)
+
+    def test_mediums_fetched_together(self):
+        with subscription_batch():
+            sub_e1_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1)
+            ind_e_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.ind_e)
+            with self.assertNumQueries(4):
+                self.assertEqual(list(sub_e1_mediums), [self.medium_1])
+            with self.assertNumQueries(0):
+                self.assertEqual(list(ind_e_mediums), [self.medium_2])
+
+    def test_resolved_together(self):
+        with subscription_batch():
+            results = [
+                Subscription.objects.is_subscribed(self.source_1, self.medium_1, entity)
+                for entity in [self.sub_e1, self.sub_e2, self.ind_e]
+            ]
+            with self.assertNumQueries(3):
+                self.assertEqual([bool(r) for r in results], [True, False, False])
+            with self.assertNumQueries(0):
+                self.assertTrue(results[0])
+
+    def test_checks_after_resolution(self):
+        with subscription_batch():
+            first = Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1)
+            self.assertTrue(first)
+            second = Subscription.objects.is_subscribed(self.source_1, self.medium_2, self.ind_e)
+            self.assertTrue(second)
+
+    def test_same_check_after_resolution(self):
+        with subscription_batch() as batch:
+            first = Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1)
+            self.assertTrue(first)
+            with self.assertNumQueries(0):
+                second = Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1)
+                self.assertTrue(second)
+                batch.resolve()
+
+    def test_lazy_result_comparisons(self):
+        with subscription_batch():
+            subscribed = Subscription.objects.is_subscribed(self.source_2, self.medium_1, self.sub_e1)
+            mediums = Subscription.objects.mediums_subscribed(self.source_2, self.sub_e1)
+        self.assertEqual(subscribed, False)
+        self.assertNotEqual(subscribed, True)
+        self.assertEqual(repr(subscribed), 'False')
+        self.assertEqual(repr(mediums), '[]')
+
+    def test_group_checks_not_deferred(self):
+        with subscription_batch():
+            is_subscribed = Subscription.objects.is_subscribed(
+                self.source_1, self.medium_1, self.super_e, self.ek
+            )
+        self.assertIs(is_subscribed, True)
+
+    def test_unrequested_combinations_ignored(self):
+        with subscription_batch():
+            sub_e1_mediums = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1, ids=True)
+            ind_e_mediums = Subscription.objects.mediums_subscribed(self.source_2, self.ind_e, ids=True)
+        self.assertEqual(sub_e1_mediums.value, frozenset([self.medium_1.id]))
+        self.assertEqual(ind_e_mediums.value, frozenset())
+
+    def test_scope_is_removed(self):
+        with subscription_batch() as batch:
+            self.assertIs(current_batch(), batch)
+        self.assertIsNone(current_batch())
+
+
+class SubscriptionBatchMiddlewareTest(TestCase):
+    def test_response(self):
+        middleware = SubscriptionBatchMiddleware()
+        request = HttpRequest()
+        middleware.process_request(request)
+        self.assertIsNotNone(current_batch())
+        response = middleware.process_response(request, 'response')
+        self.assertEqual(response, 'response')
+        self.assertIsNone(current_batch())
+
+    def test_exception(self):
+        middleware = SubscriptionBatchMiddleware()
+        request = HttpRequest()
+        middleware.process_request(request)
+        middleware.process_exception(request, ValueError())
+        self.assertIsNone(current_batch())
+        middleware.process_response(request, 'response')
+        self.assertIsNone(current_batch())
+
+    def test_only_own_batch_removed(self):
+        middleware = SubscriptionBatchMiddleware()
+        outer_request = HttpRequest()
+        inner_request = HttpRequest()
+        middleware.process_request(outer_request)
+        outer_batch = current_batch()
+        middleware.process_request(inner_request)
+        middleware.process_exception(outer_request, ValueError())
+        self.assertIsNot(current_batch(), outer_batch)
+        self.assertIsNotNone(current_batch())
+        middleware.process_response(inner_request, 'response')
+        self.assertIsNone(current_batch())
+
+    def test_nested_scope_kept(self):
+        middleware = SubscriptionBatchMiddleware()
+        request = HttpRequest()
+        middleware.process_request(request)
+        with subscription_batch() as batch:
+            middleware.process_exception(request, ValueError())
+            self.assertIs(current_batch(), batch)
+        self.assertIsNone(current_batch())
+
+    def test_response_without_request(self):
+        middleware = SubscriptionBatchMiddleware()
+        middleware.process_response(None, 'response')
+        self.assertIsNone(current_batch())
+
+    def test_exception_without_request(self):
+        middleware = SubscriptionBatchMiddleware()
+        middleware.process_exception(None, ValueError())
+        self.assertIsNone(current_batch())
@@ -0,0 +1,139 @@
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+
+from entity_subscription.bloom import (
+    BloomFilter, UnsubscribeFilter, disable_unsubscribe_filter, enable_unsubscribe_filter, get_unsubscribe_filter
+)
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class BloomFilterTest(TestCase):
+    def test_contains_added_keys(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add((i, 1, 2))
+        self.assertTrue(all((i, 1, 2) in bloom_filter for i in range(1000)))
+        # Keys that were false positives when added are not counted.
+        self.assertLessEqual(bloom_filter.count, 1000)
+        self.assertGreater(bloom_filter.count, 990)
+
+    def test_count_distinct_keys(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(3):
+            bloom_filter.add((1, 1, 2))
+        self.assertEqual(bloom_filter.count, 1)
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        self.assertEqual(bloom_filter.false_positive_rate, 0)
+        for i in range(1000):
+            bloom_filter.add((i, 1, 2))
+        self.assertAlmostEqual(bloom_filter.false_positive_rate, 0.01, places=3)
+        false_positives = sum(1 for i in range(1000, 11000) if (i, 1, 2) in bloom_filter)
+        self.assertLess(false_positives, 300)
+
+    def test_size(self):
+        # About 9.6 bits per key for a 1% error rate.
+        bloom_filter = BloomFilter(10000, 0.01)
+        self.assertEqual(bloom_filter.size_bytes, 11982)
+        self.assertEqual(bloom_filter.num_hashes, 7)
+
+
+class UnsubscribeFilterTest(TestCase):
+    def setUp(self):
+        self.entity, self.source, self.medium = G(Entity), G(Source), G(Medium)
+
+    def tearDown(self):
+        disable_unsubscribe_filter()
+
+    def test_rebuild(self):
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        unsubscribe_filter = UnsubscribeFilter(100)
+        self.assertFalse(unsubscribe_filter.might_be_unsubscribed(self.entity, self.source, self.medium))
+        unsubscribe_filter.rebuild()
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.entity, self.source, self.medium))
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.entity.id, self.source.id))
+        self.assertGreater(unsubscribe_filter.size_bytes, 0)
+        self.assertGreater(unsubscribe_filter.false_positive_rate, 0)
+
+    def test_sized_for_three_keys_per_row(self):
+        unsubscribe_filter = UnsubscribeFilter(100)
+        self.assertEqual(unsubscribe_filter.size_bytes, BloomFilter(300).size_bytes)
+        unsubscribe_filter.add(self.entity, self.source, self.medium)
+        unsubscribe_filter.add(self.entity, self.source, self.medium)
+        self.assertEqual(unsubscribe_filter.bloom_filter.count, 3)
+
+    def test_any_source(self):
+        unsubscribe_filter = UnsubscribeFilter(100)
+        self.assertFalse(unsubscribe_filter.might_be_unsubscribed(self.entity))
+        unsubscribe_filter.add(self.entity, self.source, self.medium)
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.entity))
+        self.assertFalse(unsubscribe_filter.might_be_unsubscribed(G(Entity)))
+
+    def test_enable_and_disable(self):
+        unsubscribe_filter = enable_unsubscribe_filter(100)
+        self.assertIs(get_unsubscribe_filter(), unsubscribe_filter)
+        disable_unsubscribe_filter()
+        self.assertIsNone(get_unsubscribe_filter())
+
+    def test_saved_unsubscribes_added(self):
+        unsubscribe_filter = enable_unsubscribe_filter(100)
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.entity, self.source, self.medium))
+
+    def test_preferences_added(self):
+        unsubscribe_filter = enable_unsubscribe_filter(100)
+        Unsubscribe.objects.set_preferences(self.entity, [(self.source, None)])
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.entity, self.source, self.medium))
+
+    def test_saved_while_disabled_not_added(self):
+        unsubscribe_filter = enable_unsubscribe_filter(100)
+        disable_unsubscribe_filter()
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        self.assertFalse(unsubscribe_filter.might_be_unsubscribed(self.entity, self.source, self.medium))
+
+
+class SubscriptionManagerUnsubscribeFilterTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.super_e, medium=self.medium_2, source=self.source, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source)
+        enable_unsubscribe_filter(100)
+
+    def tearDown(self):
+        disable_unsubscribe_filter()
+
+    def test_is_subscribed_skips_unsubscribe_query(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e1))
+
+    def test_is_subscribed_unsubscribed(self):
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e2))
+
+    def test_mediums_subscribed(self):
+        mediums = Subscription.objects.mediums_subscribed(self.source, self.sub_e1)
+        self.assertEqual(set(mediums), set([self.medium_1, self.medium_2]))
+        mediums = Subscription.objects.mediums_subscribed(self.source, self.sub_e2)
+        self.assertEqual(list(mediums), [self.medium_2])
+
+    def test_filter_not_subscribed(self):
+        entities = Subscription.objects.filter_not_subscribed(self.source, self.medium_1, [self.sub_e1, self.sub_e2])
+        self.assertEqual(list(entities), [self.sub_e1])
+        entities = Subscription.objects.filter_not_subscribed(self.source, self.medium_2, [self.sub_e1])
+        self.assertEqual(list(entities), [self.sub_e1])
+
+    def test_effective_subscriptions(self):
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e1], [self.source])
+        self.assertEqual(len(subscribed), 2)
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e2], [self.source])
+        self.assertEqual(subscribed, set([(self.sub_e2.id, self.source.id, self.medium_2.id)]))
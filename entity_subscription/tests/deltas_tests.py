@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django_dynamic_fixture import G, N
+from entity.models import Entity, EntityRelationship, EntityKind
+
+from entity_subscription.deltas import AudienceDelta, relationship_delta, subscription_delta
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class DeltaTestBase(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.other_ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.super_e = G(Entity)
+        self.other_super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.sub_e3 = G(Entity, entity_kind=self.ek)
+        self.other_e = G(Entity, entity_kind=self.other_ek)
+        for sub_e in [self.sub_e1, self.sub_e2, self.sub_e3, self.other_e]:
+            G(EntityRelationship, sub_entity=sub_e, super_entity=self.super_e)
+
+
+class SubscriptionDeltaTest(DeltaTestBase):
+    def test_group_subscription(self):
+        G(Subscription, entity=self.sub_e2, medium=self.medium_1, source=self.source_1, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e3, medium=self.medium_1, source=self.source_1)
+        subscription = N(
+            Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek
+        )
+        changed = {(self.source_1.id, self.medium_1.id): set([self.sub_e1.id])}
+
+        self.assertEqual(subscription_delta(subscription), AudienceDelta(changed, {}))
+        subscription.save()
+        self.assertEqual(subscription_delta(subscription), AudienceDelta(changed, {}))
+        self.assertEqual(subscription_delta(subscription, deleted=True), AudienceDelta({}, changed))
+        subscription.delete()
+        self.assertEqual(subscription_delta(subscription, deleted=True), AudienceDelta({}, changed))
+
+    def test_covered_by_other_group_subscription(self):
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.other_super_e)
+        G(Subscription, entity=self.other_super_e, medium=None, source=self.source_1, subentity_kind=self.ek)
+        subscription = G(
+            Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek
+        )
+        self.assertEqual(subscription_delta(subscription, deleted=True), AudienceDelta({}, {
+            (self.source_1.id, self.medium_1.id): set([self.sub_e2.id, self.sub_e3.id]),
+        }))
+
+    def test_wildcard_individual_subscription(self):
+        G(Unsubscribe, entity=self.other_e, medium=self.medium_2, source=None)
+        subscription = N(Subscription, entity=self.other_e, medium=None, source=self.source_2, subentity_kind=None)
+        self.assertEqual(subscription_delta(subscription), AudienceDelta({
+            (self.source_2.id, self.medium_1.id): set([self.other_e.id]),
+        }, {}))
+
+    def test_no_entities(self):
+        subscription = N(
+            Subscription, entity=self.other_super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(subscription_delta(subscription), AudienceDelta({}, {}))
+
+
+class RelationshipDeltaTest(DeltaTestBase):
+    def setUp(self):
+        super(RelationshipDeltaTest, self).setUp()
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.super_e, medium=self.medium_2, source=None, subentity_kind=self.ek)
+        G(Subscription, entity=self.other_super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+
+    def test_relationship(self):
+        new_e = G(Entity, entity_kind=self.ek)
+        G(Unsubscribe, entity=new_e, medium=self.medium_2, source=self.source_2)
+        relationship = N(EntityRelationship, sub_entity=new_e, super_entity=self.super_e)
+        changed = {
+            (self.source_1.id, self.medium_1.id): set([new_e.id]),
+            (self.source_1.id, self.medium_2.id): set([new_e.id]),
+        }
+
+        self.assertEqual(relationship_delta(relationship), AudienceDelta(changed, {}))
+        relationship.save()
+        self.assertEqual(relationship_delta(relationship), AudienceDelta(changed, {}))
+        relationship.delete()
+        self.assertEqual(relationship_delta(relationship, deleted=True), AudienceDelta({}, changed))
+
+    def test_covered_by_other_super_entity(self):
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.other_super_e)
+        relationship = EntityRelationship.objects.get(sub_entity=self.sub_e1, super_entity=self.super_e)
+        self.assertEqual(relationship_delta(relationship, deleted=True), AudienceDelta({}, {
+            (self.source_1.id, self.medium_2.id): set([self.sub_e1.id]),
+            (self.source_2.id, self.medium_2.id): set([self.sub_e1.id]),
+        }))
+
+    def test_other_kind(self):
+        relationship = N(EntityRelationship, sub_entity=G(Entity, entity_kind=self.other_ek), super_entity=self.super_e)
+        self.assertEqual(relationship_delta(relationship), AudienceDelta({}, {}))
@@ -0,0 +1,103 @@
+from django.db import connection, connections
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from mock import patch
+
+from entity_subscription import diagnostics
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+@patch('entity_subscription.diagnostics.logger')
+class SlowQueryCaptureTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium, source=self.source, subentity_kind=self.ek)
+
+    def test_not_sampled_by_default(self, logger_mock):
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e))
+        self.assertFalse(logger_mock.warning.called)
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=0.5, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=0)
+    @patch('entity_subscription.diagnostics.random.random', return_value=0.5)
+    def test_call_not_sampled(self, random_mock, logger_mock):
+        Unsubscribe.objects.is_unsubscribed(self.source, self.medium, self.sub_e)
+        self.assertFalse(logger_mock.warning.called)
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=1, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=0)
+    def test_slow_queries_logged(self, logger_mock):
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e.id))
+        self.assertEqual(len(logger_mock.warning.mock_calls), 2)
+        extra = logger_mock.warning.mock_calls[0][2]['extra']
+        self.assertEqual(extra['method'], 'is_subscribed')
+        self.assertEqual(extra['arguments'], {
+            'source': self.source.id, 'medium': self.medium.id, 'entity': self.sub_e.id, 'subentity_kind': None,
+        })
+        self.assertNotIn('EXPLAIN failed', extra['plan'])
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=1, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=0)
+    def test_querysets_evaluated(self, logger_mock):
+        entities = [self.sub_e] + [G(Entity, entity_kind=self.ek) for i in range(11)]
+        subscribed = Subscription.objects.filter_not_subscribed(self.source, self.medium, entities)
+        with self.assertNumQueries(0):
+            self.assertEqual(list(subscribed), [self.sub_e])
+        extra = logger_mock.warning.mock_calls[0][2]['extra']
+        self.assertEqual(extra['method'], 'filter_not_subscribed')
+        self.assertTrue(extra['arguments']['entities'].endswith('(12 in total)'))
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=1, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=60000)
+    def test_fast_queries_not_logged(self, logger_mock):
+        list(Subscription.objects.mediums_subscribed(self.source, self.sub_e))
+        self.assertFalse(logger_mock.warning.called)
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=1, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=60000)
+    def test_connection_restored(self, logger_mock):
+        use_debug_cursor = connection.use_debug_cursor
+        with self.assertNumQueries(2):
+            Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e)
+        self.assertEqual(connection.use_debug_cursor, use_debug_cursor)
+        self.assertNotIn('make_debug_cursor', connections['default'].__dict__)
+
+    @override_settings(ENTITY_SUBSCRIPTION_SLOW_QUERY_SAMPLE_RATE=1, ENTITY_SUBSCRIPTION_SLOW_QUERY_MS=60000)
+    def test_queries_not_logged_to_connection(self, logger_mock):
+        queries = len(connection.queries)
+        Subscription.objects.is_subscribed(self.source, self.medium, self.sub_e)
+        self.assertEqual(len(connection.queries), queries)
+
+
+class ExplainTest(TestCase):
+    def test_explain(self):
+        self.assertTrue(diagnostics.explain('SELECT id FROM entity_subscription_medium WHERE id = %s', [1]))
+
+    def test_explain_failure(self):
+        self.assertTrue(diagnostics.explain('NOT A QUERY').startswith('EXPLAIN failed'))
+        self.assertEqual(Medium.objects.count(), 0)
+
+    @patch('entity_subscription.diagnostics.connection')
+    def test_postgresql(self, connection_mock):
+        connection_mock.alias = 'default'
+        connection_mock.vendor = 'postgresql'
+        connection_mock.cursor.return_value.fetchall.return_value = [('Seq Scan',)]
+        self.assertEqual(diagnostics.explain('SELECT 1'), 'Seq Scan')
+        connection_mock.cursor.return_value.execute.assert_called_once_with('EXPLAIN (ANALYZE, BUFFERS) SELECT 1', None)
+
+    @patch('entity_subscription.diagnostics.connection')
+    def test_sqlite(self, connection_mock):
+        connection_mock.alias = 'default'
+        connection_mock.vendor = 'sqlite'
+        connection_mock.cursor.return_value.fetchall.return_value = [(0, 0, 0, 'SCAN TABLE entity_subscription_medium')]
+        self.assertEqual(diagnostics.explain('SELECT 1'), '0 0 0 SCAN TABLE entity_subscription_medium')
+        connection_mock.cursor.return_value.execute.assert_called_once_with('EXPLAIN QUERY PLAN SELECT 1', None)
+
+    @patch('entity_subscription.diagnostics.connection')
+    def test_other_backends(self, connection_mock):
+        connection_mock.alias = 'default'
+        connection_mock.vendor = 'mysql'
+        connection_mock.cursor.return_value.fetchall.return_value = [(1, 'SIMPLE')]
+        self.assertEqual(diagnostics.explain('SELECT 1'), '1 SIMPLE')
@@ -0,0 +1,166 @@
+from django.contrib.auth.models import Group, User
+from django.core.cache import get_cache
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.config import EntityConfig, entity_registry
+from entity.models import Entity, EntityRelationship, EntityKind, sync_entities
+from manager_utils import post_bulk_operation
+from mock import patch
+
+from entity_subscription.hierarchy import (
+    HierarchyCache, disable_hierarchy_cache, enable_hierarchy_cache, get_hierarchy_cache
+)
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class HierarchyCacheTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.super_e1 = G(Entity)
+        self.super_e2 = G(Entity)
+        self.sub_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e, super_entity=self.super_e1)
+        G(EntityRelationship, sub_entity=self.sub_e, super_entity=self.super_e2)
+
+    def test_get(self):
+        hierarchy_cache = HierarchyCache()
+        expected = (self.ek.id, tuple(sorted([self.super_e1.id, self.super_e2.id])))
+        with self.assertNumQueries(1):
+            self.assertEqual(hierarchy_cache.get(self.sub_e), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(hierarchy_cache.get(self.sub_e.id), expected)
+
+    def test_missing_entity(self):
+        self.assertEqual(HierarchyCache().get(-1), (None, ()))
+        self.assertEqual(HierarchyCache().get(self.super_e1)[1], ())
+
+    def test_least_recently_used_evicted(self):
+        hierarchy_cache = HierarchyCache(max_entries=2)
+        hierarchy_cache.get(self.sub_e)
+        hierarchy_cache.get(self.super_e1)
+        hierarchy_cache.get(self.sub_e)
+        hierarchy_cache.get(self.super_e2)
+        self.assertEqual(len(hierarchy_cache), 2)
+        with self.assertNumQueries(0):
+            hierarchy_cache.get(self.sub_e)
+        with self.assertNumQueries(1):
+            hierarchy_cache.get(self.super_e1)
+
+    @patch('entity_subscription.hierarchy.time.time', return_value=1000)
+    def test_timeout(self, time_mock):
+        hierarchy_cache = HierarchyCache(timeout=10)
+        hierarchy_cache.get(self.sub_e)
+        time_mock.return_value = 1010
+        with self.assertNumQueries(0):
+            hierarchy_cache.get(self.sub_e)
+        time_mock.return_value = 1011
+        with self.assertNumQueries(1):
+            hierarchy_cache.get(self.sub_e)
+
+    def test_no_timeout(self):
+        hierarchy_cache = HierarchyCache(timeout=None)
+        hierarchy_cache.get(self.sub_e)
+        with self.assertNumQueries(0):
+            hierarchy_cache.get(self.sub_e)
+
+    def test_nothing_kept_in_process(self):
+        hierarchy_cache = HierarchyCache(max_entries=0)
+        hierarchy_cache.get(self.sub_e)
+        self.assertEqual(len(hierarchy_cache), 0)
+
+    def test_django_cache(self):
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache', LOCATION='hierarchy_tests')
+        HierarchyCache(cache=cache).get(self.sub_e)
+        hierarchy_cache = HierarchyCache(cache=cache)
+        with self.assertNumQueries(0):
+            self.assertEqual(hierarchy_cache.get(self.sub_e)[0], self.ek.id)
+        self.assertEqual(len(hierarchy_cache), 1)
+
+        hierarchy_cache.invalidate([self.sub_e])
+        self.assertEqual(len(hierarchy_cache), 0)
+        self.assertIsNone(cache.get(hierarchy_cache.key(self.sub_e.id)))
+
+    def test_clear(self):
+        hierarchy_cache = HierarchyCache()
+        hierarchy_cache.get(self.sub_e)
+        hierarchy_cache.clear()
+        self.assertEqual(len(hierarchy_cache), 0)
+
+
+class EnabledHierarchyCacheTest(TestCase):
+    def setUp(self):
+        self.hierarchy_cache = enable_hierarchy_cache()
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.sub_e, medium=self.medium_2, source=self.source, subentity_kind=None)
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source, subentity_kind=None)
+        G(Unsubscribe, entity=self.ind_e, medium=self.medium_2, source=self.source)
+
+    def tearDown(self):
+        disable_hierarchy_cache()
+
+    def test_checks(self):
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_2, self.ind_e.id))
+        self.assertEqual(
+            set(Subscription.objects.mediums_subscribed(self.source, self.sub_e)), set([self.medium_1, self.medium_2])
+        )
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source, self.ind_e)), [])
+        self.assertEqual(len(self.hierarchy_cache), 2)
+
+    def test_relationships_not_queried_again(self):
+        with self.assertNumQueries(3):
+            Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e)
+        with self.assertNumQueries(2):
+            Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e)
+
+    def test_invalidated_on_relationship_change(self):
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_1, self.ind_e))
+        relationship = G(EntityRelationship, sub_entity=self.ind_e, super_entity=self.super_e)
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.ind_e))
+        relationship.delete()
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_1, self.ind_e))
+
+    def test_invalidated_on_entity_change(self):
+        Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e)
+        self.sub_e.entity_kind = G(EntityKind)
+        self.sub_e.save()
+        self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e))
+
+    def test_invalidated_on_entity_sync(self):
+        class UserConfig(EntityConfig):
+            def get_super_entities(self, user):
+                return list(user.groups.all())
+
+        entity_registry.register_entity(Group)
+        entity_registry.register_entity(User, UserConfig)
+        self.addCleanup(entity_registry.entity_registry.pop, Group)
+        self.addCleanup(entity_registry.entity_registry.pop, User)
+        group = Group.objects.create(name='group')
+        user = User.objects.create(username='user')
+        user_entity = Entity.objects.get_for_obj(user)
+        self.assertEqual(self.hierarchy_cache.get(user_entity)[1], ())
+
+        # Through the membership table, so that only sync_entities
+        # writes the new relationship.
+        User.groups.through.objects.create(user=user, group=group)
+        sync_entities(user)
+        self.assertEqual(self.hierarchy_cache.get(user_entity)[1], (Entity.objects.get_for_obj(group).id,))
+
+    def test_other_bulk_operations_ignored(self):
+        Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e)
+        post_bulk_operation.send(sender=Medium, model=Medium)
+        self.assertEqual(len(self.hierarchy_cache), 1)
+
+    def test_disable(self):
+        self.assertIs(get_hierarchy_cache(), self.hierarchy_cache)
+        disable_hierarchy_cache()
+        self.assertIsNone(get_hierarchy_cache())
+        self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e))
@@ -0,0 +1,215 @@
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from fakeredis import FakeStrictRedis
+from mock import patch
+
+from entity_subscription.mirror import RedisSubscriptionMirror, connect_mirror, disconnect_mirror, get_mirror, warm
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class RedisSubscriptionMirrorTest(TestCase):
+    def setUp(self):
+        self.client = FakeStrictRedis()
+        self.client.flushall()
+        self.mirror = RedisSubscriptionMirror(self.client)
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+
+    def tearDown(self):
+        disconnect_mirror()
+
+    def assert_matches_database(self):
+        entities = [self.sub_e1, self.sub_e2, self.ind_e]
+        for medium in [self.medium_1, self.medium_2]:
+            for entity in entities:
+                self.assertEqual(
+                    self.mirror.is_subscribed(self.source, medium, entity),
+                    Subscription.objects.is_subscribed(self.source, medium, entity),
+                )
+            expected = Subscription.objects.filter_not_subscribed(self.source, medium, entities)
+            self.assertEqual(
+                set(self.mirror.filter_not_subscribed(self.source, medium, entities)),
+                set(e.id for e in expected),
+            )
+            self.assertEqual(
+                set(self.mirror.subscribed_entity_ids(self.source, medium)),
+                set(e.id for e in expected),
+            )
+
+    def test_rebuild(self):
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source)
+        self.client.sadd(self.mirror.key(self.source, self.medium_2), self.sub_e1.id)
+        self.mirror.rebuild(chunk_size=1)
+        self.assert_matches_database()
+
+    def test_rebuild_removes_stale_sets(self):
+        self.client.sadd(self.mirror.key(self.source, self.medium_1), self.sub_e1.id)
+        self.mirror.rebuild()
+        self.assertFalse(self.mirror.is_subscribed(self.source, self.medium_1, self.sub_e1))
+
+    def test_signals_keep_mirror_up_to_date(self):
+        connect_mirror(self.mirror)
+        group_sub = G(
+            Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek
+        )
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source, subentity_kind=None)
+        self.assert_matches_database()
+        unsubscribe = G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source)
+        self.assert_matches_database()
+        unsubscribe.delete()
+        self.assert_matches_database()
+        group_sub.delete()
+        self.assert_matches_database()
+
+    def test_dispatch(self):
+        calls = []
+        connect_mirror(self.mirror, dispatch=lambda *args: calls.append(args))
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(set(calls[0][2]), set([self.sub_e1.id, self.sub_e2.id]))
+        self.assertFalse(self.mirror.is_subscribed(self.source, self.medium_1, self.sub_e1))
+
+    def test_preferences_keep_mirror_up_to_date(self):
+        connect_mirror(self.mirror)
+        Subscription.objects.set_preferences(self.super_e, [(self.source, self.medium_1)], subentity_kind=self.ek)
+        self.assert_matches_database()
+        Unsubscribe.objects.set_preferences(self.sub_e2, [(self.source, None)])
+        self.assert_matches_database()
+        Unsubscribe.objects.set_preferences(self.sub_e2, [])
+        self.assert_matches_database()
+        Subscription.objects.set_preferences(self.super_e, [], subentity_kind=self.ek)
+        self.assert_matches_database()
+
+    def test_update_without_entities(self):
+        with self.assertNumQueries(0):
+            self.mirror.update(self.source, self.medium_1, [])
+
+    def test_update_many(self):
+        G(Subscription, entity=self.super_e, medium=None, source=self.source, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_2, source=self.source)
+        self.mirror.update_many([self.sub_e1, self.sub_e2, self.ind_e], [self.source], [self.medium_1, self.medium_2])
+        self.assert_matches_database()
+
+
+class WarmTest(TestCase):
+    def setUp(self):
+        self.client = FakeStrictRedis()
+        self.client.flushall()
+        self.mirror = RedisSubscriptionMirror(self.client)
+        self.ek = G(EntityKind)
+        self.other_ek = G(EntityKind)
+        self.medium = G(Medium)
+        self.other_medium = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.other_ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, medium=self.medium, source=self.source, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium, source=self.source)
+
+    def test_warm(self):
+        calls = []
+        warmed = warm(self.mirror, chunk_size=2, progress=lambda *args: calls.append(args))
+        self.assertEqual(warmed, 3)
+        self.assertEqual(calls, [(2, 3), (3, 3)])
+        self.assertEqual(
+            set(self.mirror.subscribed_entity_ids(self.source, self.medium)), set([self.sub_e1.id, self.ind_e.id])
+        )
+        self.assertEqual(set(self.mirror.subscribed_entity_ids(self.source, self.other_medium)), set())
+
+    def test_warm_chosen_mediums_and_kinds(self):
+        warmed = warm(self.mirror, sources=[self.source], mediums=[self.medium.id], entity_kinds=[self.other_ek])
+        self.assertEqual(warmed, 1)
+        self.assertEqual(set(self.mirror.subscribed_entity_ids(self.source, self.medium)), set([self.ind_e.id]))
+
+    @patch('entity_subscription.mirror.connection')
+    @patch('entity_subscription.mirror.ThreadPool')
+    def test_warm_in_parallel(self, thread_pool_mock, connection_mock):
+        thread_pool_mock.return_value.imap_unordered.side_effect = lambda func, chunks: map(func, chunks)
+        self.assertEqual(warm(self.mirror, chunk_size=1, workers=4), 3)
+        thread_pool_mock.assert_called_once_with(4)
+        thread_pool_mock.return_value.join.assert_called_once_with()
+        self.assertEqual(len(connection_mock.close.mock_calls), 3)
+        self.assertTrue(self.mirror.is_subscribed(self.source, self.medium, self.sub_e1))
+
+
+class GetMirrorTest(TestCase):
+    def test_not_configured(self):
+        self.assertIsNone(get_mirror())
+
+    @override_settings(ENTITY_SUBSCRIPTION_REDIS_URL='redis://localhost:6379/0')
+    def test_configured(self):
+        mirror = get_mirror()
+        self.assertEqual(mirror.prefix, 'entity_subscription')
+
+
+class RebuildSubscriptionMirrorCommandTest(TestCase):
+    def test_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command('rebuild_subscription_mirror')
+
+    @patch('entity_subscription.management.commands.rebuild_subscription_mirror.get_mirror')
+    def test_rebuild(self, get_mirror_mock):
+        stdout = StringIO()
+        call_command('rebuild_subscription_mirror', chunk_size=10, stdout=stdout)
+        get_mirror_mock.return_value.rebuild.assert_called_once_with(chunk_size=10)
+
+
+class WarmSubscriptionMirrorCommandTest(TestCase):
+    def test_not_configured(self):
+        with self.assertRaises(CommandError):
+            call_command('warm_subscription_mirror')
+
+    @patch('entity_subscription.management.commands.warm_subscription_mirror.get_mirror')
+    def test_warm(self, get_mirror_mock):
+        client = FakeStrictRedis()
+        client.flushall()
+        get_mirror_mock.return_value = RedisSubscriptionMirror(client)
+        source = G(Source, name='digest')
+        medium = G(Medium, name='email')
+        entity = G(Entity)
+        G(Subscription, entity=entity, medium=medium, source=source, subentity_kind=None)
+        stdout = StringIO()
+        call_command(
+            'warm_subscription_mirror', sources=['digest'], mediums=['email'], entity_kinds=[entity.entity_kind.name],
+            stdout=stdout
+        )
+        self.assertIn('Warmed 1/1 entities.', stdout.getvalue())
+        self.assertTrue(get_mirror_mock.return_value.is_subscribed(source, medium, entity))
+
+    @patch('entity_subscription.management.commands.warm_subscription_mirror.get_mirror')
+    def test_warm_everything_in_chunks(self, get_mirror_mock):
+        get_mirror_mock.return_value = RedisSubscriptionMirror(FakeStrictRedis())
+        get_mirror_mock.return_value.client.flushall()
+        source = G(Source)
+        medium = G(Medium)
+        for entity in (G(Entity), G(Entity)):
+            G(Subscription, entity=entity, medium=medium, source=source, subentity_kind=None)
+        stdout = StringIO()
+        call_command('warm_subscription_mirror', chunk_size=1, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), ['Warmed 1/2 entities.', 'Warmed 2/2 entities.'])
+        self.assertTrue(get_mirror_mock.return_value.is_subscribed(source, medium, entity))
+
+    @patch('entity_subscription.management.commands.warm_subscription_mirror.get_mirror')
+    def test_unknown_name(self, get_mirror_mock):
+        G(Source, name='digest')
+        with self.assertRaises(CommandError):
+            call_command('warm_subscription_mirror', sources=['digest', 'missing'])
@@ -1,10 +1,14 @@
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models.signals import post_delete
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django_dynamic_fixture import G, N
 from entity.models import Entity, EntityRelationship, EntityKind
-from mock import patch
+from mock import MagicMock, patch
 
 from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.signals import preferences_changed
 
 
 class SubscriptionManagerMediumsSubscribedTest(TestCase):
@@ -322,6 +326,310 @@ class UnsubscribeManagerIsUnsubscribed(TestCase):
         self.assertFalse(is_unsubscribed)
 
 
+class SubscriptionManagerIdArgumentsTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.sub_e1, medium=self.medium_2, source=self.source, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source)
+
+    def test_mediums_subscribed_individual(self):
+        with self.assertNumQueries(1):
+            mediums = Subscription.objects.mediums_subscribed(self.source.id, self.sub_e1.id)
+            self.assertEqual(set(mediums), set([self.medium_1, self.medium_2]))
+
+    def test_mediums_subscribed_group(self):
+        mediums = Subscription.objects.mediums_subscribed(self.source.id, self.super_e.id, self.ek.id)
+        self.assertEqual(list(mediums), [self.medium_1])
+
+    def test_is_subscribed_individual(self):
+        with self.assertNumQueries(2):
+            self.assertTrue(Subscription.objects.is_subscribed(self.source.id, self.medium_1.id, self.sub_e1.id))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source.id, self.medium_1.id, self.sub_e2.id))
+
+    def test_is_subscribed_group(self):
+        self.assertTrue(
+            Subscription.objects.is_subscribed(self.source.id, self.medium_1.id, self.super_e.id, self.ek.id)
+        )
+
+    def test_filter_not_subscribed(self):
+        entity_ids = [self.sub_e1.id, self.sub_e2.id]
+        # The kinds of the entities, then the subscribed entities.
+        with self.assertNumQueries(2):
+            entities = Subscription.objects.filter_not_subscribed(self.source.id, self.medium_1.id, entity_ids)
+            self.assertEqual(list(entities), [self.sub_e1])
+
+    def test_filter_not_subscribed_different_kinds(self):
+        with self.assertRaises(ValueError):
+            Subscription.objects.filter_not_subscribed(self.source, self.medium_1, [self.sub_e1.id, self.super_e.id])
+        with self.assertRaises(ValueError):
+            Subscription.objects.filter_not_subscribed(self.source, self.medium_1, [self.sub_e1, self.super_e.id])
+
+    def test_filter_not_subscribed_generator(self):
+        entities = (entity_id for entity_id in [self.sub_e1.id, self.sub_e2.id])
+        entity_ids = Subscription.objects.filter_not_subscribed(self.source, self.medium_1, entities, ids=True)
+        self.assertEqual(entity_ids, frozenset([self.sub_e1.id]))
+
+    def test_filter_not_subscribed_unknown_ids(self):
+        entities = Subscription.objects.filter_not_subscribed(self.source, self.medium_1, [0], ids=True)
+        self.assertEqual(entities, frozenset())
+
+    def test_effective_subscriptions(self):
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e1.id, self.sub_e2], [self.source.id])
+        expected = set([
+            (self.sub_e1.id, self.source.id, self.medium_1.id),
+            (self.sub_e1.id, self.source.id, self.medium_2.id),
+        ])
+        self.assertEqual(subscribed, expected)
+
+    def test_is_unsubscribed(self):
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.source.id, self.medium_1.id, self.sub_e2.id))
+
+
+class SubscriptionManagerFirstSubscribedMediumsTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.push = G(Medium)
+        self.email = G(Medium)
+        self.in_site = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        self.unsubscribed_e = G(Entity, entity_kind=self.ek)
+        for sub_entity in (self.sub_e1, self.sub_e2, self.unsubscribed_e):
+            G(EntityRelationship, sub_entity=sub_entity, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.email, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.sub_e1, medium=self.push, source=self.source, subentity_kind=None)
+        G(Subscription, entity=self.ind_e, medium=None, source=None, subentity_kind=None)
+        G(Unsubscribe, entity=self.unsubscribed_e, medium=None, source=self.source)
+        self.priority = [self.push, self.email, self.in_site]
+
+    def test_first_subscribed_mediums(self):
+        entities = [self.sub_e1, self.sub_e2, self.ind_e, self.unsubscribed_e]
+        self.assertEqual(Subscription.objects.first_subscribed_mediums(self.source, self.priority, entities), {
+            self.sub_e1.id: self.push.id,
+            self.sub_e2.id: self.email.id,
+            self.ind_e.id: self.push.id,
+            self.unsubscribed_e.id: None,
+        })
+
+    def test_priority_order(self):
+        priority = [self.in_site.id, self.email.id]
+        entity_ids = iter([self.sub_e1.id, self.ind_e.id])
+        self.assertEqual(Subscription.objects.first_subscribed_mediums(self.source.id, priority, entity_ids), {
+            self.sub_e1.id: self.email.id,
+            self.ind_e.id: self.in_site.id,
+        })
+
+    def test_number_of_queries(self):
+        entities = [G(Entity, entity_kind=self.ek) for i in range(10)] + [self.sub_e1, self.sub_e2]
+        with self.assertNumQueries(3):
+            Subscription.objects.first_subscribed_mediums(self.source, [self.push, self.email], entities)
+
+
+class SubscriptionManagerIdsTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.push = G(Medium)
+        self.email = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.unsubscribed_e = G(Entity, entity_kind=self.ek)
+        for sub_entity in (self.sub_e1, self.sub_e2, self.unsubscribed_e):
+            G(EntityRelationship, sub_entity=sub_entity, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.email, source=self.source, subentity_kind=self.ek)
+        G(Subscription, entity=self.sub_e1, medium=self.push, source=self.source, subentity_kind=None)
+        G(Unsubscribe, entity=self.unsubscribed_e, medium=None, source=self.source)
+
+    def test_mediums_subscribed(self):
+        medium_ids = Subscription.objects.mediums_subscribed(self.source, self.sub_e1, ids=True)
+        self.assertIsInstance(medium_ids, frozenset)
+        self.assertEqual(medium_ids, frozenset([self.push.id, self.email.id]))
+        medium_ids = Subscription.objects.mediums_subscribed(self.source, self.unsubscribed_e, ids=True)
+        self.assertEqual(medium_ids, frozenset())
+
+    def test_mediums_subscribed_group(self):
+        medium_ids = Subscription.objects.mediums_subscribed(self.source, self.super_e, self.ek, ids=True)
+        self.assertEqual(medium_ids, frozenset([self.email.id]))
+
+    def test_filter_not_subscribed(self):
+        entities = [self.sub_e1, self.sub_e2, self.unsubscribed_e]
+        entity_ids = Subscription.objects.filter_not_subscribed(self.source, self.email, entities, ids=True)
+        self.assertEqual(entity_ids, frozenset([self.sub_e1.id, self.sub_e2.id]))
+        self.assertEqual(
+            entity_ids,
+            frozenset(e.id for e in Subscription.objects.filter_not_subscribed(self.source, self.email, entities))
+        )
+
+
+class SetPreferencesTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.entity = G(Entity)
+        self.other_e = G(Entity)
+        self.receiver = MagicMock()
+        preferences_changed.connect(self.receiver)
+
+    def tearDown(self):
+        preferences_changed.disconnect(self.receiver)
+
+    def pairs(self, queryset):
+        return sorted(queryset.values_list('source', 'medium'))
+
+    def test_unsubscribes(self):
+        G(Unsubscribe, entity=self.entity, medium=self.medium_1, source=self.source_1)
+        G(Unsubscribe, entity=self.entity, medium=self.medium_2, source=self.source_1)
+        G(Unsubscribe, entity=self.entity, medium=self.medium_2, source=self.source_1)
+        G(Unsubscribe, entity=self.other_e, medium=self.medium_1, source=self.source_1)
+
+        added, removed = Unsubscribe.objects.set_preferences(
+            self.entity, [(self.source_1, self.medium_2), (self.source_2.id, None)]
+        )
+        self.assertEqual(added, set([(self.source_2.id, None)]))
+        self.assertEqual(removed, set([(self.source_1.id, self.medium_1.id)]))
+        self.assertEqual(self.pairs(Unsubscribe.objects.filter(entity=self.entity)), sorted([
+            (self.source_1.id, self.medium_2.id), (self.source_2.id, None),
+        ]))
+        self.assertEqual(Unsubscribe.objects.filter(entity=self.other_e).count(), 1)
+        self.receiver.assert_called_once_with(
+            signal=preferences_changed, sender=Unsubscribe, entity=self.entity.id, added=added, removed=removed
+        )
+
+    def test_unchanged(self):
+        G(Unsubscribe, entity=self.entity, medium=self.medium_1, source=self.source_1)
+        self.assertEqual(
+            Unsubscribe.objects.set_preferences(self.entity.id, [(self.source_1.id, self.medium_1.id)]), (set(), set())
+        )
+        self.assertFalse(self.receiver.called)
+
+    def test_group_subscriptions(self):
+        G(Subscription, entity=self.entity, medium=self.medium_1, source=self.source_1, subentity_kind=None)
+        G(Subscription, entity=self.entity, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+
+        added, removed = Subscription.objects.set_preferences(
+            self.entity, [(self.source_2, self.medium_1), (self.source_2, self.medium_2)], subentity_kind=self.ek
+        )
+        self.assertEqual(added, set([(self.source_2.id, self.medium_1.id), (self.source_2.id, self.medium_2.id)]))
+        self.assertEqual(removed, set([(self.source_1.id, self.medium_1.id)]))
+        self.assertEqual(self.pairs(Subscription.objects.filter(entity=self.entity, subentity_kind=self.ek)), sorted([
+            (self.source_2.id, self.medium_1.id), (self.source_2.id, self.medium_2.id),
+        ]))
+        self.assertEqual(Subscription.objects.filter(entity=self.entity, subentity_kind=None).count(), 1)
+        self.assertEqual(self.receiver.call_args[1]['subentity_kind'], self.ek.id)
+
+    def test_single_delete_without_receivers(self):
+        G(Unsubscribe, entity=self.entity, medium=self.medium_1, source=self.source_1)
+        G(Unsubscribe, entity=self.entity, medium=self.medium_2, source=self.source_1)
+        with CaptureQueriesContext(connection) as context:
+            Unsubscribe.objects.set_preferences(self.entity, [])
+        deletes = [query for query in context.captured_queries if 'DELETE' in query['sql']]
+        self.assertEqual(len(deletes), 1)
+        self.assertFalse(Unsubscribe.objects.exists())
+
+    def test_delete_receivers(self):
+        unsubscribe = G(Unsubscribe, entity=self.entity, medium=self.medium_1, source=self.source_1)
+        deleted_ids = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted_ids.append(instance.id)
+
+        post_delete.connect(receiver, sender=Unsubscribe)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Unsubscribe)
+        Unsubscribe.objects.set_preferences(self.entity, [])
+        self.assertEqual(deleted_ids, [unsubscribe.id])
+
+    def test_individual_subscriptions(self):
+        Subscription.objects.set_preferences(self.entity, [(self.source_1, self.medium_1)])
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.entity))
+        Subscription.objects.set_preferences(self.entity, [])
+        self.assertFalse(Subscription.objects.filter(entity=self.entity).exists())
+
+
+class SubscriptionManagerWildcardTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+
+    def test_all_mediums(self):
+        G(Subscription, entity=self.super_e, medium=None, source=self.source_1, subentity_kind=self.ek)
+        mediums = Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1)
+        self.assertEqual(set(mediums), set([self.medium_1, self.medium_2]))
+        mediums = Subscription.objects.mediums_subscribed(self.source_2, self.sub_e1)
+        self.assertEqual(list(mediums), [])
+        mediums = Subscription.objects.mediums_subscribed(self.source_1, self.super_e, self.ek)
+        self.assertEqual(set(mediums), set([self.medium_1, self.medium_2]))
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_1, self.medium_2, self.sub_e1))
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_1, self.medium_2, self.super_e, self.ek))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source_2, self.medium_2, self.sub_e1))
+
+    def test_all_sources(self):
+        G(Subscription, entity=self.sub_e1, medium=self.medium_1, source=None, subentity_kind=None)
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_2, self.medium_1, self.sub_e1))
+        self.assertFalse(Subscription.objects.is_subscribed(self.source_2, self.medium_2, self.sub_e1))
+        entities = Subscription.objects.filter_not_subscribed(self.source_2, self.medium_1, [self.sub_e1, self.sub_e2])
+        self.assertEqual(list(entities), [self.sub_e1])
+
+    def test_unsubscribe_from_all_mediums(self):
+        G(Subscription, entity=self.super_e, medium=None, source=None, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e1, medium=None, source=self.source_1)
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source_1, self.sub_e1)), [])
+        self.assertEqual(len(Subscription.objects.mediums_subscribed(self.source_2, self.sub_e1)), 2)
+        self.assertFalse(Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.sub_e1))
+        self.assertTrue(Subscription.objects.is_subscribed(self.source_2, self.medium_1, self.sub_e1))
+        self.assertTrue(Unsubscribe.objects.is_unsubscribed(self.source_1, self.medium_2, self.sub_e1))
+        entities = Subscription.objects.filter_not_subscribed(self.source_1, self.medium_1, [self.sub_e1, self.sub_e2])
+        self.assertEqual(list(entities), [self.sub_e2])
+
+    def test_global_opt_out(self):
+        G(Subscription, entity=self.super_e, medium=None, source=None, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e1, medium=None, source=None)
+        self.assertEqual(list(Subscription.objects.mediums_subscribed(self.source_2, self.sub_e1)), [])
+        self.assertFalse(Subscription.objects.is_subscribed(self.source_2, self.medium_2, self.sub_e1))
+
+    def test_effective_subscriptions(self):
+        G(Subscription, entity=self.super_e, medium=None, source=None, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=None)
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e1])
+        expected = set([
+            (self.sub_e1.id, self.source_1.id, self.medium_2.id),
+            (self.sub_e1.id, self.source_2.id, self.medium_2.id),
+        ])
+        self.assertEqual(subscribed, expected)
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e1], [self.source_1])
+        self.assertEqual(subscribed, set([(self.sub_e1.id, self.source_1.id, self.medium_2.id)]))
+
+    def test_unicode(self):
+        entity = G(Entity, entity_meta={'name': 'Entity Test'}, display_name='Entity Test')
+        sub = G(Subscription, entity=entity, medium=None, source=None)
+        self.assertEqual(sub.__unicode__(), 'Entity Test to all sources by all mediums')
+        unsub = G(Unsubscribe, entity=entity, medium=None, source=None)
+        self.assertEqual(unsub.__unicode__(), 'Entity Test from all sources by all mediums')
+
+
 class NumberOfQueriesTests(TestCase):
     def test_query_count(self):
         ek = G(EntityKind)
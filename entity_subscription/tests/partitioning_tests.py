@@ -0,0 +1,168 @@
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from django_dynamic_fixture import G
+from entity.models import Entity
+from mock import patch
+
+from entity_subscription import partitioning
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+def supports_partitioning():
+    return connection.vendor == 'postgresql' and connection.pg_version >= 110000
+
+
+class PartitionStatementsTest(TestCase):
+    def test_partition_statements(self):
+        statements = partitioning.partition_statements(Subscription, [3, 5], 'subscription_id_seq')
+        self.assertTrue(statements[0].startswith('ALTER TABLE'))
+        self.assertIn('PARTITION BY LIST (source_id)', statements[2])
+        self.assertIn('FOR VALUES IN (NULL)', statements[4])
+        self.assertIn('DEFAULT', statements[5])
+        self.assertIn('entity_subscription_subscription_source_3', statements[6])
+        self.assertIn('FOR VALUES IN (5)', statements[7])
+        self.assertEqual(len([s for s in statements if 'FOREIGN KEY' in s]), 4)
+        self.assertEqual(len([s for s in statements if s.startswith('CREATE INDEX')]), 5)
+        self.assertTrue(statements[-2].startswith('INSERT INTO'))
+        self.assertTrue(statements[-1].startswith('DROP TABLE'))
+
+    def test_unpartition_statements(self):
+        statements = partitioning.unpartition_statements(Unsubscribe, 'unsubscribe_id_seq')
+        self.assertIn('ADD PRIMARY KEY (id)', statements[3])
+        self.assertEqual(len([s for s in statements if 'FOREIGN KEY' in s]), 3)
+        self.assertEqual(len([s for s in statements if s.startswith('CREATE INDEX')]), 3)
+
+    def test_create_partition_statements(self):
+        statements = partitioning.create_partition_statements(Unsubscribe, '7')
+        self.assertEqual([s.split()[0] for s in statements], ['ALTER', 'CREATE', 'INSERT', 'DELETE', 'ALTER'])
+        self.assertIn('entity_subscription_unsubscribe_source_7', statements[1])
+        self.assertIn('WHERE source_id = 7', statements[3])
+
+
+@patch('entity_subscription.partitioning._execute')
+class PartitionManagementTest(TestCase):
+    def test_enabled(self, execute_mock):
+        self.assertFalse(partitioning.partitioning_enabled())
+        with override_settings(ENTITY_SUBSCRIPTION_PARTITION_BY_SOURCE=True):
+            self.assertEqual(partitioning.partitioning_enabled(), connection.vendor == 'postgresql')
+
+    @patch('entity_subscription.partitioning._sequence', return_value='seq')
+    @patch('entity_subscription.partitioning.is_partitioned', side_effect=[False, True])
+    def test_partition_table(self, is_partitioned_mock, sequence_mock, execute_mock):
+        source = G(Source)
+        self.assertTrue(partitioning.partition_table(Subscription))
+        self.assertIn('FOR VALUES IN ({0})'.format(source.id), execute_mock.mock_calls[0][1][0][6])
+        self.assertFalse(partitioning.partition_table(Subscription))
+        self.assertEqual(len(execute_mock.mock_calls), 1)
+
+    @patch('entity_subscription.partitioning._sequence', return_value='seq')
+    @patch('entity_subscription.partitioning.is_partitioned', side_effect=[True, False])
+    def test_unpartition_table(self, is_partitioned_mock, sequence_mock, execute_mock):
+        self.assertTrue(partitioning.unpartition_table(Unsubscribe))
+        self.assertFalse(partitioning.unpartition_table(Unsubscribe))
+        self.assertEqual(len(execute_mock.mock_calls), 1)
+
+    @patch('entity_subscription.partitioning.existing_partitions')
+    def test_create_missing_partitions(self, existing_partitions_mock, execute_mock):
+        source_1, source_2 = G(Source), G(Source)
+        existing_partitions_mock.return_value = set([partitioning.partition_name(Subscription, source_1.id)])
+        self.assertEqual(partitioning.create_missing_partitions(Subscription), [source_2.id])
+        self.assertEqual(len(execute_mock.mock_calls), 1)
+
+    @patch('entity_subscription.partitioning.is_partitioned', side_effect=[True, False])
+    @patch('entity_subscription.partitioning.partitioning_enabled', return_value=True)
+    def test_partitions_created_with_source(self, enabled_mock, is_partitioned_mock, execute_mock):
+        source = G(Source)
+        self.assertEqual(len(execute_mock.mock_calls), 1)
+        partition = 'entity_subscription_subscription_source_{0}'.format(source.id)
+        self.assertIn(partition, execute_mock.mock_calls[0][1][0][1])
+        source.save()
+        self.assertEqual(len(execute_mock.mock_calls), 1)
+
+    def test_disabled(self, execute_mock):
+        G(Source)
+        self.assertFalse(execute_mock.called)
+
+
+@patch('entity_subscription.partitioning.connection')
+class CatalogQueriesTest(TestCase):
+    def test_is_partitioned(self, connection_mock):
+        connection_mock.cursor.return_value.fetchone.return_value = None
+        self.assertFalse(partitioning.is_partitioned(Subscription))
+
+    def test_existing_partitions(self, connection_mock):
+        connection_mock.cursor.return_value.fetchall.return_value = [('a',), ('b',)]
+        self.assertEqual(partitioning.existing_partitions(Subscription), set(['a', 'b']))
+
+    def test_sequence(self, connection_mock):
+        connection_mock.cursor.return_value.fetchone.return_value = ('seq',)
+        self.assertEqual(partitioning._sequence(Subscription), 'seq')
+
+    def test_execute(self, connection_mock):
+        connection_mock.alias = 'default'
+        partitioning._execute(['SELECT 1', 'SELECT 2'])
+        self.assertEqual(
+            [c[1][0] for c in connection_mock.cursor.return_value.execute.mock_calls],
+            ['SET CONSTRAINTS ALL IMMEDIATE', 'SELECT 1', 'SELECT 2'],
+        )
+
+
+class SubscriptionPartitionsCommandTest(TestCase):
+    @patch('entity_subscription.management.commands.subscription_partitions.connection')
+    def test_requires_postgresql(self, connection_mock):
+        connection_mock.vendor = 'sqlite'
+        with self.assertRaises(CommandError):
+            call_command('subscription_partitions')
+
+    @patch('entity_subscription.management.commands.subscription_partitions.connection')
+    @patch('entity_subscription.management.commands.subscription_partitions.partitioning')
+    def test_report(self, partitioning_mock, connection_mock):
+        connection_mock.vendor = 'postgresql'
+        partitioning_mock.partitioned_models.return_value = [Subscription, Unsubscribe]
+        partitioning_mock.is_partitioned.side_effect = [True, False]
+        partitioning_mock.missing_source_ids.return_value = [1, 2]
+        stdout = StringIO()
+        call_command('subscription_partitions', stdout=stdout)
+        self.assertIn('entity_subscription_subscription: 2 sources without a partition', stdout.getvalue())
+        self.assertIn('entity_subscription_unsubscribe: not partitioned', stdout.getvalue())
+        self.assertFalse(partitioning_mock.partition_table.called)
+
+    @patch('entity_subscription.management.commands.subscription_partitions.connection')
+    @patch('entity_subscription.management.commands.subscription_partitions.partitioning')
+    def test_convert_and_create(self, partitioning_mock, connection_mock):
+        connection_mock.vendor = 'postgresql'
+        partitioning_mock.partitioned_models.return_value = [Subscription]
+        partitioning_mock.partition_table.return_value = True
+        partitioning_mock.create_missing_partitions.return_value = [1]
+        stdout = StringIO()
+        call_command('subscription_partitions', convert=True, create_missing=True, stdout=stdout)
+        self.assertIn('entity_subscription_subscription: converted', stdout.getvalue())
+        self.assertIn('entity_subscription_subscription: created 1 partitions', stdout.getvalue())
+
+
+class PartitionedTablesTest(TestCase):
+    def setUp(self):
+        if not supports_partitioning():
+            self.skipTest('Requires PostgreSQL 11 or later')
+
+    def test_round_trip(self):
+        source = G(Source)
+        medium = G(Medium)
+        entity = G(Entity)
+        G(Subscription, entity=entity, medium=medium, source=source, subentity_kind=None)
+        for model in partitioning.partitioned_models():
+            self.assertTrue(partitioning.partition_table(model))
+        self.assertTrue(Subscription.objects.is_subscribed(source, medium, entity))
+
+        with override_settings(ENTITY_SUBSCRIPTION_PARTITION_BY_SOURCE=True):
+            new_source = G(Source)
+        G(Subscription, entity=entity, medium=medium, source=new_source, subentity_kind=None)
+        self.assertTrue(Subscription.objects.is_subscribed(new_source, medium, entity))
+        self.assertEqual(partitioning.missing_source_ids(Subscription), [])
+
+        for model in partitioning.partitioned_models():
+            self.assertTrue(partitioning.unpartition_table(model))
+        self.assertEqual(Subscription.objects.count(), 2)
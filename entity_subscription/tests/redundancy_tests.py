@@ -0,0 +1,99 @@
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from mock import patch
+
+from entity_subscription import redundancy
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class RedundancyTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        self.group_sub = G(
+            Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek
+        )
+
+    def test_duplicate_subscription_ids(self):
+        duplicate = G(
+            Subscription, entity=self.super_e, medium=self.medium_1, source=self.source, subentity_kind=self.ek
+        )
+        G(Subscription, entity=self.super_e, medium=self.medium_2, source=self.source, subentity_kind=self.ek)
+        self.assertEqual(list(redundancy.duplicate_subscription_ids()), [duplicate.id])
+
+    def test_duplicate_unsubscribe_ids(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source)
+        duplicate = G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source)
+        self.assertEqual(list(redundancy.duplicate_unsubscribe_ids()), [duplicate.id])
+
+    def test_wildcard_duplicates(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=None, source=None)
+        duplicate = G(Unsubscribe, entity=self.sub_e1, medium=None, source=None)
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=None)
+        self.assertEqual(list(redundancy.duplicate_unsubscribe_ids()), [duplicate.id])
+
+    def test_no_duplicates(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source)
+        with self.assertNumQueries(1):
+            self.assertEqual(list(redundancy.duplicate_unsubscribe_ids()), [])
+        self.assertEqual(list(redundancy.duplicate_subscription_ids()), [])
+
+    def test_covered_subscription_ids(self):
+        covered = G(Subscription, entity=self.sub_e1, medium=self.medium_1, source=self.source, subentity_kind=None)
+        G(Subscription, entity=self.sub_e2, medium=self.medium_2, source=self.source, subentity_kind=None)
+        self.assertEqual(list(redundancy.covered_subscription_ids()), [covered.id])
+
+    def test_unneeded_unsubscribe_ids(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source)
+        unneeded = G(Unsubscribe, entity=self.sub_e1, medium=self.medium_2, source=self.source)
+        self.assertEqual(list(redundancy.unneeded_unsubscribe_ids(chunk_size=1)), [unneeded.id])
+
+    def test_covered_by_wildcard_subscription(self):
+        G(Subscription, entity=self.super_e, medium=None, source=None, subentity_kind=self.ek)
+        covered = G(Subscription, entity=self.sub_e2, medium=self.medium_2, source=self.source, subentity_kind=None)
+        self.assertEqual(list(redundancy.covered_subscription_ids()), [covered.id])
+
+    def test_wildcard_unsubscribes(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=None, source=None)
+        unneeded = G(Unsubscribe, entity=self.sub_e1, medium=None, source=G(Source))
+        self.assertEqual(list(redundancy.unneeded_unsubscribe_ids()), [unneeded.id])
+
+    @patch('entity_subscription.redundancy.time.sleep')
+    def test_delete_in_batches(self, sleep_mock):
+        ids = [G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source).id for i in range(3)]
+        deleted = redundancy.delete_in_batches(Unsubscribe, ids[1:], batch_size=1, sleep=0.5)
+        self.assertEqual(deleted, 2)
+        self.assertEqual(list(Unsubscribe.objects.values_list('id', flat=True)), ids[:1])
+        self.assertEqual(len(sleep_mock.mock_calls), 2)
+
+
+class CompactSubscriptionsCommandTest(TestCase):
+    def setUp(self):
+        self.entity = G(Entity)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        G(Unsubscribe, entity=self.entity, medium=self.medium, source=self.source)
+        G(Unsubscribe, entity=self.entity, medium=self.medium, source=self.source)
+
+    def test_report(self):
+        stdout = StringIO()
+        call_command('compact_subscriptions', stdout=stdout)
+        self.assertIn('duplicate unsubscribes: 1', stdout.getvalue())
+        self.assertEqual(Unsubscribe.objects.count(), 2)
+
+    def test_delete(self):
+        stdout = StringIO()
+        call_command('compact_subscriptions', delete=True, stdout=stdout)
+        self.assertIn('unsubscribes from unsubscribed combinations: 1', stdout.getvalue())
+        self.assertEqual(Unsubscribe.objects.count(), 0)
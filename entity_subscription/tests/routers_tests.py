@@ -0,0 +1,128 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, router
+from django.db.utils import ConnectionRouter
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityKind, EntityRelationship
+from mock import patch
+
+from entity_subscription import statements
+from entity_subscription.mirror import _candidate_entity_ids
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.routers import SubscriptionRouter
+from entity_subscription.utils import split_databases
+
+
+@override_settings(ENTITY_SUBSCRIPTION_DATABASE='subscriptions')
+class SubscriptionRouterTest(TestCase):
+    def setUp(self):
+        self.router = SubscriptionRouter()
+
+    def test_db_for_read_and_write(self):
+        self.assertEqual(self.router.db_for_read(Subscription), 'subscriptions')
+        self.assertEqual(self.router.db_for_write(Medium), 'subscriptions')
+        self.assertIsNone(self.router.db_for_read(Entity))
+        self.assertIsNone(self.router.db_for_write(Entity))
+
+    def test_objects_related_to_subscriptions(self):
+        subscription = Subscription()
+        subscription._state.db = 'subscriptions'
+        self.assertEqual(self.router.db_for_read(Entity, instance=subscription), 'default')
+        self.assertEqual(self.router.db_for_write(EntityKind, instance=subscription), 'default')
+        self.assertEqual(self.router.db_for_read(Source, instance=subscription), 'subscriptions')
+        self.assertIsNone(self.router.db_for_read(Entity, instance=Entity()))
+
+    @override_settings(ENTITY_SUBSCRIPTION_DATABASE='default')
+    def test_entity_of_subscription(self):
+        entity = G(Entity)
+        source = G(Source)
+        G(Subscription, entity=entity, source=source, medium=None, subentity_kind=None)
+        subscription = Subscription.objects.get()
+        # As if loaded from a subscription database of its own.
+        subscription._state.db = 'subscriptions'
+        with patch.object(router, 'routers', [SubscriptionRouter()]):
+            self.assertEqual(subscription.entity, entity)
+            self.assertIn(source.display_name, subscription.__unicode__())
+
+    def test_allow_relation(self):
+        self.assertTrue(self.router.allow_relation(Subscription(), Entity()))
+        self.assertTrue(self.router.allow_relation(EntityKind(), Subscription()))
+        self.assertIsNone(self.router.allow_relation(Subscription(), ContentType()))
+        self.assertIsNone(self.router.allow_relation(Entity(), EntityKind()))
+
+    def test_allow_syncdb(self):
+        self.assertTrue(self.router.allow_syncdb('subscriptions', Unsubscribe))
+        self.assertFalse(self.router.allow_syncdb('default', Unsubscribe))
+        self.assertIsNone(self.router.allow_syncdb('subscriptions', Entity))
+
+
+# The split is only seen by the checks choosing how to query, so every
+# query still runs, and can be checked, on the default database.
+@override_settings(ENTITY_SUBSCRIPTION_DATABASE='subscriptions')
+@patch('entity_subscription.utils.router', ConnectionRouter([SubscriptionRouter()]))
+@patch('entity_subscription.utils._database', lambda model=None: 'default')
+class SplitDatabasesTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_kind=self.ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        self.source = G(Source)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.medium_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, source=self.source, medium=None, subentity_kind=None)
+        G(Unsubscribe, entity=self.ind_e, source=self.source, medium=self.medium_2)
+
+    def assertNoJoinsAcrossDatabases(self, context):
+        for query in context.captured_queries:
+            self.assertFalse('entity_subscription_' in query['sql'] and 'entity_entity' in query['sql'], query['sql'])
+
+    def test_split_databases(self):
+        self.assertTrue(split_databases())
+
+    def test_is_subscribed(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.sub_e.id))
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.ind_e))
+            self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_2, self.ind_e))
+            self.assertTrue(Subscription.objects.is_subscribed(self.source, self.medium_1, self.super_e, self.ek))
+            self.assertFalse(Subscription.objects.is_subscribed(self.source, self.medium_2, self.super_e, self.ek))
+        self.assertNoJoinsAcrossDatabases(context)
+
+    def test_mediums_subscribed(self):
+        with CaptureQueriesContext(connection) as context:
+            mediums = Subscription.objects.mediums_subscribed(self.source, self.sub_e.id, ids=True)
+            self.assertEqual(mediums, frozenset([self.medium_1.id]))
+            mediums = Subscription.objects.mediums_subscribed(self.source, self.ind_e, ids=True)
+            self.assertEqual(mediums, frozenset([self.medium_1.id]))
+            mediums = Subscription.objects.mediums_subscribed(self.source, self.super_e, self.ek, ids=True)
+            self.assertEqual(mediums, frozenset([self.medium_1.id]))
+        self.assertNoJoinsAcrossDatabases(context)
+
+    def test_filter_not_subscribed(self):
+        entities = [self.sub_e, self.ind_e]
+        with CaptureQueriesContext(connection) as context:
+            # Relationships, subscriptions, the mediums of the wildcard
+            # subscription and unsubscribes.
+            with self.assertNumQueries(4):
+                entity_ids = Subscription.objects.filter_not_subscribed(self.source, self.medium_1, entities, ids=True)
+            self.assertEqual(entity_ids, frozenset([self.sub_e.id, self.ind_e.id]))
+            entities = Subscription.objects.filter_not_subscribed(self.source, self.medium_2, [e.id for e in entities])
+            self.assertEqual(list(entities), [])
+        self.assertNoJoinsAcrossDatabases(context)
+
+    def test_filter_not_subscribed_different_kinds(self):
+        with self.assertRaises(ValueError):
+            Subscription.objects.filter_not_subscribed(self.source, self.medium_1, [self.sub_e.id, self.super_e.id])
+
+    def test_mirror_candidates(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(_candidate_entity_ids(self.source.id, [self.ek]), set([self.sub_e.id, self.ind_e.id]))
+        self.assertNoJoinsAcrossDatabases(context)
+
+    @override_settings(ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS=True)
+    def test_prepared_statements_not_used(self):
+        self.assertFalse(statements.use_prepared_statements())
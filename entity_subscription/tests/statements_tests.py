@@ -0,0 +1,102 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from mock import MagicMock, patch
+
+from entity_subscription import statements
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class PreparedIsSubscribedTest(TestCase):
+    """Checks the raw SQL fast path against the ORM queries it replaces.
+    """
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.other_ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.other_kind_e = G(Entity, entity_kind=self.other_ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        self.unrelated_e = G(Entity, entity_kind=self.ek)
+        for sub_entity in (self.sub_e1, self.sub_e2, self.other_kind_e):
+            G(EntityRelationship, sub_entity=sub_entity, super_entity=self.super_e)
+        self.entities = [self.sub_e1, self.sub_e2, self.other_kind_e, self.ind_e, self.unrelated_e]
+
+    def assert_matches_orm(self):
+        for source in (self.source_1, self.source_2):
+            for medium in (self.medium_1, self.medium_2):
+                for entity in self.entities:
+                    for args in ((source, medium, entity), (source.id, medium.id, entity.id)):
+                        self.assertEqual(
+                            statements.is_subscribed(*args),
+                            Subscription.objects._is_subscribed_individual(*args),
+                            'Mismatch for {0}'.format(args),
+                        )
+
+    def test_group_and_individual_subscriptions(self):
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source_2, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source_1)
+        self.assert_matches_orm()
+
+    def test_wildcards(self):
+        G(Subscription, entity=self.super_e, medium=None, source=self.source_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.ind_e, medium=None, source=None, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_2, source=None)
+        G(Unsubscribe, entity=self.ind_e, medium=None, source=self.source_2)
+        self.assert_matches_orm()
+
+    def test_nothing_subscribed(self):
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium_1, source=self.source_1)
+        self.assert_matches_orm()
+
+    def test_unprepared_on_other_backends(self):
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source_1)
+        with patch('entity_subscription.statements.connection.vendor', 'sqlite'):
+            self.assert_matches_orm()
+
+    def test_single_query(self):
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        # On PostgreSQL, the first check of a connection also prepares
+        # the statement.
+        statements.is_subscribed(self.source_1.id, self.medium_1.id, self.sub_e1.id)
+        with self.assertNumQueries(1):
+            self.assertTrue(statements.is_subscribed(self.source_1.id, self.medium_1.id, self.sub_e1.id))
+
+    @override_settings(ENTITY_SUBSCRIPTION_PREPARED_STATEMENTS=True)
+    def test_used_by_manager(self):
+        G(Subscription, entity=self.ind_e, medium=self.medium_1, source=self.source_1, subentity_kind=None)
+        statements.is_subscribed(self.source_1, self.medium_1, self.ind_e)
+        with self.assertNumQueries(1):
+            self.assertTrue(Subscription.objects.is_subscribed(self.source_1, self.medium_1, self.ind_e))
+
+    def test_not_used_by_default(self):
+        self.assertFalse(statements.use_prepared_statements())
+
+
+@patch('entity_subscription.statements._statement_cache', [])
+@patch('entity_subscription.statements.connection')
+class PostgresPreparedStatementTest(TestCase):
+    def test_prepared_once_per_connection(self, connection_mock):
+        connection_mock.vendor = 'postgresql'
+        connection_mock._entity_subscription_prepared = None
+        cursor = connection_mock.cursor.return_value
+        cursor.fetchone.return_value = (True,)
+
+        self.assertTrue(statements.is_subscribed(1, 2, 3))
+        self.assertTrue(statements.is_subscribed(1, 2, 3))
+        connection_mock.connection = MagicMock()
+        self.assertTrue(statements.is_subscribed(1, 2, 3))
+
+        executed = [call[1][0] for call in cursor.execute.mock_calls]
+        self.assertEqual([sql.split()[0] for sql in executed], ['PREPARE', 'EXECUTE', 'EXECUTE', 'PREPARE', 'EXECUTE'])
+        self.assertIn('$4', executed[0])
+        self.assertNotIn(':entity', executed[0])
+        self.assertEqual(cursor.execute.mock_calls[1][1][1], [1, 2, 3, None])
@@ -0,0 +1,184 @@
+import csv
+import os
+import shutil
+import tempfile
+from unittest import skipUnless
+
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase
+from django.utils.six import StringIO
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityKind, EntityRelationship
+from mock import MagicMock, patch
+
+from entity_subscription import transfer
+from entity_subscription.bloom import disable_unsubscribe_filter, enable_unsubscribe_filter
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.signals import preferences_changed
+
+
+def rows(output):
+    return list(csv.reader(StringIO(output.getvalue())))
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind, name='user')
+        self.super_e = G(Entity)
+        self.sub_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, super_entity=self.super_e, sub_entity=self.sub_e)
+        self.source = G(Source, name='news')
+        self.email = G(Medium, name='email')
+        self.sms = G(Medium, name='sms')
+        G(Subscription, entity=self.super_e, source=self.source, medium=self.email, subentity_kind=self.ek)
+        G(Subscription, entity=self.sub_e, source=None, medium=self.sms, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e, source=self.source, medium=self.sms)
+
+    def subscriptions(self):
+        return sorted(Subscription.objects.values_list('entity', 'source', 'medium', 'subentity_kind'))
+
+    @patch('entity_subscription.transfer.uses_copy', return_value=False)
+    def test_export_rows(self, uses_copy_mock):
+        output = StringIO()
+        transfer.export_rows(Subscription, output)
+        self.assertEqual(rows(output), [
+            [str(self.super_e.id), 'news', 'email', 'user'],
+            [str(self.sub_e.id), '', 'sms', ''],
+        ])
+
+    @patch('entity_subscription.transfer.uses_copy', return_value=False)
+    def test_round_trip(self, uses_copy_mock):
+        output = StringIO()
+        transfer.export_rows(Subscription, output)
+        subscriptions = self.subscriptions()
+        Subscription.objects.all().delete()
+
+        self.assertEqual(transfer.import_rows(Subscription, StringIO(output.getvalue()), batch_size=1), 2)
+        self.assertEqual(self.subscriptions(), subscriptions)
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY requires PostgreSQL')
+    def test_copy_round_trip(self):
+        output = StringIO()
+        transfer.export_rows(Unsubscribe, output)
+        self.assertEqual(rows(output), [[str(self.sub_e.id), 'news', 'sms']])
+
+        self.assertEqual(transfer.import_rows(Unsubscribe, StringIO(output.getvalue()), replace=True), 1)
+        self.assertEqual(
+            list(Unsubscribe.objects.values_list('entity', 'source', 'medium')),
+            [(self.sub_e.id, self.source.id, self.sms.id)],
+        )
+
+    def test_import_replace(self):
+        transfer.import_rows(Unsubscribe, StringIO('{0},,email\n'.format(self.super_e.id)), replace=True)
+        self.assertEqual(
+            list(Unsubscribe.objects.values_list('entity', 'source', 'medium')),
+            [(self.super_e.id, None, self.email.id)],
+        )
+
+    def test_import_sends_preferences_changed(self):
+        receiver = MagicMock()
+        preferences_changed.connect(receiver, sender=Subscription)
+        self.addCleanup(preferences_changed.disconnect, receiver, sender=Subscription)
+        input = StringIO('{0},news,sms,\n{0},,email,\n'.format(self.sub_e.id))
+        self.assertEqual(transfer.import_rows(Subscription, input, replace=True), 2)
+
+        changes = dict((kwargs['entity'], kwargs) for args, kwargs in receiver.call_args_list)
+        self.assertEqual(set(changes), set([self.super_e.id, self.sub_e.id]))
+        self.assertEqual(changes[self.super_e.id]['subentity_kind'], self.ek.id)
+        self.assertEqual(changes[self.super_e.id]['added'], set())
+        self.assertEqual(changes[self.super_e.id]['removed'], set([(self.source.id, self.email.id)]))
+        self.assertIsNone(changes[self.sub_e.id]['subentity_kind'])
+        self.assertEqual(changes[self.sub_e.id]['added'], set([(self.source.id, self.sms.id), (None, self.email.id)]))
+        self.assertEqual(changes[self.sub_e.id]['removed'], set([(None, self.sms.id)]))
+
+    def test_imported_unsubscribes_added_to_filter(self):
+        unsubscribe_filter = enable_unsubscribe_filter(100)
+        self.addCleanup(disable_unsubscribe_filter)
+        transfer.import_rows(Unsubscribe, StringIO('{0},news,email\n'.format(self.super_e.id)))
+        self.assertTrue(unsubscribe_filter.might_be_unsubscribed(self.super_e, self.source, self.email))
+
+    def test_import_errors(self):
+        input = StringIO('{0},news,email\nx,news,email\n{0},news,fax\n0,news,email\n{0},news\n'.format(
+            self.super_e.id
+        ))
+        with self.assertRaises(ValueError) as context:
+            transfer.import_rows(Unsubscribe, input, batch_size=2)
+        self.assertEqual(context.exception.args[0], 'line 2: expected an entity id and 2 names')
+        self.assertEqual(Unsubscribe.objects.count(), 1)
+
+        input.seek(0)
+        with self.assertRaises(ValueError) as context:
+            transfer.import_rows(Unsubscribe, input)
+        self.assertEqual(context.exception.args[0], '\n'.join([
+            'line 2: expected an entity id and 2 names',
+            'line 3: unknown medium "fax"',
+            'line 4: unknown entity 0',
+            'line 5: expected an entity id and 2 names',
+        ]))
+
+    def test_import_max_errors(self):
+        with self.assertRaises(ValueError) as context:
+            transfer.import_rows(Unsubscribe, StringIO('x\n' * (transfer.MAX_ERRORS + 5)))
+        self.assertEqual(len(context.exception.args[0].splitlines()), transfer.MAX_ERRORS)
+
+    def test_export_effective(self):
+        output = StringIO()
+        transfer.export_effective(output, chunk_size=1)
+        self.assertEqual(rows(output), [[str(self.sub_e.id), 'news', 'email']])
+
+
+class TransferCommandTest(TestCase):
+    def setUp(self):
+        self.entity = G(Entity)
+        self.source = G(Source, name='news')
+        self.medium = G(Medium, name='email')
+        G(Unsubscribe, entity=self.entity, source=self.source, medium=self.medium)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'unsubscribes.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_export_to_stdout(self):
+        stdout = StringIO()
+        call_command('export_subscriptions', model='unsubscribe', stdout=stdout)
+        self.assertEqual(rows(stdout), [[str(self.entity.id), 'news', 'email']])
+
+    def test_export_effective(self):
+        stdout = StringIO()
+        call_command('export_subscriptions', effective=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '')
+
+    def test_export_and_import_file(self):
+        call_command('export_subscriptions', model='unsubscribe', output=self.path)
+        stdout = StringIO()
+        call_command('import_subscriptions', self.path, model='unsubscribe', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Imported 1 rows.\n')
+        self.assertEqual(Unsubscribe.objects.count(), 2)
+
+    def test_import_stdin(self):
+        with patch('sys.stdin', StringIO('{0},news,\n'.format(self.entity.id))):
+            call_command('import_subscriptions', '-', model='unsubscribe', replace=True, stdout=StringIO())
+        self.assertEqual(list(Unsubscribe.objects.values_list('medium', flat=True)), [None])
+
+    def test_import_invalid_rows(self):
+        with open(self.path, 'w') as input:
+            input.write('{0},news,fax\n'.format(self.entity.id))
+        with self.assertRaisesRegexp(CommandError, 'line 1: unknown medium "fax"'):
+            call_command('import_subscriptions', self.path, model='unsubscribe')
+
+    def test_import_invalid_stdin(self):
+        with patch('sys.stdin', StringIO('x\n')):
+            with self.assertRaisesRegexp(CommandError, 'line 1: expected an entity id'):
+                call_command('import_subscriptions', '-', model='unsubscribe')
+
+    def test_import_requires_path(self):
+        with self.assertRaises(CommandError):
+            call_command('import_subscriptions')
+
+    def test_unknown_model(self):
+        with self.assertRaises(CommandError):
+            call_command('export_subscriptions', model='relationship')
+        with self.assertRaises(CommandError):
+            call_command('import_subscriptions', self.path, model='relationship')
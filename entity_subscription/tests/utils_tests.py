@@ -0,0 +1,125 @@
+from django.db import connection
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from mock import MagicMock, patch
+
+from entity_subscription import deltas, redundancy, utils
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class IdArrayTest(TestCase):
+    def test_as_sql(self):
+        ids = utils.IdArray(['1', 2, 3])
+        self.assertEqual(ids._as_sql(connection=None), ('SELECT unnest(%s::integer[])', ['{1,2,3}']))
+
+    def test_prepare(self):
+        ids = utils.IdArray([1, 2])
+        self.assertIs(ids._prepare(), ids)
+
+    def test_sequence(self):
+        self.assertEqual(list(utils.IdArray(iter([1, 2]))), [1, 2])
+        self.assertEqual(len(utils.IdArray([1, 2])), 2)
+        self.assertFalse(utils.IdArray([]))
+
+
+class IdListTest(TestCase):
+    @patch('entity_subscription.utils.connections')
+    def test_postgresql(self, connections_mock):
+        connections_mock.__getitem__.return_value.vendor = 'postgresql'
+        self.assertIsInstance(utils.id_list([1, 2]), utils.IdArray)
+        self.assertEqual(utils.id_chunks(range(1000)), [list(range(1000))])
+
+    @patch('entity_subscription.utils.connections')
+    def test_other_backends(self, connections_mock):
+        connections_mock.__getitem__.return_value.vendor = 'sqlite'
+        self.assertEqual(utils.id_list(iter([1, 2])), [1, 2])
+        self.assertEqual(utils.id_chunks([1, 2]), [[1, 2]])
+        with patch('entity_subscription.utils.ID_CHUNK_SIZE', 2):
+            self.assertEqual(utils.id_chunks([1, 2, 3, 4, 5]), [[1, 2], [3, 4], [5]])
+
+    @patch('entity_subscription.utils.ID_CHUNK_SIZE', 1)
+    @patch('entity_subscription.utils._database', lambda model=None: 'default' if model is Entity else 'subscriptions')
+    def test_database_of_model(self):
+        connections = {'subscriptions': MagicMock(vendor='postgresql'), 'default': MagicMock(vendor='sqlite')}
+        with patch('entity_subscription.utils.connections', connections):
+            self.assertIsInstance(utils.id_list([1, 2]), utils.IdArray)
+            self.assertEqual(utils.id_list([1, 2], Entity), [1, 2])
+            self.assertEqual(utils.id_chunks([1, 2], Subscription), [[1, 2]])
+            self.assertEqual(utils.id_chunks([1, 2], Entity), [[1], [2]])
+            self.assertEqual(utils.id_chunks([1, 2]), [[1], [2]])
+
+
+@patch('entity_subscription.utils.ID_CHUNK_SIZE', 1)
+@patch('entity_subscription.utils.binds_id_arrays', return_value=False)
+class ChunkedSubscriptionResolutionTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.medium = G(Medium)
+        self.source = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium, source=self.source, subentity_kind=self.ek)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium, source=self.source)
+
+    def test_effective_subscriptions(self, binds_id_arrays_mock):
+        subscribed = Subscription.objects._effective_subscriptions([self.sub_e1, self.sub_e2.id], [self.source])
+        self.assertEqual(subscribed, set([(self.sub_e1.id, self.source.id, self.medium.id)]))
+
+    def test_subscription_keys(self, binds_id_arrays_mock):
+        entity_ids, sources, subscribed = Subscription.objects._subscription_keys([self.sub_e1, self.sub_e2])
+        self.assertEqual(entity_ids, [self.sub_e1.id, self.sub_e2.id])
+        self.assertIsNone(sources)
+        self.assertEqual(subscribed, set([
+            (self.sub_e1.id, self.source.id, self.medium.id),
+            (self.sub_e2.id, self.source.id, self.medium.id),
+        ]))
+
+    def test_filter_not_subscribed(self, binds_id_arrays_mock):
+        entities = [self.sub_e1, self.sub_e2.id]
+        entity_ids = Subscription.objects.filter_not_subscribed(self.source, self.medium, entities, ids=True)
+        self.assertEqual(entity_ids, frozenset([self.sub_e1.id]))
+        self.assertEqual(list(Subscription.objects.filter_not_subscribed(self.source, self.medium, entities)), [
+            self.sub_e1
+        ])
+
+    def test_duplicate_ids(self, binds_id_arrays_mock):
+        G(Unsubscribe, entity=self.sub_e1, medium=self.medium, source=self.source)
+        duplicates = [
+            G(Unsubscribe, entity=entity, medium=self.medium, source=self.source).id
+            for entity in [self.sub_e1, self.sub_e2]
+        ]
+        self.assertEqual(sorted(redundancy.duplicate_unsubscribe_ids()), duplicates)
+
+    def test_uncovered_keys(self, binds_id_arrays_mock):
+        medium = G(Medium)
+        uncovered = deltas._uncovered_keys(
+            [self.sub_e1.id, self.sub_e2.id], set([(self.source.id, self.medium.id), (self.source.id, medium.id)])
+        )
+        self.assertEqual(uncovered, set([
+            (self.sub_e1.id, self.source.id, medium.id), (self.sub_e2.id, self.source.id, medium.id),
+        ]))
+
+
+class SplitDatabasesTest(TestCase):
+    def test_single_database(self):
+        self.assertFalse(utils.split_databases())
+
+    def test_subquery(self):
+        queryset = Entity.objects.values_list('id', flat=True)
+        self.assertIs(utils.subquery(queryset), queryset)
+        with patch('entity_subscription.utils.split_databases', return_value=True):
+            entity = G(Entity)
+            self.assertEqual(utils.subquery(queryset), [entity.id])
+
+
+class SubscriptionConnectionTest(TestCase):
+    def test_proxies_routed_connection(self):
+        self.assertEqual(utils.subscription_connection.alias, connection.alias)
+        utils.subscription_connection.entity_subscription_test = True
+        self.assertTrue(connection.entity_subscription_test)
+        del utils.subscription_connection.entity_subscription_test
+        self.assertFalse(hasattr(connection, 'entity_subscription_test'))
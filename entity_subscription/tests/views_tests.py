@@ -0,0 +1,132 @@
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django_dynamic_fixture import G
+from entity.models import Entity, EntityRelationship, EntityKind
+from mock import patch
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+
+
+class CheckSubscriptionsTest(TestCase):
+    def setUp(self):
+        self.ek = G(EntityKind)
+        self.other_ek = G(EntityKind)
+        self.medium_1 = G(Medium)
+        self.medium_2 = G(Medium)
+        self.source_1 = G(Source)
+        self.source_2 = G(Source)
+        self.super_e = G(Entity)
+        self.sub_e1 = G(Entity, entity_kind=self.ek)
+        self.sub_e2 = G(Entity, entity_kind=self.ek)
+        self.other_e = G(Entity, entity_kind=self.other_ek)
+        self.ind_e = G(Entity, entity_kind=self.ek)
+        G(EntityRelationship, sub_entity=self.sub_e1, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.sub_e2, super_entity=self.super_e)
+        G(EntityRelationship, sub_entity=self.other_e, super_entity=self.super_e)
+        G(Subscription, entity=self.super_e, medium=self.medium_1, source=self.source_1, subentity_kind=self.ek)
+        G(Subscription, entity=self.other_e, medium=self.medium_1, source=self.source_1, subentity_kind=None)
+        G(Subscription, entity=self.ind_e, medium=self.medium_2, source=self.source_1, subentity_kind=None)
+        G(Unsubscribe, entity=self.sub_e2, medium=self.medium_1, source=self.source_1)
+
+    def post(self, body):
+        return self.client.post(
+            reverse('entity_subscription_check'), json.dumps(body), content_type='application/json'
+        )
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    def test_checks(self):
+        checks = [
+            (source, medium, entity)
+            for source in [self.source_1, self.source_2]
+            for medium in [self.medium_1, self.medium_2]
+            for entity in [self.sub_e1, self.sub_e2, self.ind_e]
+        ]
+        response = self.post({'checks': [
+            {'source': source.name, 'medium': medium.id, 'entity': entity.id} for source, medium, entity in checks
+        ]})
+        expected = [Subscription.objects.is_subscribed(*check) for check in checks]
+        self.assertEqual(self.content(response), {'results': expected})
+        self.assertEqual(expected.count(True), 2)
+
+    def test_number_of_queries(self):
+        checks = [
+            {'source': self.source_1.name, 'medium': self.medium_1.name, 'entity': entity.id}
+            for entity in [self.sub_e1, self.sub_e2, self.other_e, self.ind_e]
+        ]
+        with self.assertNumQueries(6):
+            response = self.post({'checks': checks})
+            self.assertEqual(self.content(response), {'results': [True, False, True, False]})
+
+    def test_no_checks(self):
+        with self.assertNumQueries(0):
+            response = self.post({'checks': []})
+            self.assertEqual(self.content(response), {'results': []})
+
+    def test_audience_of_entities(self):
+        entities = [self.ind_e.id, self.other_e.id, self.sub_e2.id, self.sub_e1.id]
+        audience = {'source': self.source_1.id, 'medium': self.medium_1.name, 'entities': entities}
+        response = self.post({'audience': audience})
+        self.assertEqual(self.content(response), {'entities': [self.other_e.id, self.sub_e1.id]})
+
+    def test_audience_of_super_entity(self):
+        audience = {'source': self.source_1.id, 'medium': self.medium_1.id, 'super_entity': self.super_e.id}
+        response = self.post({'audience': audience})
+        self.assertEqual(self.content(response), {'entities': [self.sub_e1.id, self.other_e.id]})
+
+        audience['subentity_kind'] = self.ek.name
+        response = self.post({'audience': audience})
+        self.assertEqual(self.content(response), {'entities': [self.sub_e1.id]})
+
+    @patch('entity_subscription.views.STREAM_CHUNK_SIZE', 2)
+    def test_streamed_in_chunks(self):
+        checks = [{'source': self.source_1.id, 'medium': self.medium_1.id, 'entity': self.sub_e1.id}] * 5
+        response = self.post({'checks': checks})
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(json.loads(b''.join(chunks).decode('utf-8')), {'results': [True] * 5})
+
+    @patch('entity_subscription.views.STREAM_CHUNK_SIZE', 2)
+    def test_chunks_resolved_as_streamed(self):
+        entities = [self.sub_e2.id, self.ind_e.id, self.other_e.id, self.sub_e1.id]
+        audience = {'source': self.source_1.id, 'medium': self.medium_1.id, 'entities': entities}
+        effective_subscriptions = Subscription.objects._effective_subscriptions
+        with patch.object(
+            Subscription.objects, '_effective_subscriptions', wraps=effective_subscriptions
+        ) as effective_subscriptions_mock:
+            response = self.post({'audience': audience})
+            chunks = iter(response.streaming_content)
+            self.assertEqual(next(chunks), b'{"entities": [')
+            self.assertEqual(effective_subscriptions_mock.call_count, 0)
+            self.assertEqual(next(chunks), '{0}, {1}'.format(self.other_e.id, self.sub_e1.id).encode('utf-8'))
+            self.assertEqual(effective_subscriptions_mock.call_count, 2)
+            self.assertEqual(list(chunks), [b']}'])
+
+    def test_post_required(self):
+        self.assertEqual(self.client.get(reverse('entity_subscription_check')).status_code, 405)
+
+    def test_bad_requests(self):
+        check = {'source': self.source_1.id, 'medium': self.medium_1.id, 'entity': self.sub_e1.id}
+        bodies = [
+            ([], 'Expected an object with "checks" or "audience".'),
+            ({'checks': check}, '"checks" must be a list.'),
+            ({'checks': [dict(check, source='unknown')]}, 'Unknown source name: unknown'),
+            ({'checks': [dict(check, entity='1')]}, 'Expected an integer id, got "1".'),
+            ({'checks': [dict(check, medium=True)]}, 'Expected an integer id, got true.'),
+            ({'audience': {'source': self.source_1.id}}, 'Missing "medium".'),
+            ({'audience': dict(check, entities=1)}, '"entities" must be a list.'),
+        ]
+        for body, error in bodies:
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content.decode('utf-8')), {'error': error})
+
+    def test_invalid_json(self):
+        response = self.client.post(reverse('entity_subscription_check'), '{', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
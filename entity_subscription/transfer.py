@@ -0,0 +1,204 @@
+"""Bulk export and import of subscription state as CSV.
+
+Rows are written and read as CSV without a header. Entities are given
+by id, while sources, mediums and entity kinds are given by name, with
+an empty field for a null wildcard or an individual subscription:
+
+- `Subscription` rows: entity, source, medium, subentity kind.
+- `Unsubscribe` rows: entity, source, medium.
+- Effective subscriptions: entity, source, medium.
+
+On PostgreSQL, raw rows are copied with `COPY`, otherwise they are
+streamed through the ORM or inserted with batched `executemany`
+calls. Either way, memory use does not grow with the number of rows.
+"""
+import csv
+import itertools
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import six
+from django.utils.encoding import force_text
+from entity.models import Entity, EntityKind
+
+from entity_subscription.models import Medium, Source, Subscription, Unsubscribe
+from entity_subscription.signals import preferences_changed
+from entity_subscription.utils import id_chunks, id_list, subscription_connection as connection
+
+
+# Number of validation errors reported before an import gives up.
+MAX_ERRORS = 10
+
+
+def uses_copy():
+    """Return True if rows are copied with PostgreSQL's `COPY`.
+    """
+    return connection.vendor == 'postgresql'
+
+
+def open_csv(path, mode='r'):
+    """Open a file for the csv module, which reads and writes bytes on Python 2.
+    """
+    return open(path, mode + ('b' if six.PY2 else ''))
+
+
+def transfer_models():
+    return {'subscription': Subscription, 'unsubscribe': Unsubscribe}
+
+
+def _name_models(model):
+    """Return the models of the fields given by name, after the entity, in column order.
+    """
+    models = [('source', Source), ('medium', Medium)]
+    if model is Subscription:
+        models.append(('subentity_kind', EntityKind))
+    return models
+
+
+def export_rows(model, output):
+    """Write every `Subscription` or `Unsubscribe` row to a file as CSV.
+    """
+    fields = ['entity'] + ['{0}__name'.format(field) for field, _ in _name_models(model)]
+    queryset = model.objects.order_by('id').values_list(*fields)
+    if uses_copy():
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.copy_expert('COPY ({0}) TO STDOUT WITH CSV'.format(force_text(cursor.mogrify(sql, params))), output)
+    else:
+        csv.writer(output).writerows(_csv_row(row) for row in queryset.iterator())
+
+
+def export_effective(output, chunk_size=1000):
+    """Write the effective subscription of every entity to every source and medium as CSV.
+
+    Entities are resolved `chunk_size` at a time, each chunk with the
+    fixed number of queries of the bulk subscription resolution.
+    """
+    from entity_subscription.mirror import _candidate_entity_ids, _chunks
+
+    source_names = dict(Source.objects.values_list('id', 'name'))
+    medium_names = dict(Medium.objects.values_list('id', 'name'))
+    writer = csv.writer(output)
+    for source_id in sorted(source_names):
+        for chunk in _chunks(sorted(_candidate_entity_ids(source_id)), chunk_size):
+            keys = Subscription.objects._effective_subscriptions(chunk, [source_id])
+            writer.writerows(
+                _csv_row((entity_id, source_names[source_id], medium_names[medium_id]))
+                for entity_id, source_id, medium_id in sorted(keys)
+            )
+
+
+def import_rows(model, input, batch_size=10000, replace=False):
+    """Load `Subscription` or `Unsubscribe` rows from a CSV file, as written by `export_rows`.
+
+    Rows are validated and written `batch_size` at a time, all in one
+    transaction, so nothing is loaded if any row is invalid. With
+    `replace`, every existing row of the model is deleted first.
+
+    Rows are written without sending model signals. Instead, once the
+    rows are loaded, `preferences_changed` is sent for every entity
+    whose rows were added or deleted, if it has any receivers, so the
+    unsubscribe filter and the Redis mirror stay up to date. The
+    changes are kept in memory until then.
+
+    Raises:
+
+      ValueError - listing the first invalid rows, with their line
+      numbers.
+
+    Returns:
+
+      The number of rows loaded.
+    """
+    name_models = _name_models(model)
+    ids_by_name = [dict(name_model.objects.values_list('name', 'id')) for _, name_model in name_models]
+    fields = [field for field, _ in name_models]
+    columns = [model._meta.get_field(field).column for field in ['entity'] + fields]
+    rows = csv.reader(input)
+    notify = preferences_changed.has_listeners(model)
+    changes = defaultdict(lambda: (set(), set()))
+    loaded = 0
+    with transaction.atomic(using=connection.alias):
+        if replace:
+            if notify:
+                _record_changes(changes, 1, model.objects.values_list(*['entity'] + fields).iterator())
+            connection.cursor().execute('DELETE FROM {0}'.format(connection.ops.quote_name(model._meta.db_table)))
+        for batch in iter(lambda: list(itertools.islice(rows, batch_size)), []):
+            resolved = _resolve(batch, loaded + 1, name_models, ids_by_name)
+            _write(model._meta.db_table, columns, resolved)
+            if notify:
+                _record_changes(changes, 0, resolved)
+            loaded += len(batch)
+    for key, (added, removed) in changes.items():
+        lookups = dict(zip(['entity', 'subentity_kind'], key))
+        preferences_changed.send(sender=model, added=added, removed=removed, **lookups)
+    return loaded
+
+
+def _record_changes(changes, index, rows):
+    """Add the (source, medium) pairs of rows to the pairs added, or removed, for their entity.
+
+    Rows hold an entity, source, medium and, for subscriptions, a
+    subentity kind, which is part of the key the pairs are kept under.
+    """
+    for row in rows:
+        changes[(row[0],) + tuple(row[3:])][index].add((row[1], row[2]))
+
+
+def _resolve(batch, first_line, name_models, ids_by_name):
+    """Return the rows of a batch with names replaced by ids, checking every entity exists.
+    """
+    errors, resolved = [], []
+    for line, row in enumerate(batch, first_line):
+        row = [force_text(value) for value in row]
+        if len(row) != len(name_models) + 1 or not row[0].isdigit():
+            errors.append((line, u'expected an entity id and {0} names'.format(len(name_models))))
+            continue
+        values = [int(row[0])]
+        for (field, _), ids, name in zip(name_models, ids_by_name, row[1:]):
+            if name and name not in ids:
+                errors.append((line, u'unknown {0} "{1}"'.format(field.replace('_', ' '), name)))
+            values.append(ids.get(name))
+        resolved.append((line, values))
+
+    missing_entity_ids = set(row_values[0] for line, row_values in resolved)
+    for chunk in id_chunks(list(missing_entity_ids), Entity):
+        missing_entity_ids -= set(Entity.objects.filter(id__in=id_list(chunk, Entity)).values_list('id', flat=True))
+    errors.extend(
+        (line, u'unknown entity {0}'.format(row_values[0]))
+        for line, row_values in resolved if row_values[0] in missing_entity_ids
+    )
+    if errors:
+        raise ValueError(u'\n'.join(
+            u'line {0}: {1}'.format(line, error) for line, error in sorted(errors)[:MAX_ERRORS]
+        ))
+    return [row_values for line, row_values in resolved]
+
+
+def _write(table, columns, rows):
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    if uses_copy():
+        buffer = six.StringIO()
+        csv.writer(buffer).writerows(_csv_row(row) for row in rows)
+        buffer.seek(0)
+        cursor.copy_expert('COPY {0} ({1}) FROM STDIN WITH CSV'.format(
+            qn(table), ', '.join(qn(column) for column in columns)
+        ), buffer)
+    else:
+        cursor.executemany('INSERT INTO {0} ({1}) VALUES ({2})'.format(
+            qn(table), ', '.join(qn(column) for column in columns), ', '.join(['%s'] * len(columns))
+        ), rows)
+
+
+def _csv_row(row):
+    """Return the fields of a CSV row, with None written as an empty field.
+    """
+    return ['' if value is None else _csv_value(value) for value in row]
+
+
+def _csv_value(value):
+    # The csv module of Python 2 only writes byte strings.
+    if six.PY2 and isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return value
@@ -0,0 +1,7 @@
+from django.conf.urls import patterns, url
+
+
+urlpatterns = patterns(
+    'entity_subscription.views',
+    url(r'^check/$', 'check_subscriptions', name='entity_subscription_check'),
+)
@@ -0,0 +1,133 @@
+from django.db import connections, models, router
+
+
+# Entity ids per query on backends that can not bind an id list as a
+# single parameter. Stays below SQLite's default limit of 999 bound
+# variables per statement.
+ID_CHUNK_SIZE = 400
+
+
+def get_id(obj):
+    """Return the primary key of a model instance, or the id itself.
+
+    Lets manager methods accept either model instances or raw integer
+    ids, without triggering any query.
+    """
+    return obj.pk if isinstance(obj, models.Model) else obj
+
+
+class IdArray(object):
+    """A list of ids bound as a single PostgreSQL array parameter.
+
+    Used as the value of an `__in` lookup, it compiles to
+    `IN (SELECT unnest(%s::integer[]))`, with the ids sent as one
+    array literal. The SQL text is then the same however many ids
+    there are. Lookups through a foreign key must name the target
+    column, as in `entity__id__in`, for Django to treat it as a
+    subquery.
+    """
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def _prepare(self):
+        return self
+
+    def _as_sql(self, connection):
+        return 'SELECT unnest(%s::integer[])', ['{' + ','.join(str(int(i)) for i in self.ids) + '}']
+
+
+class _SubscriptionConnection(object):
+    """The connection to the database the subscription tables are routed to.
+
+    Like `django.db.connection` for the default database, it looks up
+    the connection on every use, so each thread uses its own.
+    """
+    def __getattr__(self, name):
+        return getattr(connections[_database()], name)
+
+    def __setattr__(self, name, value):
+        setattr(connections[_database()], name, value)
+
+    def __delattr__(self, name):
+        delattr(connections[_database()], name)
+
+
+def _database(model=None):
+    """Return the alias of the database a model, by default `Subscription`, is read from.
+    """
+    if model is None:
+        from entity_subscription.models import Subscription
+
+        model = Subscription
+    return router.db_for_read(model)
+
+
+# Used for backend-specific SQL on the subscription tables, in place
+# of the default connection.
+subscription_connection = _SubscriptionConnection()
+
+
+def binds_id_arrays(model=None):
+    """Return True if a model's database accepts an `IdArray` in `__in` lookups.
+
+    By default, the database of the subscription tables.
+    """
+    return connections[_database(model)].vendor == 'postgresql'
+
+
+def id_list(ids, model=None):
+    """Return entity ids in the form to pass to an `__in` lookup on a model.
+
+    An `IdArray` if the model's database, by default the one of the
+    subscription tables, is PostgreSQL, a plain list otherwise.
+    """
+    return IdArray(ids) if binds_id_arrays(model) else list(ids)
+
+
+def id_chunks(ids, model=None):
+    """Return id lists small enough to bind in a single query on a model.
+
+    All the ids in one list on PostgreSQL, where they are bound as a
+    single array parameter, chunks of `ID_CHUNK_SIZE` elsewhere. With
+    no model, the chunks must fit queries on both the subscription and
+    the entity tables.
+    """
+    from entity.models import Entity
+
+    ids = list(ids)
+    if model is None:
+        binds = binds_id_arrays() and binds_id_arrays(Entity)
+    else:
+        binds = binds_id_arrays(model)
+    if binds or len(ids) <= ID_CHUNK_SIZE:
+        return [ids]
+    return [ids[i:i + ID_CHUNK_SIZE] for i in range(0, len(ids), ID_CHUNK_SIZE)]
+
+
+def split_databases():
+    """Return True if subscriptions and entities are routed to different databases.
+
+    Subqueries and joins between the two sets of tables can then not
+    run; ids are fetched from one database and passed to the other
+    instead.
+    """
+    from entity.models import Entity
+    from entity_subscription.models import Subscription
+
+    return router.db_for_read(Subscription) != router.db_for_read(Entity)
+
+
+def subquery(queryset):
+    """Return a flat `values_list` queryset in the form to use in an `__in` lookup on the other set of tables.
+
+    The queryset itself, run as a subquery, on a single database. Its
+    values, fetched with one query, when subscriptions and entities are
+    on different databases.
+    """
+    return list(queryset) if split_databases() else queryset
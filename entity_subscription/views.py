@@ -0,0 +1,135 @@
+"""JSON views answering subscription checks for services outside of Django.
+
+The views are enabled by including `entity_subscription.urls` in a
+project's url configuration. They do no authentication of their own,
+so they should only be routed where the calling services are trusted,
+or wrapped in the project's own access checks.
+"""
+import json
+
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import six
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from entity.models import EntityKind, EntityRelationship
+
+from entity_subscription.models import Medium, Source, Subscription
+
+
+# Number of results serialized per chunk of a streamed response.
+STREAM_CHUNK_SIZE = 1000
+
+
+@csrf_exempt
+@require_POST
+def check_subscriptions(request):
+    """Answer a batch of subscription checks, or an audience request, posted as JSON.
+
+    A body of `{"checks": [{"entity": 1, "source": "news", "medium":
+    "email"}, ...]}` is answered with `{"results": [true, ...]}`, one
+    Boolean per check in the order given.
+
+    A body of `{"audience": {"source": "news", "medium": "email",
+    "entities": [1, 2, ...]}}` is answered with `{"entities": [...]}`,
+    the ids of the given entities subscribed to the source and medium.
+    In place of `entities`, `super_entity` and an optional
+    `subentity_kind` check the sub-entities of a super-entity.
+
+    Sources, mediums and entity kinds may be given by name or by id.
+    The checks are resolved `STREAM_CHUNK_SIZE` at a time, in a fixed
+    number of queries per chunk, and each chunk of results is streamed
+    back as soon as it is resolved. Malformed requests are answered with
+    a 400 response and an `error` message, before any check is resolved.
+    """
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+        if isinstance(body, dict) and 'checks' in body:
+            key, values = 'results', _check(body['checks'])
+        elif isinstance(body, dict) and 'audience' in body:
+            key, values = 'entities', _audience(body['audience'])
+        else:
+            raise ValueError('Expected an object with "checks" or "audience".')
+    except ValueError as error:
+        return HttpResponseBadRequest(json.dumps({'error': str(error)}), content_type='application/json')
+    return StreamingHttpResponse(_stream(key, values), content_type='application/json')
+
+
+def _check(checks):
+    if not isinstance(checks, list):
+        raise ValueError('"checks" must be a list.')
+    entity_ids = [_integer(_field(check, 'entity')) for check in checks]
+    source_ids = _ids(Source, [_field(check, 'source') for check in checks])
+    medium_ids = _ids(Medium, [_field(check, 'medium') for check in checks])
+    return _check_results(list(zip(entity_ids, source_ids, medium_ids)))
+
+
+def _check_results(keys):
+    """Yield the results of (entity, source, medium) checks, resolving a chunk of them at a time.
+    """
+    for start in range(0, len(keys), STREAM_CHUNK_SIZE):
+        chunk = keys[start:start + STREAM_CHUNK_SIZE]
+        subscribed = Subscription.objects._effective_subscriptions(
+            list(set(entity_id for entity_id, _, _ in chunk)), set(source_id for _, source_id, _ in chunk)
+        )
+        yield [key in subscribed for key in chunk]
+
+
+def _audience(audience):
+    [source_id] = _ids(Source, [_field(audience, 'source')])
+    [medium_id] = _ids(Medium, [_field(audience, 'medium')])
+    if 'super_entity' in audience:
+        relationships = EntityRelationship.objects.filter(super_entity=_integer(audience['super_entity']))
+        if audience.get('subentity_kind') is not None:
+            [entity_kind_id] = _ids(EntityKind, [audience['subentity_kind']])
+            relationships = relationships.filter(sub_entity__entity_kind=entity_kind_id)
+        entity_ids = list(relationships.order_by('sub_entity').values_list('sub_entity', flat=True))
+    else:
+        entities = _field(audience, 'entities')
+        if not isinstance(entities, list):
+            raise ValueError('"entities" must be a list.')
+        entity_ids = [_integer(entity) for entity in entities]
+    return _audience_results(entity_ids, source_id, medium_id)
+
+
+def _audience_results(entity_ids, source_id, medium_id):
+    """Yield the entities subscribed to a source and medium, resolving a chunk of them at a time.
+    """
+    for start in range(0, len(entity_ids), STREAM_CHUNK_SIZE):
+        chunk = entity_ids[start:start + STREAM_CHUNK_SIZE]
+        subscribed = Subscription.objects._effective_subscriptions(chunk, [source_id])
+        yield [entity_id for entity_id in chunk if (entity_id, source_id, medium_id) in subscribed]
+
+
+def _stream(key, chunks):
+    """Yield the JSON of an object holding a single list, as each chunk of the list is produced.
+    """
+    yield '{{{0}: ['.format(json.dumps(key))
+    separator = ''
+    for chunk in chunks:
+        if chunk:
+            yield separator + ', '.join(json.dumps(value) for value in chunk)
+            separator = ', '
+    yield ']}'
+
+
+def _field(obj, name):
+    if not isinstance(obj, dict) or name not in obj:
+        raise ValueError('Missing "{0}".'.format(name))
+    return obj[name]
+
+
+def _integer(value):
+    if isinstance(value, bool) or not isinstance(value, six.integer_types):
+        raise ValueError('Expected an integer id, got {0}.'.format(json.dumps(value)))
+    return value
+
+
+def _ids(model, values):
+    """Return the ids of objects given by name or id, fetching every name in one query.
+    """
+    names = set(value for value in values if isinstance(value, six.string_types))
+    ids_by_name = dict(model.objects.filter(name__in=names).values_list('name', 'id')) if names else {}
+    missing = names - set(ids_by_name)
+    if missing:
+        raise ValueError('Unknown {0} name: {1}'.format(model._meta.verbose_name, ', '.join(sorted(missing))))
+    return [ids_by_name[value] if isinstance(value, six.string_types) else _integer(value) for value in values]
@@ -26,7 +26,7 @@ setup(
     author='Erik Swanson',
     author_email='opensource@ambition.com',
     keywords='',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     classifiers=[
         'Programming Language :: Python',
         'Intended Audience :: Developers',
@@ -38,12 +38,17 @@ setup(
     install_requires=[
         'django>=1.6,<1.7',
         'django-entity>=1.5.0',
+        'django-manager-utils>=0.5.5',
     ],
+    extras_require={
+        'redis': ['redis'],
+    },
     tests_require=[
         'django-dynamic-fixture ',
         'django-nose',
         'south',
         'mock',
+        'fakeredis',
     ],
     test_suite='run_tests.run_tests',
     include_package_data=True,